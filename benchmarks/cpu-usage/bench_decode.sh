@@ -0,0 +1,91 @@
+#!/bin/bash
+
+# Before/after benchmark of the monitor decoders: replays the same traces
+# through the byte-at-a-time decoder (monitor_scalar, FAST_SCAN=0) and the
+# default one (PAD skip + PTWRITE batching) and reports the decode time.
+#
+# Usage: ./bench_decode.sh [sidestack|sidecfi|all] [trace.bin [binary]]
+#
+# Without a trace, synthetic ones are generated with gen_trace.py at a few
+# PAD densities. A trace recorded with `monitor -o` can be passed instead;
+# for SideCFI, binary is the program whose <binary>.tp(b) typemap to use.
+
+SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
+
+MODE=${1:-all}
+TRACE=$2
+BINARY=$3
+
+TRACE_SIZE=$((32 << 20))
+PAD_MEANS="0 4 64"
+
+WORK_DIR="$SCRIPT_DIR/decode-bench"
+
+function build_monitors {
+    mode=$1
+
+    echo "Building the $mode monitors..."
+    if ! make -C "$SCRIPT_DIR/$mode" monitor monitor_scalar > /dev/null 2>&1; then
+        echo "Error: Failed to build the $mode monitors."
+        exit 1
+    fi
+}
+
+function decode_time {
+    # Decode time of one replay, with the trace loaded in memory first
+    "$@" -l | awk '/Decode time/ {print $4}'
+}
+
+function run_trace {
+    mode=$1
+    trace=$2
+    typemap_args=()
+
+    if [[ "$mode" == "sidecfi" && -n "$3" ]]; then
+        typemap_args=(-t "$3")
+    fi
+
+    scalar=$(decode_time "$SCRIPT_DIR/$mode/monitor_scalar" -r "$trace" "${typemap_args[@]}")
+    fast=$(decode_time "$SCRIPT_DIR/$mode/monitor" -r "$trace" "${typemap_args[@]}")
+
+    if [[ -z "$scalar" || -z "$fast" ]]; then
+        echo "Error: Failed to replay $trace."
+        exit 1
+    fi
+
+    printf "%-10s %-40s %12s %12s %8s\n" "$mode" "$(basename "$trace")" \
+        "$scalar" "$fast" "$(awk -v a="$scalar" -v b="$fast" 'BEGIN {printf "%.2fx", a / b}')"
+}
+
+function bench_mode {
+    mode=$1
+
+    build_monitors "$mode"
+
+    if [[ -n "$TRACE" ]]; then
+        run_trace "$mode" "$TRACE" "$BINARY"
+        return
+    fi
+
+    mkdir -p "$WORK_DIR"
+    for pad in $PAD_MEANS; do
+        trace="$WORK_DIR/$mode-pad$pad.bin"
+        python3 "$SCRIPT_DIR/gen_trace.py" "$mode" "$trace" --size "$TRACE_SIZE" \
+            --pad-mean "$pad" --typemap "$WORK_DIR/$mode-pad$pad" 2> /dev/null
+        run_trace "$mode" "$trace" "$WORK_DIR/$mode-pad$pad"
+    done
+}
+
+if [[ "$MODE" != "sidestack" && "$MODE" != "sidecfi" && "$MODE" != "all" ]]; then
+    echo "Usage: $0 [sidestack|sidecfi|all] [trace.bin [binary]]"
+    exit 1
+fi
+
+printf "%-10s %-40s %12s %12s %8s\n" "monitor" "trace" "scalar (s)" "fast (s)" "speedup"
+
+if [[ "$MODE" == "all" ]]; then
+    bench_mode sidestack
+    bench_mode sidecfi
+else
+    bench_mode "$MODE"
+fi
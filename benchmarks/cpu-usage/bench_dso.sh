@@ -0,0 +1,56 @@
+#!/bin/bash
+
+# Replays a synthetic SideCFI trace that keeps dlopen'ing and dlclose'ing a
+# plugin-style DSO, once with the text typemaps (.tp) and once with the
+# binary ones (.tpb), and reports the decode time and the DSO load/unload
+# counts of the monitor.
+#
+# Usage: ./bench_dso.sh [dso_cycle] [plugin_targets] [trace_size]
+
+SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
+
+DSO_CYCLE=${1:-200}
+PLUGIN_TARGETS=${2:-20000}
+TRACE_SIZE=${3:-$((8 << 20))}
+PLUGIN_BASE=0x7f0000000000
+
+WORK_DIR="$SCRIPT_DIR/dso-bench"
+MONITOR="$SCRIPT_DIR/sidecfi/monitor"
+
+function build_monitor {
+    echo "Building the SideCFI monitor..."
+    if ! make -C "$SCRIPT_DIR/sidecfi" monitor > /dev/null; then
+        echo "Error: Failed to build $MONITOR."
+        exit 1
+    fi
+}
+
+function gen_inputs {
+    mkdir -p "$WORK_DIR"
+    echo "Generating trace: ${TRACE_SIZE} bytes, plugin cycled every ${DSO_CYCLE} checks..."
+    python3 "$SCRIPT_DIR/gen_trace.py" sidecfi "$WORK_DIR/trace.bin" \
+        --size "$TRACE_SIZE" \
+        --typemap "$WORK_DIR/main" \
+        --plugin-typemap "$WORK_DIR/plugin" \
+        --plugin-targets "$PLUGIN_TARGETS" \
+        --dso-cycle "$DSO_CYCLE"
+}
+
+function run_replay {
+    label=$1
+
+    echo "== $label =="
+    "$MONITOR" -r "$WORK_DIR/trace.bin" -t "$WORK_DIR/main" \
+        -p "$WORK_DIR/plugin" -P "$PLUGIN_BASE" -l |
+        grep -E "Decode time|PTWRITE/s|DSO (loads|unloads)"
+}
+
+build_monitor
+gen_inputs
+
+# The monitor prefers <binary>.tpb when it exists
+rm -f "$WORK_DIR/main.tpb" "$WORK_DIR/plugin.tpb"
+run_replay "text typemap (.tp)"
+
+python3 "$SCRIPT_DIR/../../tools/gen_tpb.py" "$WORK_DIR/main" "$WORK_DIR/plugin" > /dev/null
+run_replay "binary typemap (.tpb)"
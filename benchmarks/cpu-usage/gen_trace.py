@@ -0,0 +1,333 @@
+import argparse
+import os
+import random
+import re
+import struct
+import sys
+
+# Synthetic Intel PT byte streams for the SideStack and SideCFI monitors.
+#
+# The output can be fed to `monitor -r <trace>` to benchmark or fuzz the
+# decoders without PTWRITE hardware.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+opcodes_path = os.path.join(script_dir, "sidestack/pt_opcodes.h")
+
+# SideStack PTWRITE opcodes (top two bits of the 32-bit payload)
+SIDESTACK_PUSH = 0x0
+SIDESTACK_CTX = 0x1
+SIDESTACK_POP = 0x3
+
+# Context IDs of the generated SideStack threads/processes
+CTX_TID_BASE = 1000
+CTX_CR3_BASE = 0x10000000
+
+# SideCFI PTWRITE opcodes (top two bits of the 64-bit payload)
+SIDECFI_CHECK = 0x1
+SIDECFI_DLOPEN = 0x2
+
+# Bit 61 of a SideCFI dlopen PTWRITE: 0 for dlopen, 1 for dlclose
+SIDECFI_DLCLOSE_BIT = 1 << 61
+
+# Fake dlopen handles used for the plugin load/unload cycle
+PLUGIN_HANDLE_BASE = 0x55550000
+
+# Keep generated code addresses in a non-PIE text segment
+TEXT_BASE = 0x400000
+TEXT_SIZE = 0x800000
+
+
+def parse_opcodes(path):
+    # Evaluate the enum constants of pt_opcodes.h in declaration order
+    consts = {}
+    enum_re = re.compile(r"^\s*(pt\w+)\s*=\s*([^,/]+?)\s*,?\s*(/\*.*)?$")
+    with open(path, "r") as f:
+        for line in f:
+            m = enum_re.match(line)
+            if not m:
+                continue
+            name, expr = m.group(1), m.group(2)
+            try:
+                consts[name] = eval(expr, {"__builtins__": {}}, consts)
+            except NameError:
+                # Refers to a constant we do not know about; not needed here
+                continue
+    return consts
+
+
+class TraceWriter:
+    def __init__(self, opc, rng, args):
+        self.opc = opc
+        self.rng = rng
+        self.args = args
+        self.chunks = []
+        self.size = 0
+        self.last_psb = 0
+        self.stats = {
+            "pad": 0,
+            "psb": 0,
+            "cbr": 0,
+            "ptw": 0,
+            "straddle": 0,
+            "dlopen": 0,
+            "dlclose": 0,
+            "switch": 0,
+        }
+
+        ext = opc["pt_opc_ext"]
+        ptw = opc["pt_ext_ptw"]
+        pb_shr = opc["pt_opm_ptw_pb_shr"]
+
+        # Pre-built packet headers
+        self.psb_bytes = bytes([ext, opc["pt_ext_psb"]]) * (
+            opc["pt_psb_repeat_count"] + 1
+        )
+        self.psbend_bytes = bytes([ext, opc["pt_ext_psbend"]])
+        self.cbr_hdr = bytes([ext, opc["pt_ext_cbr"]])
+        self.pip_hdr = bytes([ext, opc["pt_ext_pip"]])
+        self.ptw32_hdr = bytes([ext, ptw | (0 << pb_shr)])
+        self.ptw64_hdr = bytes([ext, ptw | (1 << pb_shr)])
+
+    def emit(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def pad(self, n):
+        if n > 0:
+            self.emit(bytes(n))
+            self.stats["pad"] += n
+
+    def psb(self):
+        self.emit(self.psb_bytes)
+        self.emit(self.psbend_bytes)
+        self.stats["psb"] += 1
+        self.last_psb = self.size
+
+    def cbr(self):
+        self.emit(self.cbr_hdr + bytes([self.rng.randint(8, 60), 0]))
+        self.stats["cbr"] += 1
+
+    def filler(self):
+        # Padding, periodic PSB+PSBEND and CBR between two PTWRITEs
+        args = self.args
+        if args.pad_mean:
+            self.pad(self.rng.randint(0, 2 * args.pad_mean))
+        if args.psb_interval and self.size - self.last_psb >= args.psb_interval:
+            self.psb()
+        if args.cbr_rate and self.rng.random() < args.cbr_rate:
+            self.cbr()
+
+    def pip(self, cr3):
+        payload = (cr3 >> self.opc["pt_pl_pip_shl"]) << self.opc["pt_pl_pip_shr"]
+        self.emit(self.pip_hdr + payload.to_bytes(self.opc["pt_pl_pip_size"], "little"))
+
+    def ptw(self, packet):
+        # Optionally move the packet so it crosses the next buffer boundary
+        page = self.args.straddle
+        if page:
+            boundary = (self.size // page + 1) * page
+            if boundary - self.size <= self.args.straddle_window:
+                cut = self.rng.randint(1, len(packet) - 1)
+                self.pad(boundary - cut - self.size)
+                self.stats["straddle"] += 1
+        self.emit(packet)
+        self.stats["ptw"] += 1
+
+    def ptw32(self, value):
+        self.ptw(self.ptw32_hdr + struct.pack("<I", value))
+
+    def ptw64(self, value):
+        self.ptw(self.ptw64_hdr + struct.pack("<Q", value))
+
+    def align(self, size):
+        # Pad up to a multiple of size so repeated blocks keep their layout
+        if size and self.size % size:
+            self.pad(size - self.size % size)
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+def random_text_addr(rng):
+    return TEXT_BASE + (rng.randrange(TEXT_SIZE) & ~0x3)
+
+
+def switch_context(tw, args, ctx):
+    # Tell the monitor whose shadow stack the next PTWRITEs belong to
+    if args.context_tag == "pip":
+        tw.pip(CTX_CR3_BASE + ctx * 0x1000)
+    else:
+        tw.ptw32((SIDESTACK_CTX << 30) | (CTX_TID_BASE + ctx))
+    tw.stats["switch"] += 1
+
+
+def gen_sidestack(tw, rng, args):
+    stacks = [[] for _ in range(args.contexts)]
+    ctx = 0
+    if args.contexts > 1:
+        switch_context(tw, args, ctx)
+
+    while tw.size < args.size:
+        if args.contexts > 1 and rng.random() < args.switch_rate:
+            ctx = rng.randrange(args.contexts)
+            switch_context(tw, args, ctx)
+
+        stack = stacks[ctx]
+        depth = len(stack)
+        if depth == 0 or (depth < args.max_depth and rng.random() < args.push_rate):
+            addr = random_text_addr(rng)
+            stack.append(addr)
+            tw.ptw32((SIDESTACK_PUSH << 30) | addr)
+        else:
+            addr = stack.pop()
+            tw.ptw32((SIDESTACK_POP << 30) | addr)
+        tw.filler()
+
+    # Unwind so every block is balanced and can be repeated
+    for ctx, stack in enumerate(stacks):
+        if stack and args.contexts > 1:
+            switch_context(tw, args, ctx)
+        while stack:
+            tw.ptw32((SIDESTACK_POP << 30) | stack.pop())
+            tw.filler()
+
+    # Repeated blocks start in the first context again
+    if args.contexts > 1:
+        switch_context(tw, args, 0)
+
+
+def make_typemap(rng, args):
+    typemap = []
+    addrs = rng.sample(range(TEXT_BASE, TEXT_BASE + TEXT_SIZE, 16),
+                       args.types * args.targets)
+    for t in range(args.types):
+        for k in range(args.targets):
+            typemap.append((t + 1, addrs[t * args.targets + k]))
+    return typemap
+
+
+def make_plugin_typemap(rng, args):
+    # Plugin offsets are relative to its own base, like any DSO typemap
+    offsets = rng.sample(range(0x1000, 0x1000 + args.plugin_targets * 64, 16),
+                         args.plugin_targets)
+    return [(rng.randint(1, args.types), off) for off in offsets]
+
+
+def write_typemap(path, typemap):
+    with open(path, "w") as f:
+        for type_id, addr in typemap:
+            f.write(f"_ZTSsym_{type_id}_{addr:x} {type_id} {addr:x}\n")
+
+
+def gen_sidecfi(tw, rng, args, typemap):
+    checks = 0
+    plugin = None
+    while tw.size < args.size:
+        # dlclose the previous plugin instance and dlopen the next one
+        if args.dso_cycle and checks % args.dso_cycle == 0:
+            if plugin is not None:
+                tw.ptw64((SIDECFI_DLOPEN << 62) | SIDECFI_DLCLOSE_BIT | plugin)
+                tw.stats["dlclose"] += 1
+            plugin = PLUGIN_HANDLE_BASE + ((checks // args.dso_cycle) % 16) * 0x1000
+            tw.ptw64((SIDECFI_DLOPEN << 62) | plugin)
+            tw.stats["dlopen"] += 1
+
+        type_id, addr = rng.choice(typemap)
+        if args.violation_rate and rng.random() < args.violation_rate:
+            addr = random_text_addr(rng) | 0x1
+        tw.ptw64((SIDECFI_CHECK << 62) | (type_id << 48) | (args.base + addr))
+        tw.filler()
+        checks += 1
+
+    # Leave no plugin loaded so every block is balanced
+    if plugin is not None:
+        tw.ptw64((SIDECFI_DLOPEN << 62) | SIDECFI_DLCLOSE_BIT | plugin)
+        tw.stats["dlclose"] += 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic PT trace for monitor -r"
+    )
+    parser.add_argument("mode", choices=["sidestack", "sidecfi"])
+    parser.add_argument("output", help="trace file to write (e.g. trace.bin)")
+    parser.add_argument("--size", type=int, default=16 << 20,
+                        help="bytes of trace per block (default 16MiB)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="write the generated block this many times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pad-mean", type=int, default=4,
+                        help="mean PAD bytes between packets")
+    parser.add_argument("--psb-interval", type=int, default=4096,
+                        help="bytes between PSB+PSBEND (0 disables)")
+    parser.add_argument("--cbr-rate", type=float, default=0.001,
+                        help="probability of a CBR after each PTWRITE")
+    parser.add_argument("--straddle", type=int, default=0, metavar="BUF_SZ",
+                        help="place PTWRITEs across BUF_SZ buffer boundaries")
+    parser.add_argument("--straddle-window", type=int, default=64,
+                        help="distance to a boundary at which to straddle")
+    # SideStack
+    parser.add_argument("--max-depth", type=int, default=64,
+                        help="maximum call depth")
+    parser.add_argument("--push-rate", type=float, default=0.5,
+                        help="probability of a call vs. a return")
+    parser.add_argument("--contexts", type=int, default=1,
+                        help="threads/processes with their own shadow stack")
+    parser.add_argument("--switch-rate", type=float, default=0.01,
+                        help="probability of a context switch before each PTWRITE")
+    parser.add_argument("--context-tag", choices=["tid", "pip"], default="tid",
+                        help="tag contexts with TID PTWRITEs or PIP (CR3) packets")
+    # SideCFI
+    parser.add_argument("--types", type=int, default=256,
+                        help="number of typeIDs in the typemap")
+    parser.add_argument("--targets", type=int, default=16,
+                        help="targets per typeID")
+    parser.add_argument("--violation-rate", type=float, default=0.0,
+                        help="fraction of checks with a target not in the typemap")
+    parser.add_argument("--base", type=lambda x: int(x, 0), default=0,
+                        help="load base added to typemap offsets")
+    parser.add_argument("--typemap", metavar="BINARY",
+                        help="write the typemap to BINARY.tp (SideCFI)")
+    parser.add_argument("--dso-cycle", type=int, default=0, metavar="N",
+                        help="dlclose/dlopen a plugin every N checks (SideCFI)")
+    parser.add_argument("--plugin-typemap", metavar="PLUGIN",
+                        help="write the plugin typemap to PLUGIN.tp (SideCFI)")
+    parser.add_argument("--plugin-targets", type=int, default=4096,
+                        help="entries in the plugin typemap")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    opc = parse_opcodes(opcodes_path)
+    tw = TraceWriter(opc, rng, args)
+
+    # Every block starts with a PSB like a fresh ToPA
+    tw.psb()
+
+    if args.mode == "sidestack":
+        gen_sidestack(tw, rng, args)
+    else:
+        typemap = make_typemap(rng, args)
+        if args.typemap:
+            write_typemap(args.typemap + ".tp", typemap)
+        if args.plugin_typemap:
+            write_typemap(args.plugin_typemap + ".tp", make_plugin_typemap(rng, args))
+        gen_sidecfi(tw, rng, args, typemap)
+
+    tw.align(args.straddle)
+    block = tw.getvalue()
+
+    with open(args.output, "wb") as f:
+        for _ in range(args.repeat):
+            f.write(block)
+
+    total = len(block) * args.repeat
+    print(f"Wrote {total} bytes to {args.output}", file=sys.stderr)
+    for name, count in tw.stats.items():
+        print(f"  {name}: {count * args.repeat}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@
 #include <string.h>
 #include <fcntl.h>
 #include <signal.h>
+#include <poll.h>
 #include <time.h>
 #include <inttypes.h>
 #include <stdbool.h>
@@ -23,12 +24,30 @@
 
 #define CPU_USAGE 1
 
+/* skip PAD bytes in bulk and run the policy on batches of PTWRITEs */
+#ifndef FAST_SCAN
+#define FAST_SCAN 1
+#endif
+
+#if FAST_SCAN
+#define PTW_BATCH			16
+#else
+#define PTW_BATCH			1
+#endif
+
 /* driver defines */
 #define DEVICE_NAME         "/dev/"PTW_DEV_NAME
 #define TRACE_OUT			      "trace.bin"
 #define PKT_OUT				      "ptw_packet.log"
 #define PAGE_SIZE			      sysconf(_SC_PAGE_SIZE)
 #define READ_BUFFER_SIZE	  PAGE_SIZE
+#define REPLAY_MIN_CHUNK	  64
+
+/* read_topa() wait strategies (-w) */
+#define WAIT_SLEEP_US		100
+#define WAIT_SPIN_LOOPS		4096
+#define WAIT_MAX_SLEEP_US	1000
+#define WAIT_POLL_MS		100
 
 /* controls */
 #define MDEBUG 0
@@ -57,17 +76,107 @@ unsigned int leftover = 0;
 /* status */
 int running = 1;
 unsigned long long int bytes_written = 0;
+unsigned long long int ptw_packets = 0;
+
+/* how read_topa() waits for new pages */
+enum wait_mode {
+	WAIT_SLEEP,	/* fixed usleep(WAIT_SLEEP_US) */
+	WAIT_SPIN,	/* busy poll: lowest latency, a full core */
+	WAIT_ADAPTIVE,	/* spin for a while, then sleep with backoff */
+	WAIT_POLL,	/* block in poll() on the device */
+};
+enum wait_mode wait_mode = WAIT_SLEEP;
+unsigned long long int data_wakeups = 0;
+unsigned long long int empty_wakeups = 0;
+bool replay = false;
+char *replay_plugin = NULL;
+uint64_t replay_plugin_base = 0;
+unsigned long long int dso_loads = 0;
+unsigned long long int dso_unloads = 0;
+
+/* PTWRITE payloads decoded but not yet checked */
+unsigned long long ptw_batch[PTW_BATCH];
+int ptw_nbatch = 0;
 
 /* mapping struct */
-#define MAX_TYPEMAP 99999
-
+#define TYPEMAP_MIN_BITS	12
+#define TYPEMAP_TID_SHIFT	48
+#define TYPEMAP_TID_MASK	0x3FFFULL
+#define TYPEMAP_ADDR_MASK	0xFFFFFFFFFFFFULL
+
+#define MAX_TYPEMAP_DSOS	4096
+
+/* slot keys; a real key always has a non-zero target address */
+#define TYPEMAP_EMPTY		0ULL
+
+/*
+ * Open-addressed (linear probing) table of (typeID, target address)
+ * pairs. The key packs the 14-bit typeID above the 48-bit address, the
+ * same layout as the SideCFI PTWRITE payload, so a check is one hash
+ * and, most of the time, one cache line.
+ *
+ * Every entry is tagged with the DSO that inserted it and that DSO's
+ * generation. Unloading a DSO only bumps its generation, which turns
+ * all of its entries into tombstones at once; they are reused by later
+ * inserts and dropped on the next rehash.
+ */
 typedef struct TargetAddress {
-	unsigned long long address;
-	struct TargetAddress *next;
-  void *dso_handle;
+	uint64_t key;
+	uint32_t dso;
+	uint32_t gen;
 } TargetAddress;
 
-TargetAddress *typeIDArray[MAX_TYPEMAP] = {NULL};
+typedef struct TypeMapDSO {
+	void *handle;
+	uint32_t gen;
+	bool live;
+	size_t entries;
+} TypeMapDSO;
+
+TargetAddress *typemap = NULL;
+uint64_t typemap_mask = 0;
+unsigned typemap_bits = 0;
+size_t typemap_used = 0;	/* live entries */
+size_t typemap_filled = 0;	/* live entries + tombstones */
+
+TypeMapDSO typemap_dsos[MAX_TYPEMAP_DSOS];
+uint32_t typemap_ndsos = 0;
+uint32_t typemap_last_dso = 0;
+
+/*
+ * Binary typemap (<binary>.tpb, see tools/gen_tpb.py): a prebuilt table
+ * laid out like the one above, but keyed by the offset from the DSO base.
+ * It is mmap'ed as is and the base is subtracted at lookup time. It is
+ * only used while <binary>.tp has the size and mtime it was built from.
+ */
+#define TPB_MAGIC		"STPB"
+#define TPB_VERSION		2
+#define MAX_TYPEMAP_IMAGES	256
+
+typedef struct TypeMapHeader {
+	char magic[4];
+	uint32_t version;
+	uint32_t bits;
+	uint32_t reserved;
+	uint64_t entries;
+	uint64_t span;		/* largest offset + 1 */
+	uint64_t tp_size;	/* of the .tp it was built from */
+	int64_t tp_mtime_ns;
+} TypeMapHeader;
+
+typedef struct TypeMapImage {
+	void *dso_handle;
+	uint64_t base_address;
+	uint64_t span;
+	uint64_t mask;
+	unsigned bits;
+	const uint64_t *slots;
+	void *map;
+	size_t map_size;
+} TypeMapImage;
+
+TypeMapImage typemap_images[MAX_TYPEMAP_IMAGES];
+int typemap_nimages = 0;
 
 typedef struct TypeMap {
 	char symbol[256];
@@ -77,67 +186,191 @@ typedef struct TypeMap {
 
 struct dso_info idso;
 
+static inline uint64_t typemapKey(unsigned tID, unsigned long long address) {
+	return ((uint64_t)tID << TYPEMAP_TID_SHIFT) | (address & TYPEMAP_ADDR_MASK);
+}
+
+static inline uint64_t typemapHashBits(uint64_t key, unsigned bits) {
+	/* fibonacci hashing; the top bits are the best mixed */
+	return (key * 0x9E3779B97F4A7C15ULL) >> (64 - bits);
+}
+
+static inline uint64_t typemapHash(uint64_t key) {
+	return typemapHashBits(key, typemap_bits);
+}
+
+static inline bool typemapLive(const TargetAddress *e) {
+	return e->key != TYPEMAP_EMPTY && typemap_dsos[e->dso].gen == e->gen;
+}
+
 void printTypeMap() {
 #if MDEBUG
-	printf("\n| CEID\t|\ttrg_addr1\t|\ttrg_addr2\t|\t.....\n");
+	printf("\n| CEID\t|\ttrg_addr\t|\tdso\n");
 	printf("+-------+-----------------------+-----------------------+\n");
-	for (int i = 0; i < MAX_TYPEMAP; ++i) {
-		TargetAddress *current = typeIDArray[i];
-		if (current != NULL) {
-			printf("| %d\t|", i);
-			while (current != NULL) {
-				printf("\t 0x%llx\t|", current->address);
-				current = current->next;
-			}
-			printf("\n");
+	for (uint64_t i = 0; typemap && i <= typemap_mask; ++i) {
+		if (typemapLive(&typemap[i])) {
+			uint64_t key = typemap[i].key;
+			printf("| %llu\t|\t 0x%llx\t|\t %p\n",
+					(unsigned long long)(key >> TYPEMAP_TID_SHIFT),
+					(unsigned long long)(key & TYPEMAP_ADDR_MASK),
+					typemap_dsos[typemap[i].dso].handle);
 		}
 	}
 #endif
 }
 
-void insertTypeMap(int tID, unsigned long long address, void *dso_handle) {
-	TargetAddress *newAddr = (TargetAddress *)malloc(sizeof(TargetAddress));
-	if (newAddr == NULL) {
-		perror("Failed to allocate memory for new target address");
+/* find the live record of a DSO handle, or start one */
+uint32_t typemapDSO(void *dso_handle, bool create) {
+	uint32_t n;
+
+	if (typemap_last_dso < typemap_ndsos &&
+			typemap_dsos[typemap_last_dso].live &&
+			typemap_dsos[typemap_last_dso].handle == dso_handle)
+		return typemap_last_dso;
+
+	for (n = 0; n < typemap_ndsos; ++n) {
+		if (typemap_dsos[n].live && typemap_dsos[n].handle == dso_handle)
+			return typemap_last_dso = n;
+	}
+
+	if (!create)
+		return MAX_TYPEMAP_DSOS;
+
+	/* reuse a retired record; its bumped generation keeps old entries dead */
+	for (n = 0; n < typemap_ndsos && typemap_dsos[n].live; ++n)
+		;
+	if (n == MAX_TYPEMAP_DSOS) {
+		fprintf(stderr, "Too many DSOs loaded (%d)\n", MAX_TYPEMAP_DSOS);
+		exit(EXIT_FAILURE);
+	}
+	if (n == typemap_ndsos)
+		typemap_ndsos++;
+
+	typemap_dsos[n].handle = dso_handle;
+	typemap_dsos[n].live = true;
+	typemap_dsos[n].entries = 0;
+	return typemap_last_dso = n;
+}
+
+void placeTypeMap(uint64_t key, uint32_t dso) {
+	uint64_t i = typemapHash(key);
+
+	while (typemapLive(&typemap[i]))
+		i = (i + 1) & typemap_mask;
+
+	if (typemap[i].key == TYPEMAP_EMPTY)
+		typemap_filled++;
+	typemap[i].key = key;
+	typemap[i].dso = dso;
+	typemap[i].gen = typemap_dsos[dso].gen;
+	typemap_used++;
+}
+
+/* rehash into a table with room for at least `want` entries at 50% load */
+void resizeTypeMap(size_t want) {
+	TargetAddress *old = typemap;
+	uint64_t old_mask = typemap_mask;
+	unsigned bits = TYPEMAP_MIN_BITS;
+
+	while (((size_t)1 << bits) < want * 2)
+		bits++;
+
+	typemap = (TargetAddress *)calloc((size_t)1 << bits, sizeof(TargetAddress));
+	if (typemap == NULL) {
+		perror("Failed to allocate memory for the typemap");
 		exit(EXIT_FAILURE);
 	}
+	typemap_bits = bits;
+	typemap_mask = ((uint64_t)1 << bits) - 1;
+	typemap_used = 0;
+	typemap_filled = 0;
+
+	if (old == NULL)
+		return;
+
+	for (uint64_t i = 0; i <= old_mask; ++i) {
+		if (typemapLive(&old[i]))
+			placeTypeMap(old[i].key, old[i].dso);
+	}
+	free(old);
+}
+
+void insertTypeMap(int tID, unsigned long long address, void *dso_handle) {
+	uint32_t dso;
 
-	newAddr->address = address;
-  newAddr->dso_handle = dso_handle;
-	newAddr->next = typeIDArray[tID];
-	typeIDArray[tID] = newAddr;
+	/* PTWRITEs only carry 14 bits of typeID; larger ones can never match */
+	if ((unsigned)tID > TYPEMAP_TID_MASK || (address & TYPEMAP_ADDR_MASK) == 0)
+		return;
+
+	/* keep the load factor (tombstones included) under 75% */
+	if (typemap == NULL || (typemap_filled + 1) * 4 > (typemap_mask + 1) * 3)
+		resizeTypeMap(typemap_used + 1);
+
+	dso = typemapDSO(dso_handle, true);
+	placeTypeMap(typemapKey(tID, address), dso);
+	typemap_dsos[dso].entries++;
+}
+
+void unmapTypeMapImage(int n) {
+	munmap(typemap_images[n].map, typemap_images[n].map_size);
+	typemap_images[n] = typemap_images[--typemap_nimages];
 }
 
 void removeEntriesByDSOHandle(void *dso_handle) {
-  for (int i = 0; i < MAX_TYPEMAP; ++i) {
-    TargetAddress *current = typeIDArray[i];
-    TargetAddress *prev = NULL;
-    while (current != NULL) {
-      if (current->dso_handle == dso_handle) {
-        if (prev == NULL) {
-          typeIDArray[i] = current->next;
-        } else {
-          prev->next = current->next;
-        }
-        free(current);
-        current = (prev == NULL) ? typeIDArray[i] : prev->next;
-      } else {
-        prev = current;
-        current = current->next;
-      }
-    }
-  }
+	uint32_t dso;
+
+	for (int n = typemap_nimages - 1; n >= 0; --n) {
+		if (typemap_images[n].dso_handle == dso_handle)
+			unmapTypeMapImage(n);
+	}
+
+	/* retire the DSO; its entries become tombstones without touching them */
+	dso = typemapDSO(dso_handle, false);
+	if (dso != MAX_TYPEMAP_DSOS) {
+		typemap_dsos[dso].gen++;
+		typemap_dsos[dso].live = false;
+		typemap_used -= typemap_dsos[dso].entries;
+		typemap_dsos[dso].entries = 0;
+	}
 	printTypeMap();
 }
 
 
-inline int searchTypeMap(int tID, unsigned long long address) {
-	TargetAddress *current = typeIDArray[tID];
-	while (current != NULL) {
-		if (current->address == address) {
+static inline int searchTypeMapImage(const TypeMapImage *img, int tID,
+		unsigned long long address) {
+	uint64_t offset = address - img->base_address;
+	uint64_t key, i;
+
+	/* also rejects addresses below the base (the subtraction wraps) */
+	if (offset >= img->span)
+		return 0;
+
+	key = typemapKey(tID, offset);
+	for (i = typemapHashBits(key, img->bits); img->slots[i] != TYPEMAP_EMPTY;
+			i = (i + 1) & img->mask) {
+		if (img->slots[i] == key)
+			return 1;
+	}
+	return 0;
+}
+
+static inline int searchTypeMap(int tID, unsigned long long address) {
+	uint64_t key = typemapKey(tID, address);
+	uint64_t i;
+
+	for (int n = 0; n < typemap_nimages; ++n) {
+		if (searchTypeMapImage(&typemap_images[n], tID, address))
+			return 1;
+	}
+
+	if (typemap == NULL)
+		return 0;
+
+	for (i = typemapHash(key); typemap[i].key != TYPEMAP_EMPTY;
+			i = (i + 1) & typemap_mask) {
+		if (typemap[i].key == key && typemapLive(&typemap[i])) {
 			return 1; // Address found
 		}
-		current = current->next;
 	}
 	return 0; // Address not found
 }
@@ -149,6 +382,66 @@ unsigned long long process_trace_data(char* buf,
                                       bool wrap, 
                                       bool last_read);
 
+/* wait strategy names for -w, indexed by enum wait_mode */
+const char *wait_names[] = { "sleep", "spin", "adaptive", "poll" };
+
+static inline void
+cpu_relax(void)
+{
+#if defined(__x86_64__)
+	__builtin_ia32_pause();
+#elif defined(__aarch64__)
+	__asm__ __volatile__("yield");
+#endif
+}
+
+/*
+ * Called when read_topa() found no new pages; idle is the number of
+ * empty checks in a row, including this one.
+ */
+void
+wait_for_data(unsigned long idle)
+{
+	struct pollfd pfd;
+	unsigned long backoff;
+	int ret;
+
+	switch (wait_mode) {
+	case WAIT_SPIN:
+		cpu_relax();
+		break;
+
+	case WAIT_ADAPTIVE:
+		if (idle <= WAIT_SPIN_LOOPS) {
+			cpu_relax();
+			break;
+		}
+		/* double the sleep on every empty wakeup, up to WAIT_MAX_SLEEP_US */
+		backoff = idle - WAIT_SPIN_LOOPS;
+		usleep(backoff < 10 && (1UL << backoff) < WAIT_MAX_SLEEP_US ?
+				1UL << backoff : WAIT_MAX_SLEEP_US);
+		break;
+
+	case WAIT_POLL:
+		pfd.fd = fd;
+		pfd.events = POLLIN;
+		ret = poll(&pfd, 1, WAIT_POLL_MS);
+		if (ret < 0 && errno != EINTR) {
+			perror("poll");
+			exit(EXIT_FAILURE);
+		}
+		/* ready twice in a row without data: no poll support, don't spin */
+		if (ret > 0 && idle > 1)
+			usleep(WAIT_SLEEP_US);
+		break;
+
+	case WAIT_SLEEP:
+	default:
+		usleep(WAIT_SLEEP_US);
+		break;
+	}
+}
+
 void
 read_topa(void)
 {
@@ -159,6 +452,7 @@ read_topa(void)
 
 	bool wrap = false;
 	unsigned long long i = 0;
+	unsigned long idle = 0;
 
 	/* allocate overflow decoder */
 	overflow_buf = (char*)malloc(16);
@@ -177,6 +471,11 @@ read_topa(void)
 		}
 
 		if (read_pgs > 0) {
+			/* only checks that follow a wait count as wakeups */
+			if (idle > 0)
+				data_wakeups++;
+			idle = 0;
+
 			read_size = read_pgs * buf_sz;
 			//printf("Read size is %d\n", read_size);
 
@@ -201,6 +500,10 @@ read_topa(void)
 
 			//printf("i moved to %d\n", i);
 
+			/* record raw trace for offline replay */
+			if (trace_out)
+				fwrite(local_base, 1, read_size, trace_out);
+
 			/* move local base */
 			local_base += read_size;
 			if (local_base >= topa + topa_size) {
@@ -221,7 +524,9 @@ read_topa(void)
 			}
 
 		}  else {
-			usleep(100);
+			if (idle > 0)
+				empty_wakeups++;
+			wait_for_data(++idle);
 		}
 	}
 
@@ -240,6 +545,9 @@ read_topa(void)
 	//printf("Calling ptd with %lx, %llu, %ld, %d, %d, %d\n", (uint64_t)topa, i, buf_offset, false, false, true);
 	i = process_trace_data(local_base, 0, buf_offset, false, false, true);
 
+	if (trace_out)
+		fwrite(local_base, 1, buf_offset, trace_out);
+
 	/* log monitor stats */
 	//printf("%lld bytes copied\n", bytes_written);
 
@@ -252,13 +560,82 @@ void signal_handler(int n, siginfo_t *info, void *unused) {
 	running = 0;
 }
 
-void 
-load_dso() 
+/* mmap <binary>.tpb if there is a valid, current one; returns 0 if not */
+int
+map_typemap_image(const char *binary, uint64_t base_address, void *handle)
+{
+	char filename[260];
+	struct stat st, tp_st;
+	TypeMapHeader *hdr;
+	TypeMapImage *img;
+	void *map;
+	int tfd;
+
+	snprintf(filename, sizeof(filename), "%s.tpb", binary);
+
+	tfd = open(filename, O_RDONLY);
+	if (tfd < 0)
+		return 0;
+
+	if (fstat(tfd, &st) < 0 || (size_t)st.st_size < sizeof(TypeMapHeader) ||
+			typemap_nimages == MAX_TYPEMAP_IMAGES) {
+		close(tfd);
+		return 0;
+	}
+
+	map = mmap(0, st.st_size, PROT_READ, MAP_PRIVATE, tfd, 0x0);
+	close(tfd);
+	if (map == MAP_FAILED)
+		return 0;
+
+	hdr = (TypeMapHeader *)map;
+	if (memcmp(hdr->magic, TPB_MAGIC, 4) != 0 || hdr->version != TPB_VERSION ||
+			hdr->bits == 0 || hdr->bits > 40 ||
+			(size_t)st.st_size < sizeof(TypeMapHeader) +
+			(sizeof(uint64_t) << hdr->bits)) {
+		printf("Ignoring malformed binary typemap %s\n", filename);
+		munmap(map, st.st_size);
+		return 0;
+	}
+
+	/* a .tpb that does not match the .tp is left over from another build */
+	snprintf(filename, sizeof(filename), "%s.tp", binary);
+	if (stat(filename, &tp_st) < 0 || (uint64_t)tp_st.st_size != hdr->tp_size ||
+			tp_st.st_mtim.tv_sec * 1000000000LL + tp_st.st_mtim.tv_nsec !=
+			hdr->tp_mtime_ns) {
+		printf("Ignoring stale binary typemap %s.tpb\n", binary);
+		munmap(map, st.st_size);
+		return 0;
+	}
+
+	img = &typemap_images[typemap_nimages++];
+	img->dso_handle = handle;
+	img->base_address = base_address;
+	img->span = hdr->span;
+	img->bits = hdr->bits;
+	img->mask = ((uint64_t)1 << hdr->bits) - 1;
+	img->slots = (const uint64_t *)(hdr + 1);
+	img->map = map;
+	img->map_size = st.st_size;
+
+#if MDEBUG
+	printf("\nTYPEMAP UPDATE: mapped %" PRIu64 " entries from %s.tpb\n",
+			hdr->entries, binary);
+#endif
+	return 1;
+}
+
+void
+load_typemap(const char *binary, uint64_t base_address, void *handle)
 {
 	char filename[260];
 
+	/* prefer the prebuilt binary typemap: one mmap, no parsing */
+	if (map_typemap_image(binary, base_address, handle))
+		return;
+
 	/* add extension for typemap */
-	snprintf(filename, sizeof(filename), "%s.tp", idso.filename);
+	snprintf(filename, sizeof(filename), "%s.tp", binary);
 
 	/* open file sidecfi typemap */
 	FILE *file = fopen(filename, "r");
@@ -279,9 +656,9 @@ load_dso()
 			/* here you need to see if it's a vtable or not and add offset */
 			// sym_offset = 0x0;
 
-			typeinfo.address += idso.base_address;
+			typeinfo.address += base_address;
 
-      insertTypeMap(typeinfo.typeID, typeinfo.address, idso.handle);
+      insertTypeMap(typeinfo.typeID, typeinfo.address, handle);
 		}
 	}
 	fclose(file);
@@ -289,15 +666,24 @@ load_dso()
 	printTypeMap();
 }
 
+void 
+load_dso() 
+{
+	load_typemap(idso.filename, idso.base_address, idso.handle);
+}
+
 void freeTypeMap() {
-	for (int i = 0; i < MAX_TYPEMAP; ++i) {
-		TargetAddress *current = typeIDArray[i];
-		while (current != NULL) {
-			TargetAddress *temp = current;
-			current = current->next;
-			free(temp);
-		}
-	}
+	while (typemap_nimages > 0)
+		unmapTypeMapImage(typemap_nimages - 1);
+
+	free(typemap);
+	typemap = NULL;
+	typemap_ndsos = 0;
+	typemap_last_dso = 0;
+	typemap_mask = 0;
+	typemap_bits = 0;
+	typemap_used = 0;
+	typemap_filled = 0;
 }
 
 void
@@ -416,12 +802,129 @@ void print_ptw_details(unsigned long long ptw_value) {
 	printf("opcode: 0x%02x typeID: %d target_addr: 0x%012" PRIx64 "\n", opcode, typeID, (uint64_t)target_addr);
 }
 
-unsigned long long
-process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bool overflow, bool wrap, bool last_read)
+/* decode a PTWRITE payload and run SideCFI logic */
+static inline void
+sidecfi_policy(unsigned long long ptw_value)
 {
 	register unsigned long long target_addr;
 	register unsigned typeID;
 
+	uint64_t op = ptw_value >> 62;
+	switch (op){
+		case 0x1:
+			/* Extracting the next 13 bits for typeID */
+			typeID = (ptw_value >> 48) & 0x3FFF;
+
+			/* Extracting the lower 48 bits for target_addr */
+			target_addr = ptw_value & 0xFFFFFFFFFFFF;
+
+			/* Printing the extracted details */
+#if MDEBUG
+			printf("\n[ptw] => opcode: 0x%01lx typeID: %d target_addr: 0x%012lx\n",
+					op,
+					typeID,
+					(uint64_t)target_addr);
+#endif
+
+			bool found = searchTypeMap(typeID, target_addr);
+
+#if 0
+			if (!found) {
+				printf("CFI CHECK ERROR: no matching address found in the typemap!\n");
+				printf("MSG{0x%llx, %d}\n",
+						target_addr, typeID);
+				exit(1);
+			}
+#endif
+
+#if MDEBUG
+			else
+				printf("CFI CHECK: MSG{0x%llx, %d}\n", target_addr, typeID);
+#endif
+
+			break;
+		case 0x2:
+#if MDEBUG
+			printf("\n[ptw] => opcode: 0x%01lx dlopcode: 0x%01llx handle: 0x%016llx\n",
+					op,
+					(ptw_value >> 61) & 0x1,
+					ptw_value & 0x1FFFFFFFFFFFFFFF);
+#endif
+			if (replay) {
+				/* no driver to resolve bases: every dlopen maps the -p plugin */
+				void *dso_handle = (void*)(ptw_value & 0x1FFFFFFFFFFFFFFF);
+				if (((ptw_value >> 61) & 0x1) == 0x0) {
+					if (replay_plugin)
+						load_typemap(replay_plugin, replay_plugin_base, dso_handle);
+					dso_loads++;
+				} else {
+					removeEntriesByDSOHandle(dso_handle);
+					dso_unloads++;
+				}
+			} else if (((ptw_value >> 61) & 0x1) == 0x0) {
+				/* get the bin base and init typemap */
+				idso.handle = (void*)(ptw_value & 0x1FFFFFFFFFFFFFFF);
+				if (ioctl(fd, PTW_GET_BASE, &idso) < 0) {
+					perror("PTW_GET_BASE");
+					exit(EXIT_FAILURE);
+				}
+				load_dso();
+			} else if (((ptw_value >> 61) & 0x1) == 0x1){
+				/* unload dso */
+				void *dso_handle = (void*)(ptw_value & 0x1FFFFFFFFFFFFFFF);
+				removeEntriesByDSOHandle(dso_handle);
+			}
+
+			break;
+		default:
+			printf("Encountered invalid SideCFI opcode %lx!\n", op);
+	}
+}
+
+#if FAST_SCAN
+/*
+ * Index of the first extension opcode in local_ptr[i, end), or end.
+ * Packets are usually a few bytes apart, so look at one word at a time
+ * first and only hand long PAD runs to memchr.
+ */
+static inline unsigned long long
+skip_to_ext(const char *local_ptr, unsigned long long i, unsigned long long end)
+{
+	const uint64_t ones = 0x0101010101010101ULL;
+	uint64_t word, hit;
+	char *next;
+
+	/* local_ptr[i] is known not to match; packets are often back to back */
+	if (++i < end && local_ptr[i] == pt_opc_ext)
+		return i;
+
+	if (i + 8 <= end) {
+		memcpy(&word, local_ptr + i, 8);
+		word ^= ones * pt_opc_ext;
+		/* the lowest set bit marks the first byte equal to the opcode */
+		hit = (word - ones) & ~word & (ones << 7);
+		if (hit)
+			return i + (__builtin_ctzll(hit) >> 3);
+		i += 8;
+	}
+
+	next = memchr(local_ptr + i, pt_opc_ext, end - i);
+	return next ? (unsigned long long)(next - local_ptr) : end;
+}
+#endif
+
+/* run the queued PTWRITEs in trace order */
+static inline void
+flush_ptw_batch(void)
+{
+	for (int n = 0; n < ptw_nbatch; n++)
+		sidecfi_policy(ptw_batch[n]);
+	ptw_nbatch = 0;
+}
+
+unsigned long long
+process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bool overflow, bool wrap, bool last_read)
+{
 	/* Current packet opcode byte */
 	unsigned char packet_opcode = 0x0;
 
@@ -458,6 +961,15 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 		//if(last_read && (i > topa_end - *buf))
 		//	break;
 
+#if FAST_SCAN
+		/* everything but the extension opcode is skipped: find the next one */
+		if (local_ptr[i] != pt_opc_ext) {
+			i = skip_to_ext(local_ptr, i, read_until);
+			if (i >= read_until)
+				break;
+		}
+#endif
+
 		/* Load the current packet opcode byte */
 		packet_opcode = local_ptr[i];
 
@@ -484,73 +996,20 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 						if ((packet_opcode & pt_opm_ptw) == pt_ext_ptw){
 							/* Load 8 bytes of PTWRITE data (64-bit values only) */
 							unsigned long long ptw_value = *(unsigned long long*)(local_ptr + i + 1);
+							ptw_packets++;
 
-							/* Decode value and run SideCFI logic */
-							uint64_t op = ptw_value >> 62;
-							switch (op){
-								case 0x1:
-									/* Extracting the next 13 bits for typeID */
-									typeID = (ptw_value >> 48) & 0x3FFF; 
-
-									/* Extracting the lower 48 bits for target_addr */
-									target_addr = ptw_value & 0xFFFFFFFFFFFF; 
-
-									/* Printing the extracted details */
-#if MDEBUG
-									printf("\n[ptw] => opcode: 0x%01lx typeID: %d target_addr: 0x%012lx\n", 
-											op,
-											typeID, 
-											(uint64_t)target_addr);
-#endif
-
-									bool found = searchTypeMap(typeID, target_addr);
-
-#if 0
-									if (!found) { 
-										printf("CFI CHECK ERROR: no matching address found in the typemap!\n");
-										printf("MSG{0x%llx, %d}\n",
-												target_addr, typeID);
-										exit(1);
-									}
-#endif
-
-#if MDEBUG
-									else 
-										printf("CFI CHECK: MSG{0x%llx, %d}\n", target_addr, typeID);
-#endif
-
-									break;
-								case 0x2: 
-#if MDEBUG
-                  printf("\n[ptw] => opcode: 0x%01lx dlopcode: 0x%01llx handle: 0x%016llx\n",
-                         op,
-                         (ptw_value >> 61) & 0x1,
-                         ptw_value & 0x1FFFFFFFFFFFFFFF);
-#endif
-                  if (((ptw_value >> 61) & 0x1) == 0x0) {
-                    /* get the bin base and init typemap */
-                    idso.handle = (void*)(ptw_value & 0x1FFFFFFFFFFFFFFF);
-                    if (ioctl(fd, PTW_GET_BASE, &idso) < 0) {
-                      perror("PTW_GET_BASE");
-                      exit(EXIT_FAILURE);
-                    }
-                    load_dso(); 
-                  } else if (((ptw_value >> 61) & 0x1) == 0x1){
-                    /* unload dso */
-                    void *dso_handle = (void*)(ptw_value & 0x1FFFFFFFFFFFFFFF);
-                    removeEntriesByDSOHandle(dso_handle);
-                  }
-
-                  break; 
-								default:
-									printf("Encountered invalid SideCFI opcode %lx!\n", op);
-							}
+							/* Queue the value; the policy runs once per batch */
+							ptw_batch[ptw_nbatch++] = ptw_value;
+							if (ptw_nbatch == PTW_BATCH)
+								flush_ptw_batch();
 
 							i+=8;
 
 							/* Handled overflow buffer - no need to go further */
-							if (overflow)
+							if (overflow) {
+								flush_ptw_batch();
 								return i;
+							}
 
 							break;
 						}
@@ -588,6 +1047,9 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 
 		//printf("------------------\n");
 	}
+
+	/* Every PTWRITE before a returned offset must have been checked */
+	flush_ptw_batch();
 	
 	/* Take the slow path to check if a PTWRITE has been cut off */
 	if(!overflow){
@@ -640,9 +1102,131 @@ int fileExists(const char *filename) {
 	return (stat(filename, &buffer) == 0);
 }
 
+/*
+ * Feed a recorded trace through process_trace_data() in chunks of
+ * chunk_sz bytes, the same way read_topa() walks the ToPA, and report
+ * the decoder throughput.
+ */
+void
+replay_trace(const char *path, size_t chunk_sz, bool preload)
+{
+	struct stat st;
+	struct timespec start, stop;
+	unsigned long long ofst = 0, end, trace_sz;
+	char *trace, *tail;
+	int tfd;
+
+	tfd = open(path, O_RDONLY);
+	if (tfd < 0) {
+		printf("Failed to open trace %s: %s\n", path, strerror(errno));
+		exit(EXIT_FAILURE);
+	}
+
+	if (fstat(tfd, &st) < 0 || st.st_size == 0) {
+		printf("Failed to stat trace %s or trace is empty\n", path);
+		exit(EXIT_FAILURE);
+	}
+	trace_sz = st.st_size;
+
+	if (preload) {
+		/* copy the whole trace in memory so that I/O is not timed */
+		trace = (char *)malloc(trace_sz);
+		if (trace == NULL) {
+			printf("Failed to allocate %llu bytes for trace\n", trace_sz);
+			exit(EXIT_FAILURE);
+		}
+		for (ofst = 0; ofst < trace_sz; ) {
+			ssize_t n = read(tfd, trace + ofst, trace_sz - ofst);
+			if (n <= 0) {
+				printf("Failed to read trace %s\n", path);
+				exit(EXIT_FAILURE);
+			}
+			ofst += n;
+		}
+		ofst = 0;
+	} else {
+		trace = (char *)mmap(0, trace_sz, PROT_READ, MAP_PRIVATE | MAP_POPULATE,
+				tfd, 0x0);
+		if (trace == MAP_FAILED) {
+			printf("Failed to mmap trace %s\n", path);
+			exit(EXIT_FAILURE);
+		}
+	}
+
+	/* allocate overflow decoder */
+	overflow_buf = (char*)malloc(16);
+
+	/* the tail gets up to a chunk plus a cut-off packet, zero padded */
+	tail = (char*)calloc(1, chunk_sz + 32);
+	if (overflow_buf == NULL || tail == NULL) {
+		printf("Failed to allocate replay buffers\n");
+		exit(EXIT_FAILURE);
+	}
+
+	clock_gettime(CLOCK_MONOTONIC, &start);
+
+	/* full chunks; a PTWRITE cut at a chunk end is picked up by the next one */
+	for (end = chunk_sz; end < trace_sz; end += chunk_sz)
+		ofst = process_trace_data(trace, ofst, (unsigned long)trace + end,
+				false, false, false);
+
+	/* last chunk, padded so the fast path never reads past the trace */
+	memcpy(tail, trace + ofst, trace_sz - ofst);
+	process_trace_data(tail, 0, (unsigned long)tail + (trace_sz - ofst) + 10,
+			false, false, false);
+
+	clock_gettime(CLOCK_MONOTONIC, &stop);
+
+	bytes_written = trace_sz;
+
+	double decode_time = (stop.tv_sec - start.tv_sec) +
+		(stop.tv_nsec - start.tv_nsec) / 1000000000.0;
+
+	printf("Trace bytes = %llu\n", bytes_written);
+	printf("PTWRITE packets = %llu\n", ptw_packets);
+	printf("Decode time = %.6f s\n", decode_time);
+	printf("Bytes/s = %.2f\n", bytes_written / decode_time);
+	printf("PTWRITE/s = %.2f\n", ptw_packets / decode_time);
+	printf("DSO loads = %llu\n", dso_loads);
+	printf("DSO unloads = %llu\n", dso_unloads);
+
+	free(tail);
+	free(overflow_buf);
+	if (preload)
+		free(trace);
+	else
+		munmap(trace, trace_sz);
+	close(tfd);
+}
+
+void
+usage(const char *prog)
+{
+	printf("Usage: %s [-o] [-w mode] [-r trace [-t binary] [-b base] [-p plugin] [-P base]\n"
+			"          [-c chunk] [-l]]\n", prog);
+	printf("  -o        record the raw ToPA data to " TRACE_OUT "\n");
+	printf("  -r trace  replay a recorded trace instead of reading /dev/ptw\n");
+	printf("  -t binary load binary.tp as the typemap when replaying\n");
+	printf("  -b base   base address of binary when replaying (default 0)\n");
+	printf("  -p plugin load plugin.tp on every dlopen PTWRITE when replaying\n");
+	printf("  -P base   base address of plugin when replaying (default 0)\n");
+	printf("  -c chunk  replay chunk size in bytes (default page size)\n");
+	printf("  -l        load the trace in memory before replaying instead of mmap\n");
+	printf("  -w mode   wait for data with sleep (default), spin, adaptive or poll\n");
+}
+
 int
 main(int argc, char *argv[])
 {
+	int opt;
+	unsigned int n;
+	char *replay_path = NULL;
+	char *replay_binary = NULL;
+	uint64_t replay_base = 0;
+	size_t chunk_sz = PAGE_SIZE;
+	bool preload = false;
+	bool record = false;
+
 	struct sigaction sig;
 	sig.sa_sigaction = signal_handler;
 	sig.sa_flags = SA_SIGINFO;
@@ -654,12 +1238,80 @@ main(int argc, char *argv[])
 	/* set up signal handler */
 	sigaction(SIGUSR1, &sig, NULL);
 
+	while ((opt = getopt(argc, argv, "or:t:b:p:P:c:lw:h")) != -1) {
+		switch (opt) {
+		case 'o':
+			record = true;
+			break;
+		case 'r':
+			replay_path = optarg;
+			break;
+		case 't':
+			replay_binary = optarg;
+			break;
+		case 'b':
+			replay_base = strtoull(optarg, NULL, 0);
+			break;
+		case 'p':
+			replay_plugin = optarg;
+			break;
+		case 'P':
+			replay_plugin_base = strtoull(optarg, NULL, 0);
+			break;
+		case 'c':
+			chunk_sz = strtoul(optarg, NULL, 0);
+			break;
+		case 'l':
+			preload = true;
+			break;
+		case 'w':
+			for (n = 0; n < sizeof(wait_names) / sizeof(wait_names[0]); n++) {
+				if (strcmp(optarg, wait_names[n]) == 0)
+					break;
+			}
+			if (n == sizeof(wait_names) / sizeof(wait_names[0])) {
+				printf("Unknown wait strategy %s\n", optarg);
+				usage(argv[0]);
+				exit(EXIT_FAILURE);
+			}
+			wait_mode = (enum wait_mode)n;
+			break;
+		default:
+			usage(argv[0]);
+			exit(opt == 'h' ? EXIT_SUCCESS : EXIT_FAILURE);
+		}
+	}
+
+	if (chunk_sz < REPLAY_MIN_CHUNK) {
+		printf("Replay chunk must be at least %d bytes\n", REPLAY_MIN_CHUNK);
+		exit(EXIT_FAILURE);
+	}
+
 #if MDEBUG
 	printf("This is the SideCFI monitor for application %s\n", argv[1]);
 	printf("Processing  : Concurrent\n");
 	printf("PT Decoder  : Custom\n");
 #endif
 
+	/* offline mode: decode a recorded trace and exit */
+	if (replay_path) {
+		replay = true;
+		if (replay_binary)
+			load_typemap(replay_binary, replay_base, NULL);
+		replay_trace(replay_path, chunk_sz, preload);
+		unload_dso();
+		return 0;
+	}
+
+	/* open output trace file */
+	if (record) {
+		trace_out = fopen(TRACE_OUT, "wb");
+		if (trace_out == NULL) {
+			printf("Failed to open %s: %s\n", TRACE_OUT, strerror(errno));
+			exit(EXIT_FAILURE);
+		}
+	}
+
 	/* initialize for trace capturing */
 	pt_init();
 
@@ -695,8 +1347,14 @@ main(int argc, char *argv[])
 	printf("CPU usage = %.2f%%\n", cpu_usage);
   #endif
 
+	printf("Data wakeups = %llu\n", data_wakeups);
+	printf("Empty wakeups = %llu\n", empty_wakeups);
+
 	/* cleanup trace capturing */
 	pt_destroy();
 
+	if (trace_out)
+		fclose(trace_out);
+
 	return 0;
 }
@@ -8,12 +8,14 @@
 #include <string.h>
 #include <fcntl.h>
 #include <signal.h>
+#include <poll.h>
 #include <time.h>
 //#include <intel-pt.h>
 #include "pt_opcodes.h"
 
 #include <sys/mman.h>
 #include <sys/ioctl.h>
+#include <sys/stat.h>
 
 #include <sys/resource.h>
 #include <sys/time.h>
@@ -24,12 +26,30 @@
 
 #define CPU_USAGE 1
 
+/* skip PAD bytes in bulk and run the policy on batches of PTWRITEs */
+#ifndef FAST_SCAN
+#define FAST_SCAN 1
+#endif
+
+#if FAST_SCAN
+#define PTW_BATCH			16
+#else
+#define PTW_BATCH			1
+#endif
+
 /* driver defines */
 #define DEVICE_NAME         "/dev/"PTW_DEV_NAME
 #define TRACE_OUT			"trace.bin"
 #define PKT_OUT				"ptw_packet.log"
 #define PAGE_SIZE			sysconf(_SC_PAGE_SIZE)
 #define READ_BUFFER_SIZE	PAGE_SIZE
+#define REPLAY_MIN_CHUNK	64
+
+/* read_topa() wait strategies (-w) */
+#define WAIT_SLEEP_US		100
+#define WAIT_SPIN_LOOPS		4096
+#define WAIT_MAX_SLEEP_US	1000
+#define WAIT_POLL_MS		100
 
 /* output trace file */
 FILE *trace_out;
@@ -54,9 +74,85 @@ unsigned int leftover = 0;
 /* status */
 int running = 1;
 unsigned long long int bytes_written = 0;
+unsigned long long int ptw_packets = 0;
+
+/* how read_topa() waits for new pages */
+enum wait_mode {
+	WAIT_SLEEP,	/* fixed usleep(WAIT_SLEEP_US) */
+	WAIT_SPIN,	/* busy poll: lowest latency, a full core */
+	WAIT_ADAPTIVE,	/* spin for a while, then sleep with backoff */
+	WAIT_POLL,	/* block in poll() on the device */
+};
+enum wait_mode wait_mode = WAIT_SLEEP;
+unsigned long long int data_wakeups = 0;
+unsigned long long int empty_wakeups = 0;
+
+/* PTWRITE payloads decoded but not yet checked */
+uint32_t ptw_batch[PTW_BATCH];
+int ptw_nbatch = 0;
 
 unsigned long long process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bool overflow, bool wrap, bool last_read);
 
+/* wait strategy names for -w, indexed by enum wait_mode */
+const char *wait_names[] = { "sleep", "spin", "adaptive", "poll" };
+
+static inline void
+cpu_relax(void)
+{
+#if defined(__x86_64__)
+	__builtin_ia32_pause();
+#elif defined(__aarch64__)
+	__asm__ __volatile__("yield");
+#endif
+}
+
+/*
+ * Called when read_topa() found no new pages; idle is the number of
+ * empty checks in a row, including this one.
+ */
+void
+wait_for_data(unsigned long idle)
+{
+	struct pollfd pfd;
+	unsigned long backoff;
+	int ret;
+
+	switch (wait_mode) {
+	case WAIT_SPIN:
+		cpu_relax();
+		break;
+
+	case WAIT_ADAPTIVE:
+		if (idle <= WAIT_SPIN_LOOPS) {
+			cpu_relax();
+			break;
+		}
+		/* double the sleep on every empty wakeup, up to WAIT_MAX_SLEEP_US */
+		backoff = idle - WAIT_SPIN_LOOPS;
+		usleep(backoff < 10 && (1UL << backoff) < WAIT_MAX_SLEEP_US ?
+				1UL << backoff : WAIT_MAX_SLEEP_US);
+		break;
+
+	case WAIT_POLL:
+		pfd.fd = fd;
+		pfd.events = POLLIN;
+		ret = poll(&pfd, 1, WAIT_POLL_MS);
+		if (ret < 0 && errno != EINTR) {
+			perror("poll");
+			exit(EXIT_FAILURE);
+		}
+		/* ready twice in a row without data: no poll support, don't spin */
+		if (ret > 0 && idle > 1)
+			usleep(WAIT_SLEEP_US);
+		break;
+
+	case WAIT_SLEEP:
+	default:
+		usleep(WAIT_SLEEP_US);
+		break;
+	}
+}
+
 void
 read_topa(void)
 {
@@ -67,6 +163,7 @@ read_topa(void)
 
 	bool wrap = false;
 	unsigned long long i = 0;
+	unsigned long idle = 0;
 
 	/* allocate overflow decoder */
 	overflow_buf = (char*)malloc(16);
@@ -85,6 +182,11 @@ read_topa(void)
 		}
 
 		if (read_pgs > 0) {
+			/* only checks that follow a wait count as wakeups */
+			if (idle > 0)
+				data_wakeups++;
+			idle = 0;
+
 			read_size = read_pgs * buf_sz;
 			//printf("Read size is %d\n", read_size);
 
@@ -109,6 +211,10 @@ read_topa(void)
 
 			//printf("i moved to %d\n", i);
 
+			/* record raw trace for offline replay */
+			if (trace_out)
+				fwrite(local_base, 1, read_size, trace_out);
+
 			/* move local base */
 			local_base += read_size;
 			if (local_base >= topa + topa_size) {
@@ -129,7 +235,9 @@ read_topa(void)
 			}
 
 		}  else {
-			usleep(100);
+			if (idle > 0)
+				empty_wakeups++;
+			wait_for_data(++idle);
 		}
 	}
 
@@ -236,6 +344,70 @@ sidestack_deinit (void)
 	sidestack_cleanup();
 }
 
+/* decode a PTWRITE payload and run SideStack logic */
+static inline void
+sidestack_policy(uint32_t ptw_value)
+{
+	uint32_t op = ptw_value >> 30;
+	uint32_t addr;
+	switch (op){
+		case 0x3:
+			addr = (ptw_value << 2) >> 2;
+			sidestack_pop(addr);
+			break;
+		case 0x0:
+			sidestack_push(ptw_value);
+			break;
+		case 0x1:
+			/* context switch: the low 30 bits are the TID to follow */
+			sidestack_switch(SIDESTACK_CTX_TID(ptw_value & 0x3FFFFFFF));
+			break;
+		default:
+			printf("Encountered invalid SideStack opcode %x!\n", op);
+	}
+}
+
+#if FAST_SCAN
+/*
+ * Index of the first extension opcode in local_ptr[i, end), or end.
+ * Packets are usually a few bytes apart, so look at one word at a time
+ * first and only hand long PAD runs to memchr.
+ */
+static inline unsigned long long
+skip_to_ext(const char *local_ptr, unsigned long long i, unsigned long long end)
+{
+	const uint64_t ones = 0x0101010101010101ULL;
+	uint64_t word, hit;
+	char *next;
+
+	/* local_ptr[i] is known not to match; packets are often back to back */
+	if (++i < end && local_ptr[i] == pt_opc_ext)
+		return i;
+
+	if (i + 8 <= end) {
+		memcpy(&word, local_ptr + i, 8);
+		word ^= ones * pt_opc_ext;
+		/* the lowest set bit marks the first byte equal to the opcode */
+		hit = (word - ones) & ~word & (ones << 7);
+		if (hit)
+			return i + (__builtin_ctzll(hit) >> 3);
+		i += 8;
+	}
+
+	next = memchr(local_ptr + i, pt_opc_ext, end - i);
+	return next ? (unsigned long long)(next - local_ptr) : end;
+}
+#endif
+
+/* run the queued PTWRITEs in trace order */
+static inline void
+flush_ptw_batch(void)
+{
+	for (int n = 0; n < ptw_nbatch; n++)
+		sidestack_policy(ptw_batch[n]);
+	ptw_nbatch = 0;
+}
+
 unsigned long long
 process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bool overflow, bool wrap, bool last_read)
 {
@@ -278,6 +450,15 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 		//if(last_read && (i > topa_end - *buf))
 		//	break;
 
+#if FAST_SCAN
+		/* everything but the extension opcode is skipped: find the next one */
+		if (local_ptr[i] != pt_opc_ext) {
+			i = skip_to_ext(local_ptr, i, read_until);
+			if (i >= read_until)
+				break;
+		}
+#endif
+
 		/* Load the current packet opcode byte */
 		packet_opcode = local_ptr[i];
 
@@ -305,27 +486,20 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 							/* Load 4 bytes of PTWRITE data (32-bit values only) */
 							uint32_t ptw_value = *(uint32_t*)(local_ptr + i + 1);
 							// printf("ptwrite %x\n", ptw_value);
+							ptw_packets++;
 
-							/* Decode value and run SideStack logic */
-							uint32_t op = ptw_value >> 30;
-							uint32_t addr;
-							switch (op){
-								case 0x3:
-									addr = (ptw_value << 2) >> 2;
-									sidestack_pop(addr);
-									break;
-								case 0x0:
-									sidestack_push(ptw_value);
-									break;
-								default:
-									printf("Encountered invalid SideStack opcode %x!\n", op);
-							}
+							/* Queue the value; the policy runs once per batch */
+							ptw_batch[ptw_nbatch++] = ptw_value;
+							if (ptw_nbatch == PTW_BATCH)
+								flush_ptw_batch();
 
 							i+=4;
 
 							/* Handled overflow buffer - no need to go further */
-							if(overflow)
+							if(overflow) {
+								flush_ptw_batch();
 								return i;
+							}
 
 							break;
 						}
@@ -342,6 +516,22 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 						i += 2;
 						break;
 
+					/* Ext PIP (0x43): CR3 of the address space that runs next */
+					case pt_ext_pip: {
+						uint64_t pip_value = *(uint64_t*)(local_ptr + i + 1) & 0xFFFFFFFFFFFFULL;
+
+						/* queued PTWRITEs belong to the previous stack */
+						flush_ptw_batch();
+						sidestack_switch((pip_value >> pt_pl_pip_shr) << pt_pl_pip_shl);
+
+						i += pt_pl_pip_size;
+
+						/* Handled overflow buffer - no need to go further */
+						if(overflow)
+							return i;
+						break;
+					}
+
 					/* Ext PSBEnd (0x23) */
 					case pt_ext_psbend:
 						i++;
@@ -364,6 +554,9 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 
 		//printf("------------------\n");
 	}
+
+	/* Every PTWRITE before a returned offset must have been checked */
+	flush_ptw_batch();
 	
 	/* Take the slow path to check if a PTWRITE has been cut off */
 	if(!overflow){
@@ -376,7 +569,8 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 				case 0x02:
 					i++;
 					packet_opcode = local_ptr[i];
-					if ((packet_opcode & pt_opm_ptw) == pt_ext_ptw){
+					if ((packet_opcode & pt_opm_ptw) == pt_ext_ptw ||
+							packet_opcode == pt_ext_pip){
 						//printf("Found cutoff PTWRITE!\n");
 						if(wrap){
 							i--;
@@ -410,10 +604,122 @@ process_trace_data(char* buf, unsigned long buf_ofst, unsigned long read_tgt, bo
 
 	return buf_ofst + i;
 }
+/*
+ * Feed a recorded trace through process_trace_data() in chunks of
+ * chunk_sz bytes, the same way read_topa() walks the ToPA, and report
+ * the decoder throughput.
+ */
+void
+replay_trace(const char *path, size_t chunk_sz, bool preload)
+{
+	struct stat st;
+	struct timespec start, stop;
+	unsigned long long ofst = 0, end, trace_sz;
+	char *trace, *tail;
+	int tfd;
+
+	tfd = open(path, O_RDONLY);
+	if (tfd < 0) {
+		printf("Failed to open trace %s: %s\n", path, strerror(errno));
+		exit(EXIT_FAILURE);
+	}
+
+	if (fstat(tfd, &st) < 0 || st.st_size == 0) {
+		printf("Failed to stat trace %s or trace is empty\n", path);
+		exit(EXIT_FAILURE);
+	}
+	trace_sz = st.st_size;
+
+	if (preload) {
+		/* copy the whole trace in memory so that I/O is not timed */
+		trace = (char *)malloc(trace_sz);
+		if (trace == NULL) {
+			printf("Failed to allocate %llu bytes for trace\n", trace_sz);
+			exit(EXIT_FAILURE);
+		}
+		for (ofst = 0; ofst < trace_sz; ) {
+			ssize_t n = read(tfd, trace + ofst, trace_sz - ofst);
+			if (n <= 0) {
+				printf("Failed to read trace %s\n", path);
+				exit(EXIT_FAILURE);
+			}
+			ofst += n;
+		}
+		ofst = 0;
+	} else {
+		trace = (char *)mmap(0, trace_sz, PROT_READ, MAP_PRIVATE | MAP_POPULATE,
+				tfd, 0x0);
+		if (trace == MAP_FAILED) {
+			printf("Failed to mmap trace %s\n", path);
+			exit(EXIT_FAILURE);
+		}
+	}
+
+	/* allocate overflow decoder */
+	overflow_buf = (char*)malloc(16);
+
+	/* the tail gets up to a chunk plus a cut-off packet, zero padded */
+	tail = (char*)calloc(1, chunk_sz + 32);
+	if (overflow_buf == NULL || tail == NULL) {
+		printf("Failed to allocate replay buffers\n");
+		exit(EXIT_FAILURE);
+	}
+
+	clock_gettime(CLOCK_MONOTONIC, &start);
+
+	/* full chunks; a PTWRITE cut at a chunk end is picked up by the next one */
+	for (end = chunk_sz; end < trace_sz; end += chunk_sz)
+		ofst = process_trace_data(trace, ofst, (unsigned long)trace + end,
+				false, false, false);
+
+	/* last chunk, padded so the fast path never reads past the trace */
+	memcpy(tail, trace + ofst, trace_sz - ofst);
+	process_trace_data(tail, 0, (unsigned long)tail + (trace_sz - ofst) + 10,
+			false, false, false);
+
+	clock_gettime(CLOCK_MONOTONIC, &stop);
+
+	bytes_written = trace_sz;
+
+	double decode_time = (stop.tv_sec - start.tv_sec) +
+		(stop.tv_nsec - start.tv_nsec) / 1000000000.0;
+
+	printf("Trace bytes = %llu\n", bytes_written);
+	printf("PTWRITE packets = %llu\n", ptw_packets);
+	printf("Decode time = %.6f s\n", decode_time);
+	printf("Bytes/s = %.2f\n", bytes_written / decode_time);
+	printf("PTWRITE/s = %.2f\n", ptw_packets / decode_time);
+
+	free(tail);
+	free(overflow_buf);
+	if (preload)
+		free(trace);
+	else
+		munmap(trace, trace_sz);
+	close(tfd);
+}
+
+void
+usage(const char *prog)
+{
+	printf("Usage: %s [-o] [-w mode] [-r trace [-c chunk] [-l]]\n", prog);
+	printf("  -o        record the raw ToPA data to " TRACE_OUT "\n");
+	printf("  -r trace  replay a recorded trace instead of reading /dev/ptw\n");
+	printf("  -c chunk  replay chunk size in bytes (default page size)\n");
+	printf("  -l        load the trace in memory before replaying instead of mmap\n");
+	printf("  -w mode   wait for data with sleep (default), spin, adaptive or poll\n");
+}
+
 int
 main(int argc, char *argv[])
 {
 	int enforce = 0;
+	int opt;
+	unsigned int n;
+	char *replay_path = NULL;
+	bool record = false;
+	size_t chunk_sz = PAGE_SIZE;
+	bool preload = false;
 
 	struct sigaction sig;
 	sig.sa_sigaction = signal_handler;
@@ -426,6 +732,43 @@ main(int argc, char *argv[])
 	/* set up signal handler */
 	sigaction(SIGUSR1, &sig, NULL);
 
+	while ((opt = getopt(argc, argv, "or:c:lw:h")) != -1) {
+		switch (opt) {
+		case 'o':
+			record = true;
+			break;
+		case 'r':
+			replay_path = optarg;
+			break;
+		case 'c':
+			chunk_sz = strtoul(optarg, NULL, 0);
+			break;
+		case 'l':
+			preload = true;
+			break;
+		case 'w':
+			for (n = 0; n < sizeof(wait_names) / sizeof(wait_names[0]); n++) {
+				if (strcmp(optarg, wait_names[n]) == 0)
+					break;
+			}
+			if (n == sizeof(wait_names) / sizeof(wait_names[0])) {
+				printf("Unknown wait strategy %s\n", optarg);
+				usage(argv[0]);
+				exit(EXIT_FAILURE);
+			}
+			wait_mode = (enum wait_mode)n;
+			break;
+		default:
+			usage(argv[0]);
+			exit(opt == 'h' ? EXIT_SUCCESS : EXIT_FAILURE);
+		}
+	}
+
+	if (chunk_sz < REPLAY_MIN_CHUNK) {
+		printf("Replay chunk must be at least %d bytes\n", REPLAY_MIN_CHUNK);
+		exit(EXIT_FAILURE);
+	}
+
 #if 0
 	printf("This is the SideStack monitor.\n");
 	printf("Processing  : Concurrent\n");
@@ -442,6 +785,22 @@ main(int argc, char *argv[])
 	/* initialize sidestack */
 	sidestack_init();
 
+	/* offline mode: decode a recorded trace and exit */
+	if (replay_path) {
+		replay_trace(replay_path, chunk_sz, preload);
+		sidestack_deinit();
+		return 0;
+	}
+
+	/* open output trace file */
+	if (record) {
+		trace_out = fopen(TRACE_OUT, "wb");
+		if (trace_out == NULL) {
+			printf("Failed to open %s: %s\n", TRACE_OUT, strerror(errno));
+			exit(EXIT_FAILURE);
+		}
+	}
+
 	/* initialize for trace capturing */
 	pt_init();
 
@@ -477,9 +836,15 @@ main(int argc, char *argv[])
 	printf("CPU usage = %.2f%%\n", cpu_usage);
   #endif
 
+	printf("Data wakeups = %llu\n", data_wakeups);
+	printf("Empty wakeups = %llu\n", empty_wakeups);
+
 	/* cleanup trace capturing */
 	pt_destroy();
 
+	if (trace_out)
+		fclose(trace_out);
+
 	/* cleanup sidestack */
 	sidestack_deinit();
 
@@ -5,38 +5,332 @@
 #include <stdint.h>
 #include <stdbool.h>
 #include <stdlib.h>
+#include <unistd.h>
+#include <sys/mman.h>
 
 #define SIDESTACK_API_DEBUG 0
 #define SIDESTACK_STATS 1
-#define SIDESTACK_STACK_SIZE 16384
+
+/*
+ * Every shadow stack reserves address space for SIDESTACK_MAX_ENTRIES up
+ * front but only makes SIDESTACK_STACK_SIZE entries (rounded up to a
+ * page) accessible, then doubles that as calls nest deeper. Both ends of
+ * the reservation are PROT_NONE guard pages, so an access that gets past
+ * the bounds checks faults instead of corrupting other stacks.
+ */
+#define SIDESTACK_STACK_SIZE 1024
+#define SIDESTACK_MAX_ENTRIES (1UL << 24)
+
+/*
+ * One shadow stack per traced context: a CR3 from PIP packets or a TID
+ * from SideStack context PTWRITEs. Contexts live in an open-addressed
+ * hash table keyed by that ID, with TIDs tagged so that they never equal
+ * a CR3. The active stack is kept in the shstk_* globals below so push
+ * and pop never look at the table; sidestack_switch() parks it in its
+ * context and loads the next one.
+ * The trace does not say when a thread or process exits, so the contexts
+ * are also kept in a list from most to least recently switched to. Once
+ * SIDESTACK_MAX_CTX contexts exist, a new one takes over the stack of
+ * the last context in that list.
+ */
+#define SIDESTACK_CTX_NONE 0ULL         /* context before the first switch */
+#define SIDESTACK_CTX_TID(tid) ((1ULL << 63) | (tid))  /* above any CR3 */
+#define SIDESTACK_CTX_MIN_BITS 6
+#define SIDESTACK_MAX_CTX 16384
+
+struct sidestack_ctx {
+    uint64_t id;
+    struct sidestack_ctx *prev;     /* more recently switched to */
+    struct sidestack_ctx *next;     /* less recently switched to */
+    void *map;
+    size_t map_size;
+    uint32_t *base;
+    uint32_t *curr;
+    uint32_t *limit;
+    uint32_t *end;
+};
 
 uint32_t *shstk_base = NULL;
 uint32_t *shstk_curr = NULL;
+uint32_t *shstk_limit = NULL;   /* end of the accessible entries */
+uint32_t *shstk_end = NULL;     /* end of the reservation */
+
+struct sidestack_ctx **shstk_ctxs = NULL;
+uint64_t shstk_ctx_mask = 0;
+unsigned shstk_ctx_bits = 0;
+unsigned long shstk_nctxs = 0;
+struct sidestack_ctx *shstk_ctx = NULL;    /* owner of the active stack */
+struct sidestack_ctx *shstk_lru_first = NULL;
+struct sidestack_ctx *shstk_lru_last = NULL;
 
 unsigned long long int shstk_pushes, shstk_pops = 0ULL;
+unsigned long long int shstk_max_depth = 0ULL;
+unsigned long long int shstk_underflows = 0ULL;
+unsigned long long int shstk_grows = 0ULL;
+unsigned long long int shstk_switches = 0ULL;
+unsigned long long int shstk_evictions = 0ULL;
 
-void sidestack_initialize(){
-    // Initialize a sidestack of size defined above
-    shstk_base = (uint32_t*)malloc(sizeof(uint32_t) * SIDESTACK_STACK_SIZE);
-    if(shstk_base == NULL){
+struct sidestack_ctx *sidestack_ctx_new(uint64_t id){
+    size_t page = sysconf(_SC_PAGE_SIZE);
+    size_t initial = sizeof(uint32_t) * SIDESTACK_STACK_SIZE;
+    struct sidestack_ctx *ctx;
+
+    ctx = (struct sidestack_ctx*)calloc(1, sizeof(*ctx));
+    if(ctx == NULL){
+        fprintf(stderr, "Failed to allocate shadow stack context.");
+        exit(1);
+    }
+    ctx->id = id;
+
+    // Reserve the whole stack plus a guard page on each side
+    ctx->map_size = sizeof(uint32_t) * SIDESTACK_MAX_ENTRIES + 2 * page;
+    ctx->map = mmap(NULL, ctx->map_size, PROT_NONE,
+            MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+    if(ctx->map == MAP_FAILED){
+        fprintf(stderr, "Failed to reserve shadow stack.");
+        exit(1);
+    }
+    ctx->base = (uint32_t*)((char*)ctx->map + page);
+    ctx->end = ctx->base + SIDESTACK_MAX_ENTRIES;
+
+    // Make the initial part of the stack accessible
+    initial = (initial + page - 1) & ~(page - 1);
+    if(mprotect(ctx->base, initial, PROT_READ | PROT_WRITE) != 0){
         fprintf(stderr, "Failed to allocate shadow stack.");
         exit(1);
     }
-    shstk_curr = shstk_base;
+    ctx->limit = ctx->base + initial / sizeof(uint32_t);
+    ctx->curr = ctx->base;
+    return ctx;
+}
+
+static inline uint64_t sidestack_ctx_hash(uint64_t id, unsigned bits){
+    // fibonacci hashing, as for the SideCFI typemap
+    return (id * 0x9E3779B97F4A7C15ULL) >> (64 - bits);
+}
+
+void sidestack_ctx_place(struct sidestack_ctx *ctx){
+    uint64_t i = sidestack_ctx_hash(ctx->id, shstk_ctx_bits);
+
+    while (shstk_ctxs[i] != NULL)
+        i = (i + 1) & shstk_ctx_mask;
+    shstk_ctxs[i] = ctx;
+}
+
+// Rehash into a table twice as large (or the initial one)
+void sidestack_ctx_resize(){
+    struct sidestack_ctx **old = shstk_ctxs;
+    uint64_t old_mask = shstk_ctx_mask;
+
+    shstk_ctx_bits = old ? shstk_ctx_bits + 1 : SIDESTACK_CTX_MIN_BITS;
+    shstk_ctx_mask = (1ULL << shstk_ctx_bits) - 1;
+    shstk_ctxs = (struct sidestack_ctx**)calloc(shstk_ctx_mask + 1,
+            sizeof(*shstk_ctxs));
+    if(shstk_ctxs == NULL){
+        fprintf(stderr, "Failed to allocate shadow stack contexts.");
+        exit(1);
+    }
+
+    if (old == NULL)
+        return;
+    for (uint64_t i = 0; i <= old_mask; ++i) {
+        if (old[i] != NULL)
+            sidestack_ctx_place(old[i]);
+    }
+    free(old);
+}
+
+// Take the context in slot i out of the table, moving the contexts probed
+// after it back so that lookups still find them
+void sidestack_ctx_remove(uint64_t i){
+    uint64_t j = i;
+    uint64_t home;
+
+    for (;;) {
+        j = (j + 1) & shstk_ctx_mask;
+        if (shstk_ctxs[j] == NULL)
+            break;
+        home = sidestack_ctx_hash(shstk_ctxs[j]->id, shstk_ctx_bits);
+        // Leave it if its home slot lies cyclically in (i, j]
+        if (((j - home) & shstk_ctx_mask) < ((j - i) & shstk_ctx_mask))
+            continue;
+        shstk_ctxs[i] = shstk_ctxs[j];
+        i = j;
+    }
+    shstk_ctxs[i] = NULL;
+}
+
+void sidestack_lru_unlink(struct sidestack_ctx *ctx){
+    if (ctx->prev)
+        ctx->prev->next = ctx->next;
+    else
+        shstk_lru_first = ctx->next;
+    if (ctx->next)
+        ctx->next->prev = ctx->prev;
+    else
+        shstk_lru_last = ctx->prev;
+}
+
+void sidestack_lru_push(struct sidestack_ctx *ctx){
+    ctx->prev = NULL;
+    ctx->next = shstk_lru_first;
+    if (shstk_lru_first)
+        shstk_lru_first->prev = ctx;
+    else
+        shstk_lru_last = ctx;
+    shstk_lru_first = ctx;
+}
+
+// Take the least recently used context out of the table and hand its
+// stack, emptied but still mapped, to id
+struct sidestack_ctx *sidestack_ctx_recycle(uint64_t id){
+    struct sidestack_ctx *ctx = shstk_lru_last;
+    uint64_t i;
+
+    for (i = sidestack_ctx_hash(ctx->id, shstk_ctx_bits); shstk_ctxs[i] != ctx;
+            i = (i + 1) & shstk_ctx_mask)
+        ;
+#if SIDESTACK_API_DEBUG
+    printf("SideStack evicted context 0x%lx\n", (unsigned long)ctx->id);
+#endif
+    sidestack_ctx_remove(i);
+    sidestack_lru_unlink(ctx);
+    shstk_nctxs--;
+#if SIDESTACK_STATS
+    shstk_evictions++;
+#endif
+
+    ctx->id = id;
+    ctx->curr = ctx->base;
+    return ctx;
+}
+
+// Find the context of id, creating it on first use
+struct sidestack_ctx *sidestack_ctx_get(uint64_t id){
+    struct sidestack_ctx *ctx;
+    uint64_t i;
+
+    for (i = sidestack_ctx_hash(id, shstk_ctx_bits); shstk_ctxs[i] != NULL;
+            i = (i + 1) & shstk_ctx_mask) {
+        if (shstk_ctxs[i]->id == id)
+            return shstk_ctxs[i];
+    }
+
+    if (shstk_nctxs == SIDESTACK_MAX_CTX) {
+        ctx = sidestack_ctx_recycle(id);
+    } else {
+        // Keep the table at most half full
+        if ((shstk_nctxs + 1) * 2 > shstk_ctx_mask + 1)
+            sidestack_ctx_resize();
+        ctx = sidestack_ctx_new(id);
+    }
+    sidestack_ctx_place(ctx);
+    sidestack_lru_push(ctx);
+    shstk_nctxs++;
+    return ctx;
+}
+
+// Park the active stack in its context and make id's stack active
+void sidestack_switch(uint64_t id){
+    if (shstk_ctx->id == id)
+        return;
+
+    shstk_ctx->curr = shstk_curr;
+    shstk_ctx->limit = shstk_limit;
+
+    shstk_ctx = sidestack_ctx_get(id);
+    if (shstk_ctx != shstk_lru_first) {
+        sidestack_lru_unlink(shstk_ctx);
+        sidestack_lru_push(shstk_ctx);
+    }
+    shstk_base = shstk_ctx->base;
+    shstk_curr = shstk_ctx->curr;
+    shstk_limit = shstk_ctx->limit;
+    shstk_end = shstk_ctx->end;
+#if SIDESTACK_STATS
+    shstk_switches++;
+#endif
+#if SIDESTACK_API_DEBUG
+    printf("SideStack switched to context 0x%lx\n", (unsigned long)id);
+#endif
+}
+
+void sidestack_initialize(){
+    // Start with the context of a trace that carries no context IDs
+    sidestack_ctx_resize();
+    shstk_ctx = sidestack_ctx_get(SIDESTACK_CTX_NONE);
+    shstk_base = shstk_ctx->base;
+    shstk_curr = shstk_ctx->curr;
+    shstk_limit = shstk_ctx->limit;
+    shstk_end = shstk_ctx->end;
 #if SIDESTACK_API_DEBUG
     printf("SideStack initialized at %p\n", (void *)shstk_base);
 #endif
 }
 
 void sidestack_cleanup(){
-    if (shstk_base != NULL) {
-	    //free(shstk_base);
-	    shstk_base = NULL;
-	    shstk_curr = NULL;
+    unsigned long long committed = 0;
+
+    if (shstk_ctx == NULL)
+        return;
+
+    // Park the active stack so every context is up to date
+    shstk_ctx->curr = shstk_curr;
+    shstk_ctx->limit = shstk_limit;
+
+    for (uint64_t i = 0; i <= shstk_ctx_mask; ++i) {
+        struct sidestack_ctx *ctx = shstk_ctxs[i];
+        if (ctx == NULL)
+            continue;
+        committed += ctx->limit - ctx->base;
+        munmap(ctx->map, ctx->map_size);
+        free(ctx);
     }
 #if SIDESTACK_STATS
-    printf("Pushes: %llu\n", shstk_pushes);
-    printf("Pops  : %llu\n", shstk_pops);
+    // One JSON object per run so the results can be parsed as is
+    printf("{\"pushes\": %llu, \"pops\": %llu, \"max_depth\": %llu, "
+            "\"underflows\": %llu, \"grows\": %llu, \"contexts\": %lu, "
+            "\"switches\": %llu, \"evictions\": %llu, \"committed\": %llu}\n",
+            shstk_pushes, shstk_pops, shstk_max_depth, shstk_underflows,
+            shstk_grows, shstk_nctxs, shstk_switches, shstk_evictions,
+            committed);
+#endif
+    free(shstk_ctxs);
+    shstk_ctxs = NULL;
+    shstk_ctx = NULL;
+    shstk_lru_first = NULL;
+    shstk_lru_last = NULL;
+    shstk_nctxs = 0;
+    shstk_base = NULL;
+    shstk_curr = NULL;
+    shstk_limit = NULL;
+    shstk_end = NULL;
+}
+
+// Double the accessible part of the active stack
+void sidestack_grow(){
+    size_t grow = shstk_limit - shstk_base;
+
+    if (shstk_limit == shstk_end) {
+        fprintf(stderr, "SideStack overflow: more than %lu nested calls\n",
+                SIDESTACK_MAX_ENTRIES);
+        exit(1);
+    }
+    if (grow > (size_t)(shstk_end - shstk_limit))
+        grow = shstk_end - shstk_limit;
+
+    if (mprotect(shstk_limit, sizeof(uint32_t) * grow,
+                PROT_READ | PROT_WRITE) != 0) {
+        fprintf(stderr, "Failed to grow shadow stack.");
+        exit(1);
+    }
+    shstk_limit += grow;
+#if SIDESTACK_STATS
+    shstk_grows++;
+#endif
+#if SIDESTACK_API_DEBUG
+    printf("SideStack grown to %lu entries\n",
+            (unsigned long)(shstk_limit - shstk_base));
 #endif
 }
 
@@ -44,6 +338,9 @@ void sidestack_push(uint32_t addr) {
 #if SIDESTACK_API_DEBUG
     printf("Pushing addr %x at %p\n", addr, (void *)shstk_curr);
 #endif
+    // Grow before writing past the accessible part
+    if (shstk_curr == shstk_limit)
+        sidestack_grow();
     // Push address
     *shstk_curr = addr;
 #if SIDESTACK_API_DEBUG
@@ -56,10 +353,21 @@ void sidestack_push(uint32_t addr) {
 #endif
 #if SIDESTACK_STATS
     shstk_pushes++;
+    if ((unsigned long long)(shstk_curr - shstk_base) > shstk_max_depth)
+        shstk_max_depth = shstk_curr - shstk_base;
 #endif
 }
 
 void sidestack_pop(uint32_t addr) {
+    // Return without a matching call, e.g. from a frame entered before
+    // tracing started: nothing to compare against
+    if (shstk_curr == shstk_base) {
+#if SIDESTACK_STATS
+        shstk_underflows++;
+#endif
+        return;
+    }
+
     // Decrement current pointer to access last used element
     (shstk_curr)--;
 #if SIDESTACK_API_DEBUG
@@ -15,11 +15,18 @@
 #
 # Please cite accordingly.
 
+import hashlib
+import json
 import os
+import queue
+import re
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import psutil
 
@@ -94,6 +101,12 @@ funcs = [
     "homebrew",
 ]
 
+# Attacks each attack_gen build found impossible, by the sha256 of the build
+feasibility_cache = os.path.join(script_dir, "feasibility.json")
+
+# Compilers whose attacks are watched by a monitor, one attack at a time
+monitored_compilers = ["clang_sidecfi", "clang_sidestack"]
+
 techniques = []
 repeat_times = 0
 results = {}
@@ -101,12 +114,19 @@ print_OK = True
 print_SOME = True
 print_FAIL = True
 summary_format = "bash"
+jobs = 1
+log_files = False
+use_feasibility_cache = True
+count_only = False
+json_out = None
 
 if len(sys.argv) < 2:
     print(
         "Usage: python "
         + sys.argv[0]
-        + "[direct|indirect|both] <number of times to repeat each test>"
+        + " [direct|indirect|both] <number of times to repeat each test>"
+        + " [compiler] [--jobs=N] [--log-files]"
+        + " [--no-feasibility-cache] [--count] [--json-out=FILE]"
     )
     sys.exit(1)
 else:
@@ -144,6 +164,21 @@ else:
                     print_FAIL = False
             elif "format" in arg:
                 summary_format = arg
+            elif arg.startswith("--jobs="):
+                # Attacks run at once for the compilers without a monitor
+                jobs = int(arg.split("=")[1])
+            elif arg == "--log-files":
+                # Run the attacks through the shell, with their output in /tmp
+                log_files = True
+            elif arg == "--no-feasibility-cache":
+                # Run the attacks known to be impossible too
+                use_feasibility_cache = False
+            elif arg == "--count":
+                # Only print the size of the matrix, without running attacks
+                count_only = True
+            elif arg.startswith("--json-out="):
+                # One JSON record per attack, for tools/ripe_results.py
+                json_out = arg.split("=", 1)[1]
             i += 1
 
 
@@ -219,20 +254,325 @@ def analyze_log(log_entry, additional_info):
     return additional_info
 
 
-def analyze_log2(additional_info):
-    for i in range(1, repeat_times + 1):
-        log_entry2 = open(f"/tmp/ripe_log2{i}", "r").read()
-        if "Segmentation fault" in log_entry2:
-            additional_info += [red("SEGFAULT")]
-        elif "Bus error" in log_entry2:
-            additional_info += [red("BUSERROR")]
-        elif "Illegal instruction" in log_entry2:
-            additional_info += [red("SIGILL")]
+# Signals that end an attack, and how the shell reports them
+attack_signals = {
+    signal.SIGSEGV: ("SEGFAULT", "Segmentation fault"),
+    signal.SIGBUS: ("BUSERROR", "Bus error"),
+    signal.SIGILL: ("SIGILL", "Illegal instruction"),
+}
+
+
+# Defenses that report an attack, as in the additional info
+detectors = ["SideCFI", "SideStack", "ASAN"]
+
+
+def signal_name(signum):
+    if signum in attack_signals:
+        return attack_signals[signum][0]
+    return signal.Signals(signum).name
+
+
+def plain(string):
+    return re.sub("\033\\[[0-9;]*m", "", string)
+
+
+def shell_signal(log_entry2):
+    for signum, (_, message) in attack_signals.items():
+        if message in log_entry2:
+            return signum
+    return None
+
+
+def analyze_signals(signals, additional_info):
+    for signum in signals:
+        if signum in attack_signals:
+            additional_info += [red(attack_signals[signum][0])]
     return additional_info
 
 
-if not os.path.exists("/tmp/ripe-eval"):
-    os.system("mkdir /tmp/ripe-eval")
+def attack_gen_path(compiler):
+    return os.path.join(script_dir, "build", f"{compiler}_attack_gen")
+
+
+def binary_hash(compiler):
+    path = attack_gen_path(compiler)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_feasibility():
+    # {binary hash: {"<tech> <loc> <ptr> <attack> <func>": possible}}
+    if not os.path.exists(feasibility_cache):
+        return {}
+    with open(feasibility_cache, "r") as f:
+        return json.load(f)
+
+
+def save_feasibility(feasibility):
+    with open(feasibility_cache + ".tmp", "w") as f:
+        json.dump(feasibility, f, indent=1, sort_keys=True)
+    os.replace(feasibility_cache + ".tmp", feasibility_cache)
+
+
+class Workspace:
+    # Files of the attempts at one attack: the logs and the marker file the
+    # shell spawned by a successful attack creates. The attacks also run in
+    # the directory, as the fscanf ones write ./fscanf_temp_file.
+    def __init__(self, directory, marker_dir=None):
+        self.directory = directory
+        self.log = os.path.join(directory, "ripe_log")
+        self.monitor_log = os.path.join(directory, "ripe_log_monitor")
+        self.marker = os.path.join(marker_dir or directory, "f_xxxx")
+
+    def log2(self, i):
+        return os.path.join(self.directory, f"ripe_log2{i}")
+
+
+# Shared by all attacks when they run one at a time
+shared_workspace = Workspace("/tmp", "/tmp/ripe-eval")
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def run_attack_gen(compiler, parameters_str, workspace, cpu, timeout):
+    # Runs the attack without a shell, returns its output and the signal
+    # that ended it. A successful attack's shell reads the touch command.
+    command = [attack_gen_path(compiler)] + parameters_str.split()
+    if cpu is not None:
+        command = ["taskset", "-c", str(cpu)] + command
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=workspace.directory,
+        start_new_session=True,
+    )
+
+    touch = f"touch {workspace.marker}\n".encode()
+    try:
+        output, _ = process.communicate(touch, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # Also kills the shell of the attack, which holds on to the pipe
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+
+    log_entry = parameters_str + "\n" + output.decode(errors="replace")
+    signum = -process.returncode if process.returncode < 0 else None
+    return log_entry, signum
+
+
+def run_attack_gen_shell(compiler, parameters_str, workspace, cpu, timeout, i):
+    # Runs the attack through the shell, with its output in the logs of the
+    # workspace
+    with open(workspace.log, "w") as f:
+        f.write(parameters_str + "\n")
+
+    taskset = f"taskset -c {cpu} " if cpu is not None else ""
+    attack_gen = attack_gen_path(compiler)
+    cmdline = f'(cd {workspace.directory} && echo "touch {workspace.marker}" | {taskset}{attack_gen} {parameters_str} >> {workspace.log} 2>&1) 2> {workspace.log2(i)}'
+    if timeout is None:
+        os.system(cmdline)
+    else:
+        process = subprocess.Popen(
+            cmdline,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        try:
+            process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.kill(process.pid, signal.SIGTERM)
+
+    log_entry = open(workspace.log, "r").read()
+    return log_entry, shell_signal(open(workspace.log2(i), "r").read())
+
+
+def run_attempt(compiler, parameters_str, i, workspace, cpu):
+    # One attempt at an attack, returns its output, the monitor's log and the
+    # signal that ended the attack
+    sidecfi_used = compiler == "clang_sidecfi"
+    sidestack_used = compiler == "clang_sidestack"
+
+    sys.stdout.write(f"... Running {parameters_str} ...\n")
+    sys.stdout.flush()
+
+    def attack(cpu, timeout):
+        if log_files:
+            return run_attack_gen_shell(
+                compiler, parameters_str, workspace, cpu, timeout, i
+            )
+        return run_attack_gen(compiler, parameters_str, workspace, cpu, timeout)
+
+    # The monitor writes to a log opened here, so it exists however early
+    # the attack ends
+    if sidecfi_used:
+        with open(workspace.monitor_log, "w") as log, subprocess.Popen(
+            [sidecfi_monitor], stdout=log
+        ) as monitor:
+            log_entry, signum = attack(cpu, 2)
+
+            # check if the main has been terminated
+            # and if monitor is still running
+            # and send SIGUSR1 to the monitor
+            if psutil.pid_exists(monitor.pid):
+                os.kill(monitor.pid, signal.SIGUSR1)
+
+            # Wait for the monitor to finish before proceeding
+            monitor.wait()
+            try:
+                monitor.wait(timeout=2)  # 10 second timeout for monitor
+            except subprocess.TimeoutExpired:
+                os.kill(monitor.pid, signal.SIGUSR1)
+
+            # Sleep to avoid overwhelming the system
+            # time.sleep(0.3)
+    elif sidestack_used:
+        with open(workspace.monitor_log, "w") as log, subprocess.Popen(
+            [sidestack_monitor], stdout=log
+        ) as monitor:
+            log_entry, signum = attack(None, None)
+            monitor.wait()
+    else:
+        log_entry, signum = attack(cpu, 2)
+
+    monitor_log = ""
+    if sidecfi_used or sidestack_used:
+        monitor_log = open(workspace.monitor_log, "r").read()
+        remove_file(workspace.monitor_log)
+    return log_entry, monitor_log, signum
+
+
+def run_attack(compiler, parameters, workspace, cpu=0):
+    # All attempts at one attack, returns
+    # (attack_possible, s_attempts, additional_info, parameters_str, record)
+    # where the record has the attempts, their signals and the elapsed time
+    started = time.time()
+    i = 0
+    s_attempts = 0
+    attack_possible = 1
+    additional_info = []
+    signals = []
+
+    sidecfi_used = compiler == "clang_sidecfi"
+    sidestack_used = compiler == "clang_sidestack"
+    parameters_str = "-t %8s -l %5s -c %18s -i %16s -f %8s" % parameters
+
+    while i < repeat_times:
+        i += 1
+
+        log_entry, monitor_log, signum = run_attempt(
+            compiler, parameters_str, i, workspace, cpu
+        )
+        signals.append(signum)
+        if "Impossible" in log_entry:
+            attack_possible = 0
+            break
+
+        additional_info = analyze_log(log_entry, additional_info)
+
+        if sidecfi_used or sidestack_used:
+            additional_info = analyze_log(monitor_log, additional_info)
+
+        if os.path.exists(workspace.marker):
+            remove_file(workspace.marker)
+            if sidecfi_used and "CFI CHECK ERROR" not in monitor_log:
+                s_attempts += 1
+            elif sidestack_used:
+                additional_info = analyze_signals(
+                    signals, additional_info
+                )  # Analyze additional info for errors
+
+                if (
+                    "-Violation-" not in monitor_log
+                    and "SEGFAULT" not in additional_info
+                    and "BUSERROR" not in additional_info
+                    and "SIGILL" not in additional_info
+                ):
+                    s_attempts += 1
+            elif not sidecfi_used and not sidestack_used:
+                s_attempts += 1
+
+    # The logs of FAIL and SOME attacks tell why they failed
+    if attack_possible and s_attempts < repeat_times:
+        additional_info = analyze_signals(signals, additional_info)
+
+    record = {
+        "attempts": i,
+        "signals": [signal_name(signum) if signum else None for signum in signals],
+        "elapsed_s": round(time.time() - started, 3),
+    }
+    return attack_possible, s_attempts, additional_info, parameters_str, record
+
+
+def attack_record(compiler, parameters, outcome, s_attempts, additional_info):
+    info = sorted(set(plain(x) for x in additional_info))
+    signal_names = [name for name, _ in attack_signals.values()]
+    return {
+        "compiler": compiler,
+        "technique": parameters[0],
+        "location": parameters[1],
+        "code_ptr": parameters[2],
+        "attack": parameters[3],
+        "function": parameters[4],
+        "outcome": outcome,
+        "successes": s_attempts,
+        "repeat": repeat_times,
+        "detections": [x for x in info if x in detectors],
+        "notes": [x for x in info if x not in detectors and x not in signal_names],
+    }
+
+
+def run_attack_isolated(compiler, parameters, cpus):
+    # Runs an attack in a private workspace, pinned to a CPU of its own
+    cpu = cpus.get()
+    directory = tempfile.mkdtemp(prefix="ripe-")
+    try:
+        return run_attack(compiler, parameters, Workspace(directory), cpu)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        cpus.put(cpu)
+
+
+def run_attacks(compiler, all_parameters):
+    # Outcomes of the attacks, in order. Up to `jobs` attacks run at once,
+    # except under a monitor.
+    if jobs <= 1 or compiler in monitored_compilers:
+        for parameters in all_parameters:
+            yield run_attack(compiler, parameters, shared_workspace)
+        return
+
+    cpus = queue.Queue()
+    for cpu in sorted(os.sched_getaffinity(0))[:jobs]:
+        cpus.put(cpu)
+    with ThreadPoolExecutor(cpus.qsize()) as pool:
+        yield from pool.map(
+            lambda parameters: run_attack_isolated(compiler, parameters, cpus),
+            all_parameters,
+        )
+
+
+os.makedirs("/tmp/ripe-eval", exist_ok=True)
+
+feasibility = load_feasibility() if use_feasibility_cache or count_only else {}
+
+json_file = open(json_out, "w") if json_out and not count_only else None
+
+
+def write_record(record):
+    if json_file is not None:
+        json_file.write(json.dumps(record) + "\n")
+        json_file.flush()
+
 
 for compiler in compilers:
     total_ok = 0
@@ -250,187 +590,116 @@ for compiler in compilers:
         code_ptr_filtered = code_ptr
         attacks_filtered = attacks
 
-    for tech in techniques:
-        for loc in locations:
-            for ptr in code_ptr_filtered:
-                for attack in attacks_filtered:
-                    for func in funcs:
-                        i = 0
-                        s_attempts = 0
-                        attack_possible = 1
-                        additional_info = []
-
-                        while i < repeat_times:
-                            i += 1
-
-                            sidecfi_used = compiler == "clang_sidecfi"
-                            sidestack_used = compiler == "clang_sidestack"
-
-                            os.system("rm /tmp/ripe_log")
-                            parameters = (tech, loc, ptr, attack, func)
-                            parameters_str = (
-                                "-t %8s -l %5s -c %18s -i %16s -f %8s" % parameters
-                            )
-                            sys.stdout.write(f"... Running {parameters_str} ...\n")
-                            sys.stdout.flush()
-                            os.system(f"echo {parameters_str} >> /tmp/ripe_log")
-
-                            if sidecfi_used:
-                                monitorline = (
-                                    f"{sidecfi_monitor} > /tmp/ripe_log_monitor"
-                                )
-                                with subprocess.Popen(
-                                    monitorline, shell=True
-                                ) as monitor:
-                                    cmdline = f'(echo "touch /tmp/ripe-eval/f_xxxx" | taskset -c 0 ./build/{compiler}_attack_gen {parameters_str} >> /tmp/ripe_log 2>&1) 2> /tmp/ripe_log2{i}'
-                                    process = subprocess.Popen(
-                                        cmdline,
-                                        shell=True,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                    )
-
-                                    try:
-                                        process.communicate(timeout=2)
-                                    except subprocess.TimeoutExpired:
-                                        os.kill(process.pid, signal.SIGTERM)
-
-                                    # check if the main has been terminated
-                                    # and if monitor is still running
-                                    # and send SIGUSR1 to the monitor
-                                    if psutil.pid_exists(monitor.pid):
-                                        os.kill(monitor.pid, signal.SIGUSR1)
-
-                                    # Wait for the monitor to finish before proceeding
-                                    monitor.wait()
-                                    try:
-                                        monitor.wait(
-                                            timeout=2
-                                        )  # 10 second timeout for monitor
-                                    except subprocess.TimeoutExpired:
-                                        os.kill(monitor.pid, signal.SIGUSR1)
-
-                                    # Sleep to avoid overwhelming the system
-                                    # time.sleep(0.3)
-                            elif sidestack_used:
-                                monitorline = (
-                                    f"{sidestack_monitor} > /tmp/ripe_log_monitor"
-                                )
-                                with subprocess.Popen(
-                                    monitorline, shell=True
-                                ) as monitor:
-                                    cmdline = (
-                                        '(echo "touch /tmp/ripe-eval/f_xxxx" | ./build/'
-                                        + compiler
-                                        + "_attack_gen "
-                                        + parameters_str
-                                        + " >> /tmp/ripe_log 2>&1) 2> /tmp/ripe_log2"
-                                        + str(i)
-                                    )
-                                    os.system(cmdline)
-                                    os.wait()
-                                    monitor.wait()
-                            else:
-                                cmdline = f'(echo "touch /tmp/ripe-eval/f_xxxx" | taskset -c 0 ./build/{compiler}_attack_gen {parameters_str} >> /tmp/ripe_log 2>&1) 2> /tmp/ripe_log2{i}'
-                                process = subprocess.Popen(
-                                    cmdline,
-                                    shell=True,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                )
-
-                                try:
-                                    process.communicate(timeout=2)
-                                except subprocess.TimeoutExpired:
-                                    os.kill(process.pid, signal.SIGTERM)
-
-                            log_entry = open("/tmp/ripe_log", "r").read()
-                            if "Impossible" in log_entry:
-                                attack_possible = 0
-                                break
-
-                            additional_info = analyze_log(log_entry, additional_info)
-
-                            if sidecfi_used or sidestack_used:
-                                monitor_log = open("/tmp/ripe_log_monitor", "r").read()
-                                additional_info = analyze_log(
-                                    monitor_log, additional_info
-                                )
-                                os.system("rm -f /tmp/ripe_log_monitor")
-
-                            if os.path.exists("/tmp/ripe-eval/f_xxxx"):
-                                os.system("rm -f /tmp/ripe-eval/f_xxxx")
-                                if (
-                                    sidecfi_used
-                                    and "CFI CHECK ERROR" not in monitor_log
-                                ):
-                                    s_attempts += 1
-                                elif sidestack_used:
-                                    additional_info = analyze_log2(
-                                        additional_info
-                                    )  # Analyze additional info for errors
-
-                                    if (
-                                        "-Violation-" not in monitor_log
-                                        and "SEGFAULT" not in additional_info
-                                        and "BUSERROR" not in additional_info
-                                        and "SIGILL" not in additional_info
-                                    ):
-                                        s_attempts += 1
-                                elif not sidecfi_used and not sidestack_used:
-                                    s_attempts += 1
-
-                        if attack_possible == 0:
-                            total_np += 1
-                            continue
-
-                        # SUCCESS
-                        if s_attempts == repeat_times:
-                            if print_OK:
-                                print(
-                                    "%5s %s %s (%s/%s) %s"
-                                    % (
-                                        compiler,
-                                        parameters_str,
-                                        green("OK", 4),
-                                        s_attempts,
-                                        repeat_times,
-                                        " ".join(set(additional_info)),
-                                    )
-                                )
-                            total_ok += 1
-                        # FAIL
-                        elif s_attempts == 0:
-                            additional_info = analyze_log2(additional_info)
-                            if print_FAIL:
-                                print(
-                                    "%5s %s %6s (%s/%s) %s"
-                                    % (
-                                        compiler,
-                                        parameters_str,
-                                        red("FAIL", 4),
-                                        s_attempts,
-                                        repeat_times,
-                                        " ".join(set(additional_info)),
-                                    )
-                                )
-                            total_fail += 1
-                        # SOME
-                        else:
-                            if print_SOME:
-                                additional_info = analyze_log2(additional_info)
-                                print(
-                                    "%5s %s %6s (%s/%s) %s"
-                                    % (
-                                        compiler,
-                                        parameters_str,
-                                        orange("SOME", 4),
-                                        s_attempts,
-                                        repeat_times,
-                                        " ".join(set(additional_info)),
-                                    )
-                                )
-                            total_some += 1
+    all_parameters = [
+        (tech, loc, ptr, attack, func)
+        for tech in techniques
+        for loc in locations
+        for ptr in code_ptr_filtered
+        for attack in attacks_filtered
+        for func in funcs
+    ]
+
+    # Attacks this build found impossible before are not run again
+    build_hash = binary_hash(compiler)
+    known = feasibility.setdefault(build_hash, {}) if build_hash else {}
+    impossible = [p for p in all_parameters if known.get(" ".join(p)) is False]
+    unchecked = [p for p in all_parameters if " ".join(p) not in known]
+
+    if count_only:
+        print(
+            "%s: %s attacks, %s impossible, %s not checked yet, %s feasible"
+            % (
+                compiler,
+                len(all_parameters),
+                len(impossible),
+                len(unchecked),
+                len(all_parameters) - len(impossible) - len(unchecked),
+            )
+        )
+        continue
+
+    if use_feasibility_cache:
+        total_np += len(impossible)
+        for parameters in impossible:
+            record = attack_record(compiler, parameters, "NP", 0, [])
+            record.update(attempts=0, signals=[], elapsed_s=0.0, cached=True)
+            write_record(record)
+        all_parameters = [
+            p for p in all_parameters if known.get(" ".join(p)) is not False
+        ]
+
+    for parameters, outcome in zip(
+        all_parameters, run_attacks(compiler, all_parameters)
+    ):
+        attack_possible, s_attempts, additional_info, parameters_str, run = outcome
+        known[" ".join(parameters)] = attack_possible == 1
+
+        if attack_possible == 0:
+            status = "NP"
+        elif s_attempts == repeat_times:
+            status = "OK"
+        elif s_attempts == 0:
+            status = "FAIL"
+        else:
+            status = "SOME"
+        record = attack_record(
+            compiler, parameters, status, s_attempts, additional_info
+        )
+        record.update(run, cached=False)
+        write_record(record)
+
+        if attack_possible == 0:
+            total_np += 1
+            continue
+
+        # SUCCESS
+        if s_attempts == repeat_times:
+            if print_OK:
+                print(
+                    "%5s %s %s (%s/%s) %s"
+                    % (
+                        compiler,
+                        parameters_str,
+                        green("OK", 4),
+                        s_attempts,
+                        repeat_times,
+                        " ".join(set(additional_info)),
+                    )
+                )
+            total_ok += 1
+        # FAIL
+        elif s_attempts == 0:
+            if print_FAIL:
+                print(
+                    "%5s %s %6s (%s/%s) %s"
+                    % (
+                        compiler,
+                        parameters_str,
+                        red("FAIL", 4),
+                        s_attempts,
+                        repeat_times,
+                        " ".join(set(additional_info)),
+                    )
+                )
+            total_fail += 1
+        # SOME
+        else:
+            if print_SOME:
+                print(
+                    "%5s %s %6s (%s/%s) %s"
+                    % (
+                        compiler,
+                        parameters_str,
+                        orange("SOME", 4),
+                        s_attempts,
+                        repeat_times,
+                        " ".join(set(additional_info)),
+                    )
+                )
+            total_some += 1
+
+    if build_hash and use_feasibility_cache:
+        save_feasibility(feasibility)
 
     results[compiler] = {
         "total_ok": total_ok,
@@ -439,6 +708,9 @@ for compiler in compilers:
         "total_np": total_np,
     }
 
+if json_file is not None:
+    json_file.close()
+
 total_attacks = total_ok + total_some + total_fail + total_np
 if "bash" in summary_format:
     for compiler in results:
@@ -131,7 +131,7 @@ build_app() {
 run_server() {
 	export LD_LIBRARY_PATH="$OPENSSL_DIR/lib"
 
-	taskset -c 0 $APP_DIR/sbin/named -c $BIND_CONF -n 1 -g
+	taskset -c ${SERVER_CPUS:-0} $APP_DIR/sbin/named -c $BIND_CONF -n 1 -g
 }
 
 # Execute the action
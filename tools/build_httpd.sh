@@ -226,7 +226,7 @@ build_app() {
 
 # Function to run the server
 run_server() {
-    taskset -c 0 $APP_DIR/bin/httpd -k start 
+    taskset -c ${SERVER_CPUS:-0} $APP_DIR/bin/httpd -k start 
 }
 
 stop_server() {
@@ -138,7 +138,7 @@ build_app() {
 # Function to run the server
 run_server() {
     export LD_LIBRARY_PATH=$OPENSSL_DIR/lib64
-    taskset -c 0 $APP_DIR/sbin/lighttpd -D -f $LIGHTTPD_CONF
+    taskset -c ${SERVER_CPUS:-0} $APP_DIR/sbin/lighttpd -D -f $LIGHTTPD_CONF
 }
 
 # Execute the action
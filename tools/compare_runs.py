@@ -0,0 +1,199 @@
+import argparse
+import csv
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+import stats
+from results_db import RAW_DIR, WRK_PERCENTILES, connect, ingest_run
+
+# Compares RunXXX directories against a base run, sample by sample.
+#
+# For every (suite, benchmark, mode, metric) with per-iteration samples in
+# the base run and in another run, reports the change of the mean and its
+# p-value (bootstrap of the difference of the means, or Mann-Whitney U),
+# and flags a regression when the change is significant and worse than
+# --threshold percent. Exits with 1 if anything regressed, so CI can gate
+# on it. Runs missing from the results store are ingested first.
+#
+# Usage: python3 compare_runs.py Run003 Run004 [Run005 ...]
+
+# Metrics where lower is better (run_fig9.py reports lto / mode for them)
+LOWER_IS_BETTER = {"run_time", "avg", "errors", "latency_avg_us", "startup_s"}
+LOWER_IS_BETTER |= {f"latency_p{p}_us" for p in WRK_PERCENTILES}
+
+
+def load_samples(conn, runs, suite=None, mode=None):
+    # {(suite, benchmark, mode, metric): {run: [values]}} in one query
+    sql = (
+        "SELECT run, suite, benchmark, mode, metric, value FROM latest_samples "
+        f"WHERE iteration > 0 AND run IN ({', '.join('?' * len(runs))})"
+    )
+    args = list(runs)
+    if suite:
+        sql += " AND suite = ?"
+        args.append(suite)
+    if mode:
+        sql += " AND mode = ?"
+        args.append(mode)
+
+    samples = defaultdict(lambda: defaultdict(list))
+    for run, suite, benchmark, mode, metric, value in conn.execute(sql, args):
+        samples[(suite, benchmark, mode, metric)][run].append(value)
+    return samples
+
+
+def compare(samples, base_run, runs, test, threshold, alpha):
+    # Also returns how many comparisons had too few samples for the test to
+    # ever reach alpha
+    rows = []
+    underpowered = 0
+    for key in sorted(samples):
+        per_run = samples[key]
+        if base_run not in per_run:
+            continue
+        base = np.array(per_run[base_run])
+
+        for run in runs:
+            if run not in per_run:
+                continue
+            other = np.array(per_run[run])
+
+            base_mean, mean = base.mean(), other.mean()
+            if base_mean == 0:
+                continue
+            delta = (mean - base_mean) / abs(base_mean) * 100
+
+            if len(base) < 2 or len(other) < 2:
+                pvalue = float("nan")
+            elif test == "mwu":
+                pvalue = stats.mannwhitney_pvalue(base, other)
+                if stats.mannwhitney_min_pvalue(len(base), len(other)) > alpha:
+                    underpowered += 1
+            else:
+                pvalue = stats.bootstrap_pvalue(base, other)
+
+            # Positive when the run got better
+            gain = -delta if key[3] in LOWER_IS_BETTER else delta
+            status = ""
+            if pvalue <= alpha and abs(delta) >= threshold:
+                status = "regression" if gain < 0 else "improvement"
+
+            rows.append(key + (run, base_mean, mean, delta, pvalue, status))
+    return rows, underpowered
+
+
+def print_table(rows, show_all):
+    header = ["suite", "benchmark", "mode", "metric", "run"]
+    header += ["base", "mean", "delta%", "p", "status"]
+    print(
+        f"{header[0]:<10} {header[1]:<28} {header[2]:<10} {header[3]:<18} "
+        f"{header[4]:<8} {header[5]:>12} {header[6]:>12} {header[7]:>8} "
+        f"{header[8]:>6} {header[9]}"
+    )
+    for suite, benchmark, mode, metric, run, base, mean, delta, p, status in rows:
+        if not status and not show_all:
+            continue
+        print(
+            f"{suite:<10} {benchmark[:28]:<28} {mode:<10} {metric:<18} {run:<8} "
+            f"{base:>12.2f} {mean:>12.2f} {delta:>+8.2f} {p:>6.3f} {status}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare runs against the first one and flag regressions."
+    )
+    parser.add_argument("runs", nargs="+", help="base RunXXX, then the runs to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=2.0,
+        help="smallest change in percent to flag (default: 2.0)",
+    )
+    parser.add_argument(
+        "--alpha", type=float, default=0.05, help="significance level (default: 0.05)"
+    )
+    parser.add_argument(
+        "--test",
+        choices=["bootstrap", "mwu"],
+        default="bootstrap",
+        help="significance test (default: bootstrap)",
+    )
+    parser.add_argument("--suite", help="only compare this suite (e.g. spec17)")
+    parser.add_argument("--mode", help="only compare this mode (e.g. sidecfi)")
+    parser.add_argument(
+        "--all", action="store_true", help="print unflagged comparisons too"
+    )
+    parser.add_argument("--csv", action="store_true", help="print CSV instead")
+    args = parser.parse_args()
+
+    if len(args.runs) < 2:
+        print("Error: Need a base run and at least one run to compare.")
+        sys.exit(2)
+
+    conn = connect()
+
+    # Ingest the runs the store has not seen yet
+    known = {run for (run,) in conn.execute("SELECT DISTINCT run FROM ingests")}
+    for run in args.runs:
+        if run in known:
+            continue
+        run_dir = RAW_DIR / run
+        if not run_dir.is_dir():
+            print(f"Error: {run_dir} does not exist.")
+            sys.exit(2)
+        ingest_run(run_dir, conn)
+
+    samples = load_samples(conn, args.runs, args.suite, args.mode)
+    conn.close()
+
+    base_run, runs = args.runs[0], args.runs[1:]
+    rows, underpowered = compare(
+        samples, base_run, runs, args.test, args.threshold, args.alpha
+    )
+
+    if not rows:
+        print(f"Error: No samples of {', '.join(runs)} to compare against {base_run}.")
+        sys.exit(2)
+    if underpowered == len(rows):
+        print(
+            f"Error: Too few samples for --test mwu to reach p <= {args.alpha}. "
+            "Use more iterations or --test bootstrap."
+        )
+        sys.exit(2)
+
+    if args.csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(
+            ["suite", "benchmark", "mode", "metric", "run"]
+            + ["base", "mean", "delta", "p", "status"]
+        )
+        for row in rows:
+            writer.writerow(
+                list(row[:5]) + [f"{value:.4f}" for value in row[5:9]] + [row[9]]
+            )
+    else:
+        print_table(rows, args.all)
+
+    if underpowered:
+        print(
+            f"Warning: {underpowered} comparisons have too few samples for "
+            f"--test mwu to reach p <= {args.alpha} and cannot be flagged.",
+            file=sys.stderr,
+        )
+
+    regressions = sum(1 for row in rows if row[-1] == "regression")
+    improvements = sum(1 for row in rows if row[-1] == "improvement")
+    print(
+        f"{len(rows)} comparisons against {base_run}: "
+        f"{regressions} regressions, {improvements} improvements",
+        file=sys.stderr,
+    )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
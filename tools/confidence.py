@@ -0,0 +1,69 @@
+import argparse
+import csv
+import sys
+from collections import defaultdict
+
+from stats import NO_CI, relative_ci
+
+# Confidence intervals for the adaptive iteration mode of the run_* scripts.
+#
+# Reads the samples collected so far (one value per line, or a CSV with a
+# key and a value column, e.g. the per-iteration rows of a SPEC result) and
+# prints "<n> <mean> <relative CI %>", where n and the relative CI are the
+# worst over all keys. Exits with 0 once every key has at least --min
+# samples and a 95% CI half-width within --target percent of its mean,
+# i.e. when the caller can stop iterating. The interval itself is
+# stats.relative_ci().
+
+
+def read_samples(path, key_col=None, value_col=0):
+    samples = defaultdict(list)
+    with open(path, "r") as f:
+        for row in csv.reader(f):
+            if len(row) <= max(value_col, key_col or 0):
+                continue
+            try:
+                value = float(row[value_col])
+            except ValueError:
+                continue
+            key = row[key_col] if key_col is not None else ""
+            samples[key].append(value)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check whether the samples collected so far are precise enough."
+    )
+    parser.add_argument("samples", help="file with the samples so far")
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=1.0,
+        help="relative CI half-width to reach, in percent (default: 1.0)",
+    )
+    parser.add_argument(
+        "--min", type=int, default=2, help="minimum number of samples (default: 2)"
+    )
+    parser.add_argument("--key-col", type=int, help="CSV column naming the series")
+    parser.add_argument(
+        "--value-col", type=int, default=0, help="CSV column of the value"
+    )
+    args = parser.parse_args()
+
+    samples = read_samples(args.samples, args.key_col, args.value_col)
+    if not samples:
+        print(f"0 0 {NO_CI}")
+        sys.exit(1)
+
+    n = min(len(values) for values in samples.values())
+    cis = [float(relative_ci(values)) for values in samples.values()]
+    worst = NO_CI if NO_CI in cis else max(cis)
+    mean = sum(sum(v) / len(v) for v in samples.values()) / len(samples)
+    print(f"{n} {mean:.2f} {worst}")
+
+    sys.exit(0 if n >= args.min and worst != NO_CI and worst <= args.target else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import struct
+import sys
+import time
+from collections import Counter, deque
+from itertools import accumulate
+
+from wrk_driver import PERCENTILES
+
+try:
+    import dns.message
+    import dns.rcode
+    import dns.rdatatype
+except ImportError:
+    dns = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# DNS load generator for the BIND experiment, for machines without dnsperf
+# and for query mixes closer to real traffic than one.txt.
+#
+# Sends the queries of a query file over UDP (or TCP, --tcp) with up to
+# --max-outstanding queries in flight, at most --rate queries/s if given.
+# The query file has the dnsperf format, one "<name> <type>" per line,
+# optionally followed by a weight; queries are drawn at random by weight.
+# Every response is timed, and the result has the shape of the wrk_driver.py
+# results (so "wrk_driver.py hgrm" exports its histogram):
+#   {"duration_us": ..., "sent": ..., "requests": ..., "queries_per_sec": ...,
+#    "errors": {"timeout": ..., "servfail": ..., "total": ...},
+#    "rcodes": {"NOERROR": ..., ...},
+#    "latency_us": {"min": ..., "max": ..., "mean": ..., "stdev": ...,
+#                   "p50": ..., "p90": ..., "p99": ..., "p99.9": ...},
+#    "histogram": [[latency_us, count], ...]}
+# The queries/s are printed and, with --json-out, the result is appended as
+# one JSON line. Queries are built with dnspython, uvloop is used if it is
+# installed.
+#
+# Usage: python3 dns_load.py -s 127.0.0.1 -p 1053 -d <queries> -l <seconds>
+#                            [-Q <rate>] [-q <outstanding>] [--tcp]
+
+DNS_PORT = 53
+MAX_OUTSTANDING = 100
+TIMEOUT = 5.0
+
+# Every UDP socket or TCP connection has its own 16-bit query id space
+UDP_SOCKETS = 4
+TCP_CONNECTIONS = 4
+
+# Let the responses in every this many queries sent back to back
+YIELD_EVERY = 64
+
+# How often timed out queries are collected, in seconds
+SWEEP_INTERVAL = 0.1
+
+
+def read_queries(path):
+    # [(wire query without id, weight)] from a dnsperf-style query file
+    queries = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            name = parts[0]
+            rdtype = parts[1] if len(parts) > 1 else "A"
+            weight = float(parts[2]) if len(parts) > 2 else 1.0
+            wire = dns.message.make_query(name, dns.rdatatype.from_text(rdtype))
+            queries.append((wire.to_wire()[2:], weight))
+    return queries
+
+
+class Histogram:
+    # Latencies in us, bucketed to 3 significant digits
+    def __init__(self):
+        self.counts = Counter()
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        if value >= 1000:
+            scale = 10 ** (int(math.log10(value)) - 2)
+            self.counts[round(value / scale) * scale] += 1
+        else:
+            self.counts[int(value)] += 1
+        self.n += 1
+        self.total += value
+        self.total_sq += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        target = p / 100 * self.n
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= target:
+                return value
+        return math.nan
+
+    def result(self):
+        if not self.n:
+            latency = {"min": math.nan, "max": math.nan, "mean": math.nan}
+            latency["stdev"] = math.nan
+        else:
+            mean = self.total / self.n
+            latency = {
+                "min": round(self.min, 2),
+                "max": round(self.max, 2),
+                "mean": round(mean, 2),
+                "stdev": round(math.sqrt(max(self.total_sq / self.n - mean**2, 0)), 2),
+            }
+        for p in PERCENTILES:
+            latency[f"p{p}"] = self.percentile(p)
+        return latency, [[value, self.counts[value]] for value in sorted(self.counts)]
+
+
+class Channel:
+    # Mixin of the UDP and TCP protocols: the transport and the query ids
+    # free on it. The protocols implement send().
+    def __init__(self, index):
+        self.index = index
+        self.free = deque(random.sample(range(1 << 16), 1 << 16))
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+class UdpChannel(Channel, asyncio.DatagramProtocol):
+    def __init__(self, index, generator):
+        Channel.__init__(self, index)
+        self.generator = generator
+
+    def datagram_received(self, data, addr):
+        self.generator.response(self, data)
+
+    def send(self, wire):
+        self.transport.sendto(wire)
+
+
+class TcpChannel(Channel, asyncio.Protocol):
+    def __init__(self, index, generator):
+        Channel.__init__(self, index)
+        self.generator = generator
+        self.buffer = b""
+
+    def data_received(self, data):
+        # Responses are prefixed with their 16-bit length
+        self.buffer += data
+        while len(self.buffer) >= 2:
+            (length,) = struct.unpack("!H", self.buffer[:2])
+            if len(self.buffer) < 2 + length:
+                break
+            self.generator.response(self, self.buffer[2 : 2 + length])
+            self.buffer = self.buffer[2 + length :]
+
+    def connection_lost(self, exc):
+        self.generator.closed = True
+
+    def send(self, wire):
+        self.transport.write(struct.pack("!H", len(wire)) + wire)
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        queries,
+        server,
+        port=DNS_PORT,
+        tcp=False,
+        max_outstanding=MAX_OUTSTANDING,
+        rate=0,
+        timeout=TIMEOUT,
+        seed=0,
+    ):
+        self.queries = [wire for wire, _ in queries]
+        # Cumulative, so that picking a query does not sum all the weights
+        self.cum_weights = list(accumulate(weight for _, weight in queries))
+        self.server = server
+        self.port = port
+        self.tcp = tcp
+        self.max_outstanding = max_outstanding
+        self.rate = rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+
+        self.channels = []
+        self.pending = {}
+        self.histogram = Histogram()
+        self.rcodes = Counter()
+        self.sent = 0
+        self.timeouts = 0
+        self.closed = False
+
+    async def connect(self, loop):
+        for index in range(TCP_CONNECTIONS if self.tcp else UDP_SOCKETS):
+            if self.tcp:
+                channel = TcpChannel(index, self)
+                await loop.create_connection(lambda: channel, self.server, self.port)
+            else:
+                channel = UdpChannel(index, self)
+                await loop.create_datagram_endpoint(
+                    lambda: channel, remote_addr=(self.server, self.port)
+                )
+            self.channels.append(channel)
+
+    def response(self, channel, data):
+        if len(data) < 4:
+            return
+        qid, flags = struct.unpack("!HH", data[:4])
+        sent_at = self.pending.pop((channel.index, qid), None)
+        if sent_at is None:
+            # Late answer to a query that timed out
+            return
+
+        self.histogram.record((time.perf_counter() - sent_at) * 1e6)
+        self.rcodes[dns.rcode.to_text(flags & 0xF)] += 1
+        channel.free.append(qid)
+        self.slots.release()
+
+    def expire(self, now):
+        # Pending queries are in the order they were sent
+        expired = []
+        for key, sent_at in self.pending.items():
+            if now - sent_at < self.timeout:
+                break
+            expired.append(key)
+        for key in expired:
+            del self.pending[key]
+            self.channels[key[0]].free.append(key[1])
+            self.timeouts += 1
+            self.slots.release()
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.expire(time.perf_counter())
+
+    async def send_all(self, deadline):
+        loop = asyncio.get_running_loop()
+        next_send = loop.time()
+        interval = 1 / self.rate if self.rate else 0
+
+        while loop.time() < deadline and not self.closed:
+            await self.slots.acquire()
+            if interval:
+                next_send += interval
+                if next_send > loop.time():
+                    await asyncio.sleep(next_send - loop.time())
+            if self.sent % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            channel = self.channels[self.sent % len(self.channels)]
+            qid = channel.free.popleft()
+            query = self.random.choices(self.queries, cum_weights=self.cum_weights)[0]
+            self.pending[(channel.index, qid)] = time.perf_counter()
+            channel.send(struct.pack("!H", qid) + query)
+            self.sent += 1
+
+    async def run(self, duration):
+        loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.max_outstanding)
+        await self.connect(loop)
+
+        sweeper = asyncio.create_task(self.sweep())
+        start = time.perf_counter()
+        await self.send_all(loop.time() + duration)
+        elapsed = time.perf_counter() - start
+
+        # Wait for the queries still in flight, up to the timeout
+        drain_deadline = time.perf_counter() + self.timeout
+        while self.pending and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(SWEEP_INTERVAL)
+        sweeper.cancel()
+        self.timeouts += len(self.pending)
+
+        for channel in self.channels:
+            channel.transport.close()
+        return self.result(elapsed)
+
+    def result(self, elapsed):
+        latency, histogram = self.histogram.result()
+        errors = {"timeout": self.timeouts, "servfail": self.rcodes["SERVFAIL"]}
+        errors["total"] = sum(errors.values())
+        return {
+            "duration_us": int(elapsed * 1e6),
+            "sent": self.sent,
+            "requests": self.histogram.n,
+            "queries_per_sec": round(self.histogram.n / elapsed, 2) if elapsed else 0.0,
+            "errors": errors,
+            "rcodes": dict(self.rcodes),
+            "latency_us": latency,
+            "histogram": histogram,
+        }
+
+
+def run_load(queries, server, duration, **kwargs):
+    generator = LoadGenerator(queries, server, **kwargs)
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(generator.run(duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DNS load generator.")
+    parser.add_argument("-s", "--server", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=DNS_PORT)
+    parser.add_argument("-d", "--queries", required=True, help="query file")
+    parser.add_argument("-l", "--duration", type=float, default=60, help="seconds")
+    parser.add_argument(
+        "-Q", "--rate", type=float, default=0, help="queries/s (default: no limit)"
+    )
+    parser.add_argument(
+        "-q",
+        "--max-outstanding",
+        type=int,
+        default=MAX_OUTSTANDING,
+        help=f"queries in flight (default: {MAX_OUTSTANDING})",
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=TIMEOUT, help="seconds per query"
+    )
+    parser.add_argument("--tcp", action="store_true", help="query over TCP")
+    parser.add_argument("--json-out", help="append the result to this file")
+    args = parser.parse_args()
+
+    if dns is None:
+        print("Error: dnspython is not installed.", file=sys.stderr)
+        sys.exit(1)
+    queries = read_queries(args.queries)
+    if not queries:
+        print(f"Error: {args.queries} has no queries.", file=sys.stderr)
+        sys.exit(1)
+    if args.max_outstanding > (1 << 16) * min(UDP_SOCKETS, TCP_CONNECTIONS):
+        print("Error: Too many queries in flight for the query ids.", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        data = run_load(
+            queries,
+            args.server,
+            args.duration,
+            port=args.port,
+            tcp=args.tcp,
+            max_outstanding=args.max_outstanding,
+            rate=args.rate,
+            timeout=args.timeout,
+        )
+    except OSError as e:
+        print(f"Error: Cannot query {args.server}:{args.port}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.json_out:
+        with open(args.json_out, "a") as f:
+            f.write(json.dumps(data) + "\n")
+    print(data["queries_per_sec"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import struct
+import sys
+
+# Converts the text typemap written by sidecar/tools/gen_tp.sh
+# (<binary>.tp, one "symbol typeID offset" per line) into the binary
+# typemap <binary>.tpb that the SideCFI monitor can mmap and use as is.
+#
+# Layout (little endian):
+#   header: magic "STPB", u32 version, u32 bits, u32 reserved,
+#           u64 entries, u64 span, u64 tp_size, i64 tp_mtime_ns
+#   slots:  2^bits u64 keys, (typeID << 48) | offset, 0 for empty
+#
+# tp_size and tp_mtime_ns are those of the .tp the table was built from.
+# The monitor only uses a .tpb whose .tp still has them, so a .tpb left
+# over from before a rebuild is not used.
+#
+# Offsets stay relative to the DSO base; the monitor subtracts the base
+# from the target at lookup time. The slots form an open-addressed table
+# with linear probing and fibonacci hashing, which must match
+# typemapHash() in benchmarks/cpu-usage/sidecfi/monitor.c.
+
+TPB_MAGIC = b"STPB"
+TPB_VERSION = 2
+TPB_HEADER = struct.Struct("<4sIII QQ Qq")
+TPB_MIN_BITS = 4
+
+TID_SHIFT = 48
+TID_MASK = 0x3FFF
+ADDR_MASK = 0xFFFFFFFFFFFF
+HASH_MULT = 0x9E3779B97F4A7C15
+U64_MASK = (1 << 64) - 1
+
+
+def read_tp(tp_path):
+    keys = set()
+    with open(tp_path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            try:
+                type_id = int(parts[1], 10)
+                offset = int(parts[2], 16)
+            except ValueError:
+                continue
+
+            # Same filtering as insertTypeMap(): these can never match
+            if type_id > TID_MASK or (offset & ADDR_MASK) == 0:
+                continue
+            keys.add((type_id << TID_SHIFT) | (offset & ADDR_MASK))
+    return keys
+
+
+def build_slots(keys):
+    # Keep the table at most half full so probes stay short
+    bits = TPB_MIN_BITS
+    while (1 << bits) < len(keys) * 2:
+        bits += 1
+    mask = (1 << bits) - 1
+
+    slots = [0] * (1 << bits)
+    for key in sorted(keys):
+        i = ((key * HASH_MULT) & U64_MASK) >> (64 - bits)
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = key
+    return bits, slots
+
+
+def write_tpb(tpb_path, keys, tp_stat):
+    bits, slots = build_slots(keys)
+    span = max((k & ADDR_MASK for k in keys), default=0) + 1
+
+    tmp_path = tpb_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            TPB_HEADER.pack(
+                TPB_MAGIC,
+                TPB_VERSION,
+                bits,
+                0,
+                len(keys),
+                span,
+                tp_stat.st_size,
+                tp_stat.st_mtime_ns,
+            )
+        )
+        f.write(struct.pack(f"<{len(slots)}Q", *slots))
+
+    # Never leave a half-written typemap for a monitor to mmap
+    os.replace(tmp_path, tpb_path)
+    return bits
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 " + sys.argv[0] + " <binary> [<binary> ...]")
+        sys.exit(1)
+
+    for binary in sys.argv[1:]:
+        tp_path = binary + ".tp"
+        if not os.path.exists(tp_path):
+            print(f"Error: {tp_path} does not exist.")
+            sys.exit(1)
+
+        # Taken before reading, so a .tp changed meanwhile does not match
+        tp_stat = os.stat(tp_path)
+        keys = read_tp(tp_path)
+        bits = write_tpb(binary + ".tpb", keys, tp_stat)
+        print(f"{binary}.tpb: {len(keys)} entries in {1 << bits} slots")
+
+
+if __name__ == "__main__":
+    main()
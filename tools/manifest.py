@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+# Records which units of a campaign (one benchmark in one mode) finished in
+# a RunXXX directory, so that an interrupted campaign can be resumed with
+# --resume RunXXX instead of starting over in a new directory.
+#
+# The manifest is <run_dir>/manifest.json:
+#   {"units": {"httpd:lto": {"benchmark": "httpd", "mode": "lto",
+#                            "state": "done", "returncode": 0,
+#                            "attempts": 1, "elapsed": 312.4,
+#                            "finished": 1700000000.0, "output": "...",
+#                            "cpus": "0,4"}}}
+# A unit is only "done" if it exited with 0 and its results were usable,
+# otherwise it is "failed" and a resumed campaign runs it again.
+# The output is kept because some units feed later ones (e.g. the lto
+# throughput of an app) and the app CSVs are rebuilt from it.
+
+MANIFEST_FILE = "manifest.json"
+
+
+class Manifest:
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, MANIFEST_FILE)
+        self.units = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.units = json.load(f).get("units", {})
+
+    def done(self, unit):
+        return self.units.get(unit, {}).get("state") == "done"
+
+    def output(self, unit):
+        return self.units.get(unit, {}).get("output", "")
+
+    def record(self, unit, returncode, elapsed=0.0, output="", cpus="", valid=True):
+        benchmark, _, mode = unit.partition(":")
+        entry = self.units.get(unit, {})
+        self.units[unit] = {
+            "benchmark": benchmark,
+            "mode": mode,
+            "state": "done" if returncode == 0 and valid else "failed",
+            "returncode": returncode,
+            "attempts": entry.get("attempts", 0) + 1,
+            "elapsed": round(elapsed, 1),
+            "finished": time.time(),
+            "output": output,
+            "cpus": cpus,
+        }
+        self.save()
+
+    def save(self):
+        # Write a new file and rename it, a crash must never leave a
+        # truncated manifest behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"units": self.units}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        states = [entry["state"] for entry in self.units.values()]
+        return f"{states.count('done')} done, {states.count('failed')} failed"
@@ -0,0 +1,127 @@
+import argparse
+import json
+import math
+import re
+import sys
+
+from results_db import WRK_PERCENTILES
+from stats import outliers
+
+# Reads the --json-out-file of one memtier_benchmark run (--run-count=1,
+# with more runs memtier only reports their best, worst and average):
+#   {"iteration": ..., "ops_per_sec": ..., "hits_per_sec": ...,
+#    "misses_per_sec": ..., "kb_per_sec": ..., "latency_avg_us": ...,
+#    "latency_p50_us": ..., ..., "excluded": ""}
+# and appends it to the runs of the mode collected so far (a JSON lines
+# file). Over all those runs, failed ones (no ops/s) and outliers of the
+# ops/s are marked "failed" or "outlier" in "excluded", and the ops/s of
+# the others are written to the samples file that confidence.py and the
+# results store read. A bad run is thus left out of the mean instead of
+# turning it into 0% performance.
+#
+# Usage: python3 memtier_results.py <memtier.json> <runs.jsonl> <samples.txt>
+
+# memtier prints NaN as C does, which is not JSON
+NAN = re.compile(r"(?<=[:\[,\s])-?nan\b")
+
+
+def load_json(path):
+    with open(path, "r") as f:
+        return json.loads(NAN.sub("NaN", f.read()))
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def run_record(totals):
+    # Rates and latencies of the "Totals" of the run, latencies in us like
+    # the wrk results
+    latency = totals.get("Average Latency", totals.get("Latency"))
+    record = {
+        "ops_per_sec": number(totals.get("Ops/sec")),
+        "hits_per_sec": number(totals.get("Hits/sec")),
+        "misses_per_sec": number(totals.get("Misses/sec")),
+        "kb_per_sec": number(totals.get("KB/sec")),
+        "latency_avg_us": number(latency) * 1000,
+    }
+
+    percentiles = {
+        number(key.lstrip("p")): number(value) * 1000
+        for key, value in totals.get("Percentile Latencies", {}).items()
+    }
+    for p in WRK_PERCENTILES:
+        record[f"latency_p{p}_us"] = percentiles.get(float(p), math.nan)
+    return record
+
+
+def read_result(path):
+    return run_record(load_json(path).get("ALL STATS", {}).get("Totals", {}))
+
+
+def read_jsonl(path):
+    records = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def mark_excluded(records):
+    ops = [number(record["ops_per_sec"]) for record in records]
+    mask = outliers(ops)
+    for record, value, bad in zip(records, ops, mask):
+        if not math.isfinite(value) or value <= 0:
+            record["excluded"] = "failed"
+        else:
+            record["excluded"] = "outlier" if bad else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collect the runs of a memtier_benchmark JSON result."
+    )
+    parser.add_argument("result", help="--json-out-file of memtier_benchmark")
+    parser.add_argument("runs", help="runs of the mode so far, appended to")
+    parser.add_argument("samples", help="ops/s of the runs kept, rewritten")
+    args = parser.parse_args()
+
+    records = read_jsonl(args.runs)
+    try:
+        record = read_result(args.result)
+    except (OSError, ValueError) as e:
+        # Still counts as an iteration, a failed one
+        print(f"Error: Cannot read {args.result}: {e}", file=sys.stderr)
+        record = run_record({})
+
+    record["iteration"] = len(records) + 1
+    records.append(record)
+    mark_excluded(records)
+
+    with open(args.runs, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    with open(args.samples, "w") as f:
+        for record in records:
+            if not record["excluded"]:
+                f.write(f"{record['ops_per_sec']}\n")
+
+    excluded = [r for r in records if r["excluded"]]
+    if excluded:
+        print(
+            f"Excluded {len(excluded)} of {len(records)} runs: "
+            + ", ".join(f"#{r['iteration']} ({r['excluded']})" for r in excluded),
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
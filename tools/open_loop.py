@@ -0,0 +1,309 @@
+import argparse
+import csv
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import dns_load
+from memtier_results import read_result
+from results_db import WRK_PERCENTILES
+from wrk_driver import run_wrk
+
+# Open-loop mode of the app benchmarks (OPEN_LOOP=1 in run_wrk_httpd.sh,
+# run_wrk_lighttpd.sh, run_memtier_memcached.sh and run_dnsperf_bind.sh).
+#
+# Instead of saturating the server, offers a fixed load (requests/s) for
+# OPEN_LOOP_DURATION seconds per point and sweeps it, by default
+# geometrically from the app's start rate until the server falls behind.
+# Each point records the offered and achieved throughput and the latency,
+# which is written as a latency-versus-throughput curve:
+#   offered,achieved,latency_avg_us,latency_p50_us,...,errors,knee
+# The offered load is the rate the requests are scheduled at. The knee is
+# the highest load the server still keeps up with, i.e. the last point
+# before its tail latency (p99, the mean for bind under dnsperf) grows past
+# KNEE_LATENCY times the latency at the lowest load. Where the latency is
+# not counted from the scheduled send times, requests that queue in the
+# client do not show up in it, so achieving less than KNEE_ACHIEVED of the
+# offered load also ends the knee. Its achieved throughput is printed, so
+# the scripts report the knee of a mode relative to the knee of lto.
+#
+# HTTP load comes from wrk2 (WRK2, by default install/tools/wrk2), which
+# sends at a constant rate and counts latency from the scheduled send
+# times, or else from wrk on the same schedule without that correction.
+#
+# Usage: python3 open_loop.py <app> <curve.csv>
+
+# Start of the sweep per app, in requests/s
+START_RATES = {
+    "httpd": 500,
+    "lighttpd": 500,
+    "memcached": 20000,
+    "bind": 5000,
+}
+RATE_STEP = 1.25
+MAX_POINTS = 20
+
+KNEE_ACHIEVED = 0.95
+KNEE_LATENCY = 3.0
+
+# Explicit offered loads (e.g. "1000 2000 4000") instead of the sweep
+OPEN_LOOP_RATES = os.getenv("OPEN_LOOP_RATES", "")
+OPEN_LOOP_DURATION = int(os.getenv("OPEN_LOOP_DURATION", "30"))
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+TOOLS_DIR = Path(script_dir) / "../install/tools"
+WRK_URL = "https://127.0.0.1:8443/100KB"
+MEMCACHED_PORT = 11211
+DNS_SERVER = "127.0.0.1"
+DNS_PORT = 1053
+QUERY_FILE = os.getenv(
+    "QUERY_FILE", str(Path(script_dir) / "../benchmarks/bind/bind9/one.txt")
+)
+
+# Load generator of bind, as in run_dnsperf_bind.sh
+DNS_CLIENT = os.getenv("DNS_CLIENT", "dnsperf" if shutil.which("dnsperf") else "python")
+
+WRK2 = os.getenv("WRK2", str(TOOLS_DIR / "wrk2"))
+
+# Enough wrk connections that each one sends at most one request every
+# WRK_MIN_INTERVAL_MS, memtier paces each of its threads x clients
+# connections
+WRK_MIN_INTERVAL_MS = 10
+MEMTIER_CONNECTIONS = (2, 4)
+
+CURVE_COLUMNS = ["offered", "achieved", "latency_avg_us"]
+CURVE_COLUMNS += [f"latency_p{p}_us" for p in WRK_PERCENTILES] + ["errors", "knee"]
+
+
+def point(
+    offered, achieved, latency_avg_us, percentiles=None, errors=0, corrected=False
+):
+    # corrected: the latency counts from the scheduled send times
+    row = {"offered": offered, "achieved": achieved, "latency_avg_us": latency_avg_us}
+    for p in WRK_PERCENTILES:
+        row[f"latency_p{p}_us"] = (percentiles or {}).get(p, math.nan)
+    row["errors"] = errors
+    row["corrected"] = corrected
+    return row
+
+
+def run_http(rate, duration):
+    connections = max(2, math.ceil(rate * WRK_MIN_INTERVAL_MS / 1000))
+    wrk2 = os.path.exists(WRK2)
+    wrk = WRK2 if wrk2 else TOOLS_DIR / "wrk"
+    data = run_wrk(WRK_URL, duration, 2, connections, wrk, rate=rate, wrk2=wrk2)
+    if data is None:
+        return point(rate, 0.0, math.nan)
+
+    latency = data["latency_us"]
+    percentiles = {p: latency[f"p{p}"] for p in WRK_PERCENTILES}
+    return point(
+        rate,
+        data["requests_per_sec"],
+        latency["mean"],
+        percentiles,
+        data["errors"]["total"],
+        corrected=wrk2,
+    )
+
+
+def run_memtier(rate, duration):
+    threads, clients = MEMTIER_CONNECTIONS
+    per_connection = max(1, round(rate / (threads * clients)))
+    with tempfile.NamedTemporaryFile(suffix=".json") as result:
+        subprocess.run(
+            [
+                str(TOOLS_DIR / "memtier_benchmark"),
+                "-p",
+                str(MEMCACHED_PORT),
+                "-P",
+                "memcache_binary",
+                "--protocol=memcache_binary",
+                f"-t{threads}",
+                f"-c{clients}",
+                "-d32",
+                f"--test-time={duration}",
+                "--ratio=0:1",
+                "--key-pattern=S:S",
+                f"--rate-limiting={per_connection}",
+                "--print-percentiles=" + ",".join(WRK_PERCENTILES),
+                "--run-count=1",
+                f"--json-out-file={result.name}",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            record = read_result(result.name)
+        except ValueError:
+            record = None
+
+    offered = per_connection * threads * clients
+    if record is None:
+        return point(offered, 0.0, math.nan)
+    percentiles = {p: record[f"latency_p{p}_us"] for p in WRK_PERCENTILES}
+    return point(offered, record["ops_per_sec"], record["latency_avg_us"], percentiles)
+
+
+def run_dnsperf(rate, duration):
+    # dnsperf has no percentiles, only the average latency
+    result = subprocess.run(
+        [
+            "dnsperf",
+            "-s",
+            DNS_SERVER,
+            "-p",
+            str(DNS_PORT),
+            "-d",
+            str(QUERY_FILE),
+            "-l",
+            str(duration),
+            "-Q",
+            str(rate),
+            "-q",
+            "1000",
+            "-T",
+            "1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    achieved = re.search(r"Queries per second:\s+([\d.]+)", result.stdout)
+    latency = re.search(r"Average Latency \(s\):\s+([\d.]+)", result.stdout)
+    lost = re.search(r"Queries lost:\s+(\d+)", result.stdout)
+    return point(
+        rate,
+        float(achieved.group(1)) if achieved else 0.0,
+        float(latency.group(1)) * 1e6 if latency else math.nan,
+        errors=int(lost.group(1)) if lost else 0,
+    )
+
+
+def run_dns(rate, duration):
+    if DNS_CLIENT == "dnsperf":
+        return run_dnsperf(rate, duration)
+
+    data = dns_load.run_load(
+        dns_load.read_queries(QUERY_FILE),
+        DNS_SERVER,
+        duration,
+        port=DNS_PORT,
+        max_outstanding=1000,
+        rate=rate,
+    )
+    latency = data["latency_us"]
+    percentiles = {p: latency[f"p{p}"] for p in WRK_PERCENTILES}
+    return point(
+        rate,
+        data["queries_per_sec"],
+        latency["mean"],
+        percentiles,
+        data["errors"]["total"],
+    )
+
+
+LOAD_GENERATORS = {
+    "httpd": run_http,
+    "lighttpd": run_http,
+    "memcached": run_memtier,
+    "bind": run_dns,
+}
+
+
+def tail_latency(row):
+    value = row["latency_p99_us"]
+    return value if math.isfinite(value) else row["latency_avg_us"]
+
+
+def saturated(row, base):
+    latency = tail_latency(row)
+    if not math.isfinite(latency):
+        return True
+    if math.isfinite(base) and latency > KNEE_LATENCY * base:
+        return True
+    return not row["corrected"] and row["achieved"] < KNEE_ACHIEVED * row["offered"]
+
+
+def find_knee(curve):
+    # Last point before the first saturated one, None if even the lowest
+    # load saturates the server
+    if not curve:
+        return None
+    base = tail_latency(curve[0])
+    knee = None
+    for row in curve:
+        if saturated(row, base):
+            break
+        knee = row
+    return knee
+
+
+def sweep(app, rates, duration):
+    # The given offered loads, or a geometric sweep until the server is
+    # saturated
+    run_point = LOAD_GENERATORS[app]
+    sweep_up = not rates
+    if sweep_up:
+        rates = [START_RATES[app] * RATE_STEP**i for i in range(MAX_POINTS)]
+
+    curve = []
+    base = math.nan
+    for rate in rates:
+        row = run_point(rate, duration)
+        curve.append(row)
+        print(
+            f"{app}: offered {row['offered']:.0f}/s, achieved {row['achieved']:.0f}/s, "
+            f"p99 {tail_latency(row):.0f} us",
+            file=sys.stderr,
+        )
+        if len(curve) == 1:
+            base = tail_latency(row)
+        if sweep_up and saturated(row, base):
+            break
+    return curve
+
+
+def write_curve(curve, knee, path):
+    # The knee row is marked with knee=1
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CURVE_COLUMNS)
+        writer.writeheader()
+        for row in curve:
+            values = {col: round(row[col], 2) for col in CURVE_COLUMNS[:-1]}
+            values["knee"] = int(row is knee)
+            writer.writerow(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the offered load of an app.")
+    parser.add_argument("app", choices=sorted(LOAD_GENERATORS))
+    parser.add_argument("curve", help="CSV to write the curve to")
+    args = parser.parse_args()
+
+    if LOAD_GENERATORS[args.app] is run_http and not os.path.exists(WRK2):
+        print(
+            f"Warning: {WRK2} not found, wrk latency leaves out requests "
+            "queued in the client.",
+            file=sys.stderr,
+        )
+
+    rates = [float(rate) for rate in OPEN_LOOP_RATES.split()]
+    curve = sweep(args.app, rates, OPEN_LOOP_DURATION)
+    knee = find_knee(curve)
+    write_curve(curve, knee, args.curve)
+
+    if knee is None:
+        print(f"Error: {args.app} is saturated at the lowest load.", file=sys.stderr)
+        print(0)
+        sys.exit(1)
+    print(f"{knee['achieved']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -77,7 +77,8 @@ def parse_apps_file(filename):
         reader = csv.reader(file)
         for row in reader:
             benchmarks.append(row[0].strip('"'))
-            overheads.append([float(val) for val in row[1:]])
+            # The 7 modes, followed by their CIs
+            overheads.append([float(val) for val in row[1:8]])
 
     return benchmarks, overheads
 
@@ -0,0 +1,145 @@
+import argparse
+import random
+import socket
+import ssl
+import struct
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Readiness probes for the servers of the app benchmarks, instead of fixed
+# sleeps after starting and stopping them.
+#
+# Polls the server with exponential backoff until it answers (or, with
+# --dead, until it stops answering) and prints how many seconds that took,
+# so the scripts can keep the startup latency of every mode. Exits with 1
+# if the server did not get there within --timeout.
+#
+# Probes:
+#   tcp <host>:<port>        the port accepts connections
+#   http <url>               a GET gets any HTTP response (TLS unverified)
+#   memcached <host>:<port>  the "version" command is answered
+#   dns <host>:<port>        a SOA query over UDP gets any response
+#
+# Usage: python3 readiness.py <probe> <target> [--dead] [--timeout S]
+#                             [--since <start time>]
+
+TIMEOUT = 30.0
+
+# Backoff between attempts, in seconds
+FIRST_INTERVAL = 0.01
+BACKOFF = 1.5
+MAX_INTERVAL = 0.5
+
+# Timeout of a single attempt, in seconds
+ATTEMPT_TIMEOUT = 1.0
+
+# Answered from BIND's built-in empty zones, without recursion
+DNS_PROBE_NAME = "127.in-addr.arpa"
+
+
+def address(target):
+    host, _, port = target.rpartition(":")
+    return host, int(port)
+
+
+def probe_tcp(target):
+    with socket.create_connection(address(target), ATTEMPT_TIMEOUT):
+        return True
+
+
+def probe_http(url):
+    context = ssl._create_unverified_context()
+    try:
+        with urllib.request.urlopen(url, timeout=ATTEMPT_TIMEOUT, context=context):
+            return True
+    except urllib.error.HTTPError:
+        # An error status is still an answer
+        return True
+
+
+def probe_memcached(target):
+    with socket.create_connection(address(target), ATTEMPT_TIMEOUT) as sock:
+        sock.sendall(b"version\r\n")
+        return sock.recv(64).startswith(b"VERSION")
+
+
+def dns_query(name, qid):
+    # SOA query with recursion desired
+    header = struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0)
+    qname = b"".join(
+        bytes([len(label)]) + label.encode() for label in name.split(".") if label
+    )
+    return header + qname + b"\x00" + struct.pack("!HH", 6, 1)
+
+
+def probe_dns(target):
+    qid = random.randrange(1 << 16)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(ATTEMPT_TIMEOUT)
+        sock.connect(address(target))
+        sock.send(dns_query(DNS_PROBE_NAME, qid))
+        response = sock.recv(512)
+    return len(response) >= 2 and struct.unpack("!H", response[:2])[0] == qid
+
+
+PROBES = {
+    "tcp": probe_tcp,
+    "http": probe_http,
+    "memcached": probe_memcached,
+    "dns": probe_dns,
+}
+
+
+def answers(probe, target):
+    try:
+        return PROBES[probe](target)
+    except (OSError, ValueError):
+        return False
+
+
+def wait(probe, target, live=True, timeout=TIMEOUT, since=None):
+    # Seconds since the given time (e.g. when the server was started) until
+    # the server answers (stops answering if not live), None on timeout
+    start = time.time()
+    interval = FIRST_INTERVAL
+    while True:
+        if answers(probe, target) == live:
+            return time.time() - (since or start)
+        if time.time() - start + interval > timeout:
+            return None
+        time.sleep(interval)
+        interval = min(interval * BACKOFF, MAX_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wait for a server to be ready.")
+    parser.add_argument("probe", choices=sorted(PROBES))
+    parser.add_argument("target", help="<host>:<port>, or the URL for http")
+    parser.add_argument(
+        "--dead", action="store_true", help="wait until it stops answering"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=TIMEOUT,
+        help=f"seconds to wait at most (default: {TIMEOUT})",
+    )
+    parser.add_argument(
+        "--since", type=float, help="count from this time (e.g. $(date +%%s.%%N))"
+    )
+    args = parser.parse_args()
+
+    elapsed = wait(args.probe, args.target, not args.dead, args.timeout, args.since)
+    if elapsed is None:
+        state = "still answering" if args.dead else "not answering"
+        print(
+            f"Error: {args.target} is {state} after {args.timeout}s.", file=sys.stderr
+        )
+        sys.exit(1)
+    print(f"{elapsed:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+import argparse
+import csv
+import json
+import math
+import os
+import socket
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+# Append-only SQLite store of the results of all RunXXX directories.
+#
+# Every raw result file of a run (spec17/spec06 per-mode CSVs, the app
+# CSVs, their per-iteration samples, the wrk and memtier latencies, the
+# open-loop curves, the server startup times and the Dromaeo CSV) is loaded
+# into one table with a uniform schema:
+#   run, suite, benchmark, mode, iteration, metric, value,
+#   measured_at, host, cpus, ingest
+# iteration counts the raw samples from 1; iteration 0 holds values the
+# scripts only report in aggregate (e.g. throughput relative to lto).
+#
+# Rows are never updated. Ingesting a run again (e.g. after --resume)
+# appends a new ingest, and the latest_samples view only shows the rows of
+# the latest ingest of each run, so queries always see the newest data.
+#
+# Usage: python3 results_db.py ingest [RunXXX ...]
+#        python3 results_db.py query [--run R] [--suite S] [--benchmark B]
+#                                    [--mode M] [--metric X]
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Constants for directory structure
+BASE_DIR = Path(script_dir) / "../results"
+RAW_DIR = BASE_DIR / "raw"
+DB_PATH = BASE_DIR / "results.db"
+
+# Metric of the raw samples of each app
+APP_METRICS = {
+    "httpd": "requests_per_sec",
+    "lighttpd": "requests_per_sec",
+    "memcached": "ops_per_sec",
+    "bind": "queries_per_sec",
+}
+
+# Latency percentiles kept from the wrk_driver.py results
+WRK_PERCENTILES = ["50", "90", "99", "99.9"]
+
+# Metrics kept from the memtier_results.py records, besides the ops/s
+MEMTIER_METRICS = ["hits_per_sec", "misses_per_sec", "kb_per_sec", "latency_avg_us"]
+MEMTIER_METRICS += [f"latency_p{p}_us" for p in WRK_PERCENTILES]
+
+# Metrics kept from every point of the open_loop.py curves
+OPEN_LOOP_METRICS = ["achieved", "latency_avg_us", "errors"]
+OPEN_LOOP_METRICS += [f"latency_p{p}_us" for p in WRK_PERCENTILES]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingests (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    host TEXT NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    ingest INTEGER NOT NULL REFERENCES ingests(id),
+    run TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    benchmark TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    measured_at REAL,
+    host TEXT NOT NULL,
+    cpus TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_run ON samples(run, ingest);
+CREATE INDEX IF NOT EXISTS samples_key ON samples(suite, benchmark, mode, metric);
+CREATE VIEW IF NOT EXISTS latest_samples AS
+    SELECT * FROM samples
+    WHERE ingest IN (SELECT MAX(id) FROM ingests GROUP BY run);
+"""
+
+COLUMNS = ["run", "suite", "benchmark", "mode", "iteration", "metric", "value"]
+
+
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def read_spec_csv(path, suite, mode):
+    # One row per benchmark and lap. The 3rd column is the run time (Est.
+    # Base Run Time), the one run_fig9.py divides lto by.
+    iterations = defaultdict(int)
+    with open(path, "r") as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or "." not in row[0]:
+                continue
+            try:
+                value = float(row[2])
+            except ValueError:
+                continue
+            benchmark = row[0].split(".")[1]
+            iterations[benchmark] += 1
+            yield suite, benchmark, mode, iterations[benchmark], "run_time", value
+
+
+def read_app_csv(path, app):
+    # "<mode>,<throughput relative to lto>[,<relative CI>]"
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split(",")
+            if len(parts) < 2:
+                continue
+            try:
+                yield app, app, parts[0], 0, "relative_throughput", float(parts[1])
+                if len(parts) > 2 and float(parts[2]) >= 0:
+                    yield app, app, parts[0], 0, "relative_ci", float(parts[2])
+            except ValueError:
+                continue
+
+
+def read_app_samples(path, app, mode, metric=None):
+    # One throughput (or other metric) per line, in the order the iterations
+    # ran
+    metric = metric or APP_METRICS[app]
+    iteration = 0
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                value = float(line.strip())
+            except ValueError:
+                continue
+            iteration += 1
+            yield app, app, mode, iteration, metric, value
+
+
+def read_wrk_results(path, app, mode):
+    # One wrk_driver.py (or dns_load.py) result per line, in the order the
+    # iterations ran
+    iteration = 0
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            iteration += 1
+            for p in WRK_PERCENTILES:
+                value = data["latency_us"].get(f"p{p}", math.nan)
+                if math.isfinite(value):
+                    yield app, app, mode, iteration, f"latency_p{p}_us", value
+            yield app, app, mode, iteration, "errors", data["errors"]["total"]
+
+
+def read_memtier_results(path, app, mode):
+    # memtier_results.py records, one per run. The runs it excluded are
+    # left out, so the iterations line up with the ops/s samples.
+    iteration = 0
+    excluded = 0
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if data.get("excluded"):
+                excluded += 1
+                continue
+            iteration += 1
+            for metric in MEMTIER_METRICS:
+                value = data.get(metric)
+                if value is not None and math.isfinite(value):
+                    yield app, app, mode, iteration, metric, value
+    yield app, app, mode, 0, "excluded_runs", excluded
+
+
+def read_open_loop_curve(path, app, mode):
+    # open_loop.py curve, one point per offered load, plus the knee
+    with open(path, "r") as f:
+        for row in csv.DictReader(f):
+            try:
+                values = {col: float(value) for col, value in row.items()}
+            except (TypeError, ValueError):
+                continue
+            benchmark = f"{app}@{values['offered']:.0f}"
+            for metric in OPEN_LOOP_METRICS:
+                if math.isfinite(values.get(metric, math.nan)):
+                    yield "openloop", benchmark, mode, 1, metric, values[metric]
+            if values.get("knee"):
+                yield "openloop", app, mode, 0, "knee_rps", values["achieved"]
+
+
+def read_chromium_csv(path):
+    # Telemetry results, one row per story and page set repeat
+    iterations = defaultdict(int)
+    with open(path, "r") as f:
+        for row in csv.DictReader(f):
+            try:
+                value = float(row["avg"])
+            except (KeyError, ValueError):
+                continue
+            name = row["name"]
+            story = row.get("stories", "")
+            if story and "?" in story:
+                name = f"{name}+{story.split('?')[1]}"
+            mode = row.get("displayLabel", "")
+            iterations[(name, mode)] += 1
+            yield "chromium", name, mode, iterations[(name, mode)], "avg", value
+
+
+def read_run(run_dir):
+    # Yields (suite, benchmark, mode, iteration, metric, value, file) rows
+    for path in sorted(run_dir.glob("spec*.*.csv")):
+        suite, mode = path.name.split(".")[:2]
+        if mode == "results":
+            continue
+        for row in read_spec_csv(path, suite, mode):
+            yield row + (path,)
+
+    for app in APP_METRICS:
+        path = run_dir / f"{app}.csv"
+        if path.exists():
+            for row in read_app_csv(path, app):
+                yield row + (path,)
+
+        for path in sorted((run_dir / "samples").glob(f"{app}.*.txt")):
+            _, mode, *kind, _ = path.name.split(".")
+            if kind == ["startup"]:
+                rows = read_app_samples(path, app, mode, "startup_s")
+            elif not kind:
+                rows = read_app_samples(path, app, mode)
+            else:
+                continue
+            for row in rows:
+                yield row + (path,)
+
+        for pattern in [f"{app}.*.wrk.jsonl", f"{app}.*.dns.jsonl"]:
+            for path in sorted((run_dir / "samples").glob(pattern)):
+                mode = path.name.split(".")[1]
+                for row in read_wrk_results(path, app, mode):
+                    yield row + (path,)
+
+        for path in sorted((run_dir / "samples").glob(f"{app}.*.memtier.jsonl")):
+            mode = path.name.split(".")[1]
+            for row in read_memtier_results(path, app, mode):
+                yield row + (path,)
+
+        for path in sorted((run_dir / "samples").glob(f"{app}.*.openloop.csv")):
+            mode = path.name.split(".")[1]
+            for row in read_open_loop_curve(path, app, mode):
+                yield row + (path,)
+
+    path = run_dir / "chromium.csv"
+    if path.exists() and path.stat().st_size:
+        for row in read_chromium_csv(path):
+            yield row + (path,)
+
+
+def unit_cpus(run_dir):
+    # CPUs each job of the run was pinned to, from its manifest (if any)
+    path = run_dir / "manifest.json"
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        units = json.load(f).get("units", {})
+    return {unit: entry.get("cpus", "") for unit, entry in units.items()}
+
+
+def ingest_run(run_dir, conn=None):
+    run_dir = Path(run_dir)
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    host = socket.gethostname()
+    cpus = unit_cpus(run_dir)
+
+    cursor = conn.execute(
+        "INSERT INTO ingests (run, host, ingested_at) VALUES (?, ?, ?)",
+        (run_dir.name, host, time.time()),
+    )
+    ingest = cursor.lastrowid
+
+    rows = []
+    for suite, benchmark, mode, iteration, metric, value, path in read_run(run_dir):
+        # Jobs are per (suite, mode), the app CSVs are written after them
+        pinning = cpus.get(f"{suite}:{mode}", cpus.get(suite, ""))
+        rows.append(
+            (
+                ingest,
+                run_dir.name,
+                suite,
+                benchmark,
+                mode,
+                iteration,
+                metric,
+                value,
+                path.stat().st_mtime,
+                host,
+                pinning,
+            )
+        )
+
+    conn.executemany("INSERT INTO samples VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    if own_conn:
+        conn.close()
+    return len(rows)
+
+
+def query(conn, **filters):
+    where = [f"{col} = ?" for col, value in filters.items() if value is not None]
+    args = [value for value in filters.values() if value is not None]
+
+    sql = f"SELECT {', '.join(COLUMNS)} FROM latest_samples"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY run, suite, benchmark, mode, metric, iteration"
+    return conn.execute(sql, args).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Results store of all runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="load runs into the store")
+    ingest_parser.add_argument(
+        "runs", nargs="*", help="RunXXX directories (default: all)"
+    )
+
+    query_parser = subparsers.add_parser("query", help="print samples as CSV")
+    for col in ["run", "suite", "benchmark", "mode", "metric"]:
+        query_parser.add_argument(f"--{col}")
+
+    args = parser.parse_args()
+    conn = connect()
+
+    if args.command == "ingest":
+        runs = args.runs or sorted(p.name for p in RAW_DIR.glob("Run*"))
+        for run in runs:
+            run_dir = RAW_DIR / run
+            if not run_dir.is_dir():
+                print(f"Error: {run_dir} does not exist.")
+                sys.exit(1)
+            print(f"{run}: {ingest_run(run_dir, conn)} samples")
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(COLUMNS)
+        writer.writerows(
+            query(
+                conn,
+                run=args.run,
+                suite=args.suite,
+                benchmark=args.benchmark,
+                mode=args.mode,
+                metric=args.metric,
+            )
+        )
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
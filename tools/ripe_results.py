@@ -0,0 +1,165 @@
+import argparse
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+from results_db import RAW_DIR
+
+# Summarises the per-attack records that ripe_tester.py writes with
+# --json-out (run_sec6.2.sh keeps them as RunXXX/ripe_<mode>.jsonl), one
+# JSON object per attack tuple:
+#   {"compiler": ..., "technique": ..., "location": ..., "code_ptr": ...,
+#    "attack": ..., "function": ..., "outcome": "OK"|"SOME"|"FAIL"|"NP",
+#    "successes": ..., "repeat": ..., "attempts": ..., "detections": [...],
+#    "signals": [...], "notes": [...], "elapsed_s": ..., "cached": ...}
+#
+# "summary" streams over the records of a run and prints the Section 6.2
+# table (ripe64_results.txt): the attacks stopped by Clang CFI and SideCFI,
+# and by Clang SafeStack and SideStack, where SOME counts as stopped.
+# "diff" compares two runs attack by attack and lists the attacks whose
+# outcome changed, without running anything again.
+#
+# Runs are RunXXX names under results/raw, directories or .jsonl files.
+#
+# Usage: python3 ripe_results.py summary Run003
+#        python3 ripe_results.py diff Run003 Run004
+
+TUPLE_FIELDS = ["technique", "location", "code_ptr", "attack", "function"]
+
+# (defense, sidecar variant) pairs of the table
+FORWARD = ("clang_cfi", "clang_sidecfi")
+BACKWARD = ("clang_safestack", "clang_sidestack")
+
+WIDTH = 30
+
+
+def record_files(run):
+    path = Path(run)
+    if not path.exists():
+        path = RAW_DIR / run
+    if path.is_dir():
+        return sorted(path.glob("ripe_*.jsonl"))
+    return [path]
+
+
+def read_records(run):
+    for path in record_files(run):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def count_outcomes(records):
+    # {compiler: Counter of outcomes}
+    counts = {}
+    for record in records:
+        counts.setdefault(record["compiler"], Counter())[record["outcome"]] += 1
+    return counts
+
+
+def stopped(counts):
+    return counts["FAIL"] + counts["SOME"]
+
+
+def percentage(part, whole):
+    # As bc with scale=2 computes (part / whole) * 100
+    if not whole:
+        return "n/a"
+    return f"{100 * part // whole}.00"
+
+
+def line(label, value):
+    return f"{label:<{WIDTH}} : {value}"
+
+
+def summary_table(counts):
+    cfi, sidecfi = (counts.get(c, Counter()) for c in FORWARD)
+    safestack, sidestack = (counts.get(c, Counter()) for c in BACKWARD)
+    rule = "-" * 41
+    return "\n".join(
+        [
+            "=" * 41,
+            "             Attack Results              ",
+            "=" * 41,
+            line("Total attacks (FWD)", stopped(cfi) + cfi["OK"]),
+            line("Total attacks (BWD)", stopped(safestack) + safestack["OK"]),
+            rule,
+            line("Stopped by Clang CFI", stopped(cfi)),
+            line(
+                "Stopped by SideCFI",
+                f"{stopped(sidecfi)} "
+                f"({percentage(stopped(sidecfi), stopped(cfi))}%)",
+            ),
+            rule,
+            line("Attacks passed Clang CFI", cfi["OK"]),
+            line("Attacks passed SideCFI", sidecfi["OK"]),
+            rule,
+            line("Stopped by Clang SafeStack", stopped(safestack)),
+            line(
+                "Stopped by SideStack",
+                f"{stopped(sidestack)} "
+                f"({percentage(stopped(sidestack), stopped(safestack))}%)",
+            ),
+            rule,
+            line("Attacks passed Clang SafeStack", safestack["OK"]),
+            line("Attacks passed SideStack", sidestack["OK"]),
+            "=" * 41,
+        ]
+    )
+
+
+def attack_key(record):
+    return (record["compiler"],) + tuple(record[field] for field in TUPLE_FIELDS)
+
+
+def diff_runs(old, new):
+    # [(key, old outcome, new outcome)] of the attacks whose outcome changed,
+    # None for an attack missing from one of the runs
+    old_outcomes = {attack_key(r): r["outcome"] for r in read_records(old)}
+    changes = []
+    seen = set()
+    for record in read_records(new):
+        key = attack_key(record)
+        seen.add(key)
+        before = old_outcomes.get(key)
+        if before != record["outcome"]:
+            changes.append((key, before, record["outcome"]))
+    for key, before in old_outcomes.items():
+        if key not in seen:
+            changes.append((key, before, None))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise RIPE64 results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = subparsers.add_parser("summary", help="Section 6.2 table")
+    summary_parser.add_argument("run", help="RunXXX, directory or .jsonl file")
+
+    diff_parser = subparsers.add_parser("diff", help="attacks that changed")
+    diff_parser.add_argument("old", help="RunXXX, directory or .jsonl file")
+    diff_parser.add_argument("new", help="RunXXX, directory or .jsonl file")
+
+    args = parser.parse_args()
+
+    runs = [args.run] if args.command == "summary" else [args.old, args.new]
+    for run in runs:
+        if not any(path.exists() for path in record_files(run)):
+            print(f"Error: No RIPE records found for {run}.", file=sys.stderr)
+            sys.exit(1)
+
+    if args.command == "summary":
+        print(summary_table(count_outcomes(read_records(args.run))))
+        return
+
+    changes = diff_runs(args.old, args.new)
+    for key, before, after in changes:
+        print(f"{' '.join(key)}: {before or '-'} -> {after or '-'}")
+    print(f"{len(changes)} attacks changed outcome.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
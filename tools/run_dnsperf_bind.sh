@@ -2,61 +2,145 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
 ROOT_DIR="$(cd -- "${SCRIPT_DIR}/.." &> /dev/null && pwd)"
-QUERY_FILE="${ROOT_DIR}/benchmarks/bind/bind9/one.txt"
+QUERY_FILE=${QUERY_FILE:-"${ROOT_DIR}/benchmarks/bind/bind9/one.txt"}
 DNS_SERVER="127.0.0.1"
 
-# Define the modes
-modes=("lto" "cfi" "fineibt" "sidecfi" "safestack" "sidestack" "asan" "sideasan")
+# Define the modes (MODES overrides them, e.g. when run_fig9.py splits them into jobs)
+read -r -a modes <<< "${MODES:-lto cfi fineibt sidecfi safestack sidestack asan sideasan}"
 
-# Initialize variable to save lto throughput
-lto_throughput=0
+# CPUs of the server and of the load generator
+SERVER_CPUS=${SERVER_CPUS:-0}
+CLIENT_CPUS=${CLIENT_CPUS:-3}
+
+# Initialize variable to save lto throughput (LTO_THROUGHPUT when lto is run elsewhere)
+lto_throughput=${LTO_THROUGHPUT:-0}
 throughput=0
 
 # Set this variable to "wrk" to use run_wrk.sh, or "rand" to use random values
 #throughput_source="rand"
 throughput_source="wrk"  # or "rand"
 
+# Per-iteration samples go to results/raw/<run>/samples/bind.<mode>.txt
+samples_app=bind
+source "$SCRIPT_DIR/samples.sh"
+
 duration=600
 
+# Adaptive mode (ADAPTIVE=1): iterate until the 95% CI of the mean is
+# within CI_TARGET percent, between MIN_ITERATIONS and MAX_ITERATIONS runs
+adaptive=${ADAPTIVE:-0}
+ci_target=${CI_TARGET:-1}
+min_iterations=${MIN_ITERATIONS:-2}
+max_iterations=${MAX_ITERATIONS:-10}
+iteration_duration=${ITERATION_DURATION:-60}
+
+# Load generator: dnsperf if it is installed, dns_load.py otherwise
+# (DNS_CLIENT=dnsperf|python to choose). dns_load.py also keeps the latency
+# histogram of every run in samples/bind.<mode>.dns.jsonl.
+dns_client=${DNS_CLIENT:-$(command -v dnsperf > /dev/null && echo dnsperf || echo python)}
+
+# Print the queries/s of a <duration> seconds run, append its result to <file>
+run_dns_load() {
+    if [ "$dns_client" == "dnsperf" ]; then
+        taskset -c $CLIENT_CPUS dnsperf -s $DNS_SERVER -p 1053 -d $QUERY_FILE -l $1 -T 1 | grep "Queries per second" | awk '{print $4}'
+    else
+        taskset -c $CLIENT_CPUS python3 "$SCRIPT_DIR/dns_load.py" -s $DNS_SERVER -p 1053 -d $QUERY_FILE -l $1 --json-out "$2"
+    fi
+}
+
+# Open-loop mode (OPEN_LOOP=1): sweep the offered load instead of saturating
+# the server and report the knee of the latency-throughput curve, see
+# open_loop.py
+open_loop=${OPEN_LOOP:-0}
+
 # Function to get the throughput
 get_throughput() {
     MODE="$1"
     
     if [ "$throughput_source" == "wrk" ]; then
+        # A server left over from the previous mode would be measured instead
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp $DNS_SERVER:1053 --dead > /dev/null; then
+            echo "Error: $DNS_SERVER:1053 is still in use, skipping mode $MODE." >&2
+            echo "0 -1"
+            return
+        fi
+
         # Start the server
-        taskset -c 0 ${SCRIPT_DIR}/build_bind.sh ${MODE} run &> /dev/null &
+        started=$(date +%s.%N)
+        taskset -c $SERVER_CPUS ${SCRIPT_DIR}/build_bind.sh ${MODE} run &> /dev/null &
         server_pid=$!
 
-        # Give the server some time to start properly
-        sleep 5
+        # Wait until it answers, keeping how long it took to start
+        ready=1
+        python3 "$SCRIPT_DIR/readiness.py" dns $DNS_SERVER:1053 --since "$started" >> "$(samples_file "$MODE" startup.txt)" || ready=0
+
+        # Latency results of dns_load.py, one line per run
+        latency_out=$(samples_file "$MODE" dns.jsonl)
+        : > "$latency_out"
 
-        # Capture the output of run_wrk.sh
-        avg_throughput=$(taskset -c 3 dnsperf -s $DNS_SERVER -p 1053 -d $QUERY_FILE -l $duration -T 1 | grep "Queries per second" | awk '{print $4}')
+        if [ "$ready" == "0" ]; then
+            # Nothing to benchmark, the mode fails
+            echo "Error: bind did not start in mode $MODE." >&2
+            avg_throughput=0
+            ci=-1
+        elif [ "$open_loop" == "1" ]; then
+            # Sweep the offered load, the knee is the throughput of the mode
+            avg_throughput=$(taskset -c $CLIENT_CPUS python3 "$SCRIPT_DIR/open_loop.py" bind "$(samples_file "$MODE" openloop.csv)")
+            ci=-1
+        elif [ "$adaptive" == "1" ]; then
+            # Shorter runs, until the mean is precise enough
+            samples=$(mktemp)
+            for i in $(seq 1 $max_iterations); do
+                run_dns_load $iteration_duration "$latency_out" >> "$samples"
+
+                if python3 "$SCRIPT_DIR/confidence.py" "$samples" \
+                    --target "$ci_target" --min "$min_iterations" > /dev/null; then
+                    break
+                fi
+            done
+            read -r runs avg_throughput ci <<< "$(python3 "$SCRIPT_DIR/confidence.py" "$samples")"
+            cp "$samples" "$(samples_file "$MODE")"
+            rm -f "$samples"
+        else
+            # Capture the output of run_wrk.sh
+            avg_throughput=$(run_dns_load $duration "$latency_out")
+            echo "$avg_throughput" > "$(samples_file "$MODE")"
+            ci=-1
+        fi
 
         # Stop the server
 	pkill -f sbin/named
 	wait $server_pid 2>/dev/null
 
-        # Give some time for the server to stop cleanly
-        sleep 2
+        # Wait until it stopped answering
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp $DNS_SERVER:1053 --dead > /dev/null; then
+            echo "Error: bind did not stop after mode $MODE." >&2
+        fi
     elif [ "$throughput_source" == "rand" ]; then
         # Generate a random throughput value between 300 and 499
         avg_throughput=$(od -An -N2 -i /dev/urandom | tr -d ' \n' | awk -v min=300 -v max=499 '{print int(min + ($1 % (max-min+1)))}')
+        ci=-1
     fi
-    echo "$avg_throughput"
+    echo "$avg_throughput $ci"
 }
 
 # Loop through each mode and print the mode and throughput in CSV format
 for mode in "${modes[@]}"; do
     if [ "$mode" == "lto" ]; then
         # Run the workload for lto mode and save its throughput
-        lto_throughput=$(get_throughput "$mode")
+        read -r lto_throughput lto_ci <<< "$(get_throughput "$mode")"
+
+        # Report the raw lto throughput for runs of the other modes
+        if [ "${PRINT_LTO:-0}" == "1" ]; then
+            echo "lto,$lto_throughput,$lto_ci"
+        fi
     else
         if [ "$mode" == "fineibt" ]; then
             throughput=0
+            ci=-1
         else
             # Run the workload for the current mode and get its throughput
-	    current_throughput=$(get_throughput "$mode")
+	    read -r current_throughput ci <<< "$(get_throughput "$mode")"
             # Calculate throughput as (current throughput / lto_throughput) * 100
 	    throughput=$(awk -v ct="$current_throughput" -v lt="$lto_throughput" 'BEGIN {perf=int(ct / lt * 100); if (perf > 100) perf = 100; print perf}')
         fi
@@ -66,7 +150,8 @@ for mode in "${modes[@]}"; do
             throughput=-1
         fi
 
-        echo "$mode,$throughput"
+        # Followed by the relative 95% CI of the throughput of the mode, -1 if unknown
+        echo "$mode,$throughput,$ci"
     fi
 done
 
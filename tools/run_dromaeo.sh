@@ -4,7 +4,8 @@ SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
 ROOT_DIR="$(cd -- "${SCRIPT_DIR}/.." &> /dev/null && pwd)"
 RES_DIR=${ROOT_DIR}/results
 RAW_DIR=${RES_DIR}/raw
-CUR_DIR=$(ls -1 "${RAW_DIR}" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)
+# RUN_NAME selects the run to write to (set when resuming), else the last one
+CUR_DIR=${RUN_NAME:-$(ls -1 "${RAW_DIR}" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)}
 
 # TODO: move this in sidecar
 # CHROMIUM_DIR="/home/kleftog/repos_other/chromium/src"
@@ -32,7 +33,7 @@ for benchmark in "${benchmarks[@]}"; do
         path_suffix=${paths[$i]}
 	BROWSER_PATH=${CHROMIUM_SRC}/out_gn/ra_official${path_suffix}/chrome
 
-        taskset -c 0 xvfb-run -s "-screen 0 1024x768x24" ${RUN_BENCH_DIR} \
+        taskset -c ${SERVER_CPUS:-0} xvfb-run -s "-screen 0 1024x768x24" ${RUN_BENCH_DIR} \
             --browser=exact \
             --browser-executable=${BROWSER_PATH} \
             --results-label=${label} --output-format csv \
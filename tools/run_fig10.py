@@ -1,12 +1,18 @@
+import argparse
 import csv
-import math
 import os
 import subprocess
+import sys
+import time
 from collections import defaultdict
 from pathlib import Path
 
 import numpy as np
 
+import stats
+from manifest import Manifest
+from results_db import ingest_run
+
 script_dir = os.path.dirname(os.path.abspath(__file__))
 spec06_path = Path(script_dir) / "run_spec06.sh"
 
@@ -54,32 +60,47 @@ benchmarks = [
 ]
 
 
-def setup_directories():
+def setup_directories(resume=None):
     # Create base directories if they don't exist
     for dir_path in [RAW_DIR, PARSED_DIR, PLOTS_DIR]:
         if not dir_path.exists():
             os.makedirs(dir_path)
 
-    # Determine the next RunXXX directory
-    existing_runs = sorted(RAW_DIR.glob("Run*"))
-    next_run_num = len(existing_runs)
-    next_run_dir = RAW_DIR / f"Run{next_run_num:03d}"
+    if resume:
+        # Continue in the given RunXXX directory, keeping what it has
+        next_run_dir = RAW_DIR / resume
+        if not next_run_dir.is_dir():
+            print(f"Error: {next_run_dir} does not exist.")
+            sys.exit(1)
+    else:
+        # Determine the next RunXXX directory
+        existing_runs = sorted(RAW_DIR.glob("Run*"))
+        next_run_num = len(existing_runs)
+        next_run_dir = RAW_DIR / f"Run{next_run_num:03d}"
 
-    # Create the next RunXXX directory
-    os.makedirs(next_run_dir)
+        # Create the next RunXXX directory
+        os.makedirs(next_run_dir)
 
     # Touch all the necessary raw files
     for file_name in SPEC_MODES:
         (next_run_dir / file_name).touch()
 
+    # Make the script write to this run rather than to the latest one
+    os.environ["RUN_NAME"] = next_run_dir.name
+
     return next_run_dir
 
 
 def parse_spec_mode(file_path):
+    # Est. Base Ratio (3rd index) of every lap of every benchmark
     spec_data = defaultdict(list)
     with open(file_path, "r") as f:
         reader = csv.reader(f)
         for row in reader:
+            # Skip anything a killed run left half-written
+            if len(row) < 3 or "." not in row[0]:
+                continue
+
             benchmark = row[0].split(".")[1]  # Extract the benchmark name after the dot
             if row[2].strip():
                 try:
@@ -88,50 +109,42 @@ def parse_spec_mode(file_path):
                     value = 0.0  # Assign 0 if conversion fails
             else:
                 value = 0.0
-            spec_data[benchmark].append(value)  # Est. Base Ratio (3rd index)
-
-    avg_data = {
-        benchmark: round(np.mean(results), 2)
-        for benchmark, results in spec_data.items()
-    }
-    return avg_data
-
+            spec_data[benchmark].append(value)
 
-def calculate_performance_over_lto(lto_data, mode_data):
-    performance_data = {}
-    for benchmark, lto_avg in lto_data.items():
-        if benchmark in mode_data:
-            mode_avg = mode_data[benchmark]
-            performance = (lto_avg / mode_avg) * 100
-            performance_data[benchmark] = round(performance, 2)
-        else:
-            performance_data[benchmark] = -1.0
-    return performance_data
+    return spec_data
 
 
 def calculate_geomean(values):
-    filtered_values = [v for v in values if 0 < v <= 100]
-    if not filtered_values:
-        return 0.0
-    return round(np.exp(np.mean(np.log(filtered_values))), 2)
+    return round(float(stats.geomean(np.array(list(values), dtype=float))), 2)
 
 
 def parse_spec_results(run_dir):
-    mode_data = {}
+    samples = {}
 
     for mode in SPEC_MODES:
         file_path = run_dir / mode
         mode_name = mode.split(".")[1]  # Extracting the mode name from the filename
-        mode_data[mode_name] = parse_spec_mode(file_path)
+        samples[mode_name] = parse_spec_mode(file_path)
 
-    lto_data = mode_data.pop("lto")  # LTO is the baseline
+    # LTO is the baseline
+    modes = list(samples)
+    data = stats.to_array(samples, benchmarks, modes)
+    perf, _ = stats.relative_performance(data, modes.index("lto"))
 
     final_results = {
         "griffin": performance_griffin,  # Use the hardcoded Griffin data
     }
 
-    for mode, data in mode_data.items():
-        final_results[mode] = calculate_performance_over_lto(lto_data, data)
+    # Benchmarks without an lto result are left out, the ones that did not
+    # run in a mode get -1.0
+    for m, mode in enumerate(modes):
+        if mode == "lto":
+            continue
+        final_results[mode] = {
+            benchmark: -1.0 if np.isnan(perf[b, m]) else round(float(perf[b, m]), 2)
+            for b, benchmark in enumerate(benchmarks)
+            if benchmark in samples["lto"]
+        }
 
     return final_results
 
@@ -154,9 +167,30 @@ def save_parsed_spec_results(final_results):
         writer.writerow(["geomean", griffin_geomean, sideguard_geomean])
 
 
-def execute_spec06(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(["bash", spec06_path], stdout=subprocess.PIPE, text=True)
+def execute_spec06(run_dir):
+    # Run one mode at a time and checkpoint it, so that --resume can skip
+    # the modes an interrupted run already finished
+    manifest = Manifest(run_dir)
+
+    for mode_file in SPEC_MODES:
+        mode = mode_file.split(".")[1]
+        unit = f"spec06:{mode}"
+        if manifest.done(unit):
+            print(f"Skipping {unit}, already done.")
+            continue
+
+        start_time = time.time()
+        result = subprocess.run(
+            ["bash", spec06_path],
+            stdout=subprocess.PIPE,
+            text=True,
+            env=dict(os.environ, MODES=mode),
+        )
+        manifest.record(
+            unit, result.returncode, time.time() - start_time, result.stdout
+        )
+
+    print(f"Manifest: {manifest.summary()}")
 
 
 def install_ptw_module():
@@ -209,14 +243,22 @@ def install_ptw_module():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the Figure 10 experiments.")
+    parser.add_argument(
+        "--resume",
+        metavar="RunNNN",
+        help="continue an interrupted run, skipping the modes it finished",
+    )
+    args = parser.parse_args()
+
     print("Installing the ptw kernel module...")
     install_ptw_module()
 
     print("Setting up directories...")
-    run_dir = setup_directories()
+    run_dir = setup_directories(args.resume)
 
     print(f"Running spec06 for {run_dir}...")
-    execute_spec06(run_dir / "spec06.results.csv")
+    execute_spec06(run_dir)
 
     print("Parsing results...")
     final_results = parse_spec_results(run_dir)
@@ -224,6 +266,9 @@ def main():
     print("Saving parsed results...")
     save_parsed_spec_results(final_results)
 
+    print("Storing results...")
+    print(f"{ingest_run(run_dir)} samples added to the results store.")
+
     print("Done.")
 
 
@@ -1,5 +1,5 @@
+import argparse
 import csv
-import math
 import os
 import subprocess
 import sys
@@ -8,6 +8,12 @@ from pathlib import Path
 
 import numpy as np
 
+import stats
+from stats import NO_CI
+from manifest import Manifest
+from results_db import ingest_run
+from scheduler import DONE, Job, Scheduler, cpu_list, parse_cpu_list
+
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Constants for directory structure
@@ -35,6 +41,46 @@ SPEC_MODES = [
     "spec17.sideasan.csv",
 ]
 
+# SPEC benchmarks in the order of the parsed CSV
+SPEC_BENCHMARKS = [
+    "perlbench_s",
+    "gcc_s",
+    "mcf_s",
+    "omnetpp_s",
+    "xalancbmk_s",
+    "x264_s",
+    "deepsjeng_s",
+    "leela_s",
+    "xz_s",
+]
+
+# Modes in the order of the parsed CSV (LTO is the baseline)
+SPEC_MODE_ORDER = [
+    "cfi",
+    "fineibt",
+    "sidecfi",
+    "safestack",
+    "sidestack",
+    "asan",
+    "sideasan",
+]
+
+# Benchmarks that do not run with safestack
+SAFESTACK_EXCLUDED = ["perlbench_s", "omnetpp_s", "leela_s"]
+
+# FineIBT needs different hardware, its results are fixed
+FINEIBT_SPEC17 = {
+    "perlbench_s": (95.70, 0.40),
+    "gcc_s": (98.39, 0.54),
+    "mcf_s": (98.79, 0.35),
+    "omnetpp_s": (69.30, 0.09),
+    "xalancbmk_s": (99.17, 0.00),
+    "x264_s": (95.48, 0.00),
+    "deepsjeng_s": (99.56, 0.00),
+    "leela_s": (96.66, 0.00),
+    "xz_s": (100.00, 0.00),
+}
+
 RAW_FILES = [
     "spec17.results.csv",
     "httpd.csv",
@@ -46,6 +92,33 @@ RAW_FILES = [
 
 PARSED_FILES = {"spec": "spec17.csv", "apps": "apps.csv"}
 
+# Modes of the app scripts, in the column order of the app CSVs
+APP_MODES = [
+    "cfi",
+    "fineibt",
+    "sidecfi",
+    "safestack",
+    "sidestack",
+    "asan",
+    "sideasan",
+]
+
+# Per app: script, ports it binds and load generator cores
+APPS = {
+    "httpd": (wrk_httpd_path, [8443], 4),
+    "lighttpd": (wrk_lighttpd_path, [8443], 4),
+    "memcached": (memtier_memcached_path, [11211], 1),
+    "bind": (dnsperf_bind_path, [1053], 1),
+}
+
+# Modes that need the ptw driver
+SIDE_MODES = ["sidecfi", "sidestack", "sideasan"]
+
+# CPUs to schedule the jobs on (FIG9_CPUS, e.g. "0-23") and the maximum
+# number of concurrent jobs (FIG9_JOBS, 1 runs everything serially)
+FIG9_CPUS = os.getenv("FIG9_CPUS")
+FIG9_JOBS = int(os.getenv("FIG9_JOBS", "0"))
+
 
 def prompt_for_env_var(var_name, prompt_message):
     value = os.getenv(var_name)
@@ -84,95 +157,188 @@ os.environ["CHROMIUM_SRC"] = chromium_src
 os.environ["DEPOT_TOOLS"] = depot_tools
 
 
-def setup_directories():
+def setup_directories(resume=None):
     # Create base directories if they don't exist
     for dir_path in [RAW_DIR, PARSED_DIR, PLOTS_DIR]:
         if not dir_path.exists():
             os.makedirs(dir_path)
 
-    # Determine the next RunXXX directory
-    existing_runs = sorted(RAW_DIR.glob("Run*"))
-    next_run_num = len(existing_runs)
-    next_run_dir = RAW_DIR / f"Run{next_run_num:03d}"
+    if resume:
+        # Continue in the given RunXXX directory, keeping what it has
+        next_run_dir = RAW_DIR / resume
+        if not next_run_dir.is_dir():
+            print(f"Error: {next_run_dir} does not exist.")
+            sys.exit(1)
+    else:
+        # Determine the next RunXXX directory
+        existing_runs = sorted(RAW_DIR.glob("Run*"))
+        next_run_num = len(existing_runs)
+        next_run_dir = RAW_DIR / f"Run{next_run_num:03d}"
 
-    # Create the next RunXXX directory
-    os.makedirs(next_run_dir)
+        # Create the next RunXXX directory
+        os.makedirs(next_run_dir)
 
     # Touch all the necessary raw files
     for file_name in RAW_FILES + SPEC_MODES:
         (next_run_dir / file_name).touch()
 
-    return next_run_dir
-
-
-# Functions for each benchmark
-def execute_spec17(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(["bash", spec17_path], stdout=subprocess.PIPE, text=True)
+    # Make the scripts write to this run rather than to the latest one
+    os.environ["RUN_NAME"] = next_run_dir.name
 
+    return next_run_dir
 
-def execute_httpd(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(["bash", wrk_httpd_path], stdout=subprocess.PIPE, text=True)
-
-    # Write the output of the bash script to the file
-    with open(file_path, "w") as f:
-        f.write(result.stdout)
 
+def side_job_args(mode):
+    # The ptw driver can only serve one traced program at a time. No monitor
+    # runs in these jobs, so they get no monitor core.
+    if mode in SIDE_MODES:
+        return {"resources": ["ptw"]}
+    return {}
 
-def execute_lighttpd(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(
-        ["bash", wrk_lighttpd_path], stdout=subprocess.PIPE, text=True
-    )
 
-    # Write the output of the bash script to the file
-    with open(file_path, "w") as f:
-        f.write(result.stdout)
+def lto_throughput_env(job, dep_jobs):
+    # The lto job of the app prints "lto,<throughput>,<ci>" (PRINT_LTO=1)
+    for line in dep_jobs[0].output.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and parts[0] == "lto":
+            return {"LTO_THROUGHPUT": parts[1]}
+    return {"LTO_THROUGHPUT": "0"}
 
 
-def execute_memcached(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(
-        ["bash", memtier_memcached_path], stdout=subprocess.PIPE, text=True
-    )
-
-    # Write the output of the bash script to the file
-    with open(file_path, "w") as f:
-        f.write(result.stdout)
+def app_result_check(mode):
+    # The app scripts exit with 0 even when the benchmark failed and report
+    # the mode's throughput as 0, -1 or nothing instead
+    def check(job):
+        for line in job.output.splitlines():
+            parts = line.strip().split(",")
+            if len(parts) >= 2 and parts[0] == mode:
+                try:
+                    return float(parts[1]) > 0
+                except ValueError:
+                    return False
+        return False
+
+    return check
+
+
+def spec_result_check(run_dir, mode):
+    # runcpu failing leaves the mode's CSV without any result rows
+    def check(job):
+        spec_data = parse_spec_mode(run_dir / f"spec17.{mode}.csv")
+        return any(value > 0 for values in spec_data.values() for value in values)
+
+    return check
+
+
+def add_jobs(scheduler, run_dir):
+    # SPEC takes the longest, so its jobs go first. All its modes share the
+    # SPEC tree and its result directory, so they run one at a time.
+    for mode_file in SPEC_MODES:
+        mode = mode_file.split(".")[1]
+        args = side_job_args(mode)
+        args["resources"] = ["spec17"] + args.get("resources", [])
+        scheduler.add(
+            Job(
+                f"spec17:{mode}",
+                ["bash", spec17_path],
+                env={"MODES": mode},
+                check=spec_result_check(run_dir, mode),
+                **args,
+            )
+        )
 
+    for app, (script, ports, client_cpus) in APPS.items():
+        scheduler.add(
+            Job(
+                f"{app}:lto",
+                ["bash", script],
+                client_cpus=client_cpus,
+                ports=ports,
+                env={"MODES": "lto", "PRINT_LTO": "1"},
+                check=app_result_check("lto"),
+            )
+        )
+        for mode in APP_MODES:
+            scheduler.add(
+                Job(
+                    f"{app}:{mode}",
+                    ["bash", script],
+                    client_cpus=client_cpus,
+                    ports=ports,
+                    deps=[f"{app}:lto"],
+                    env={"MODES": mode},
+                    setup=lto_throughput_env,
+                    # FineIBT is not run, the script reports it as 0
+                    check=None if mode == "fineibt" else app_result_check(mode),
+                    **side_job_args(mode),
+                )
+            )
 
-def execute_bind(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(
-        ["bash", dnsperf_bind_path], stdout=subprocess.PIPE, text=True
+    scheduler.add(Job("chromium", ["bash", dromaeo_path], resources=["ptw"]))
+
+
+def write_app_results(scheduler, run_dir):
+    # Collect the "<mode>,<throughput>,<ci>" lines of the per-mode jobs back
+    # into one CSV per app, in the order the parsers expect
+    for app in APPS:
+        with open(run_dir / f"{app}.csv", "w") as f:
+            for mode in APP_MODES:
+                job = scheduler.jobs[f"{app}:{mode}"]
+                value, ci = "0", str(NO_CI)
+                for line in job.output.splitlines():
+                    parts = line.strip().split(",")
+                    if len(parts) >= 2 and parts[0] == mode:
+                        value = parts[1]
+                        ci = parts[2] if len(parts) > 2 else str(NO_CI)
+                f.write(f"{mode},{value},{ci}\n")
+
+
+def run_tasks(run_dir):
+    if FIG9_CPUS:
+        cpus = parse_cpu_list(FIG9_CPUS)
+    else:
+        cpus = sorted(os.sched_getaffinity(0))
+
+    # Checkpoint every job as it exits and skip the ones a previous,
+    # interrupted run of this directory already finished
+    manifest = Manifest(run_dir)
+    scheduler = Scheduler(
+        cpus,
+        FIG9_JOBS,
+        on_finish=lambda job: manifest.record(
+            job.name,
+            job.returncode,
+            job.elapsed,
+            job.output,
+            cpu_list(job.cpus),
+            valid=job.state == DONE,
+        ),
     )
+    add_jobs(scheduler, run_dir)
 
-    # Write the output of the bash script to the file
-    with open(file_path, "w") as f:
-        f.write(result.stdout)
+    resumed = [name for name in scheduler.jobs if manifest.done(name)]
+    for name in resumed:
+        scheduler.mark_done(name, manifest.output(name))
+    if resumed:
+        print(f"Resuming: {len(resumed)}/{len(scheduler.jobs)} jobs already done.")
 
+    if not scheduler.run():
+        print("Warning: Some jobs failed, their results are reported as 0.")
+    print(f"Manifest: {manifest.summary()}")
 
-def execute_chromium(file_path):
-    # Call the bash script and capture its output
-    result = subprocess.run(["bash", dromaeo_path], stdout=subprocess.PIPE, text=True)
-
-
-def run_placeholder_tasks(run_dir):
-    # Call each benchmark's execution function
-    execute_spec17(run_dir / "spec17.results.csv")
-    execute_httpd(run_dir / "httpd.csv")
-    execute_lighttpd(run_dir / "lighttpd.csv")
-    execute_memcached(run_dir / "memcached.csv")
-    execute_bind(run_dir / "bind.csv")
-    execute_chromium(run_dir / "chromium.csv")
+    write_app_results(scheduler, run_dir)
 
 
 def parse_spec_mode(file_path):
+    # Est. Base Run Time (3rd index) of every lap of every benchmark
     spec_data = {}
     with open(file_path, "r") as f:
         reader = csv.reader(f)
         for row in reader:
+            # Skip anything a killed run left half-written
+            if len(row) < 3 or "." not in row[0]:
+                continue
+
             benchmark = row[0].split(".")[1]  # Extract the benchmark name after the dot
 
             # Check that benchmark is not "exchange2_s"
@@ -189,157 +355,121 @@ def parse_spec_mode(file_path):
 
             if benchmark not in spec_data:
                 spec_data[benchmark] = []
-            spec_data[benchmark].append(value)  # Est. Base Ratio (3rd index)
-
-    avg_stddev_data = {}
-    for benchmark, results in spec_data.items():
-        avg = round(np.mean(results), 2)  # Round average to two decimal places
-        stddev = round(
-            np.std(results), 2
-        )  # Round standard deviation to two decimal places
-        avg_stddev_data[benchmark] = (avg, stddev)
-
-    return avg_stddev_data
-
-
-def calculate_performance_over_lto(lto_data, mode_data):
-    performance_data = {}
-    for benchmark, (lto_avg, lto_std) in lto_data.items():
-        if benchmark in mode_data:
-            mode_avg, mode_std = mode_data[benchmark]
-            performance = (lto_avg / mode_avg) * 100
-            performance_data[benchmark] = (round(performance, 2), mode_std)
-        else:
-            performance_data[benchmark] = (-1.0, 0.0)
-    return performance_data
-
+            spec_data[benchmark].append(value)
 
-def calculate_geomean(values):
-    filtered_values = [v for v in values if 0 < v <= 100]
-    if not filtered_values:
-        return 0.0
-    return np.exp(np.mean(np.log(filtered_values)))
+    return spec_data
 
 
 def parse_spec_results(run_dir):
-    mode_data = {}
+    samples = {}
 
     for mode in SPEC_MODES:
         file_path = run_dir / mode
         mode_name = mode.split(".")[1]  # Extracting the mode name from the filename
-        mode_data[mode_name] = parse_spec_mode(file_path)
+        samples[mode_name] = parse_spec_mode(file_path)
 
-    lto_data = mode_data.pop("lto")  # LTO is the baseline
+    modes = list(samples)
+    data = stats.to_array(samples, SPEC_BENCHMARKS, modes)
+
+    # Exclude the ones safestack cannot run, whatever its files say
+    excluded = [SPEC_BENCHMARKS.index(b) for b in SAFESTACK_EXCLUDED]
+    data[excluded, modes.index("safestack")] = np.nan
+
+    # *geomean leaves them out for every mode
+    star = np.zeros((len(SPEC_BENCHMARKS), len(modes)), dtype=bool)
+    star[excluded] = True
+
+    # LTO is the baseline
+    summary = stats.summarize(
+        data, modes.index("lto"), {"geomean": None, "*geomean": star}
+    )
 
     final_results = {}
+    for m, mode in enumerate(modes):
+        if mode == "lto":
+            continue
+
+        final_results[mode] = {}
+        for b, benchmark in enumerate(SPEC_BENCHMARKS):
+            perf, err = float(summary["perf"][b, m]), float(summary["err"][b, m])
+            if np.isnan(perf):
+                final_results[mode][benchmark] = (-1.0, 0.0)
+            else:
+                final_results[mode][benchmark] = (round(perf, 2), round(err, 2))
 
-    for mode, data in mode_data.items():
-        final_results[mode] = calculate_performance_over_lto(lto_data, data)
-
-        # if mode == "safestack" exclude the ones that didn't run
-        if mode == "safestack":
-            final_results[mode]["perlbench_s"] = (-1.0, 0.0)
-            final_results[mode]["omnetpp_s"] = (-1.0, 0.0)
-            final_results[mode]["leela_s"] = (-1.0, 0.0)
-
-    fineibt_results = {
-        "perlbench_s": (95.70, 0.40),
-        "gcc_s": (98.39, 0.54),
-        "mcf_s": (98.79, 0.35),
-        "omnetpp_s": (69.30, 0.09),
-        "xalancbmk_s": (99.17, 0.00),
-        "x264_s": (95.48, 0.00),
-        "deepsjeng_s": (99.56, 0.00),
-        "leela_s": (96.66, 0.00),
-        "xz_s": (100.00, 0.00),
+    final_results["fineibt"] = FINEIBT_SPEC17
+
+    # Relative 95% CI of the mean run time, from the same laps as the mean
+    cis = stats.relative_ci(data)
+    ci_data = {
+        mode: dict(zip(SPEC_BENCHMARKS, cis[:, m].tolist()))
+        for m, mode in enumerate(modes)
     }
 
-    final_results["fineibt"] = fineibt_results
+    # Geomeans and the relative half-width of their bootstrap CIs
+    geomeans = {}
+    for name in ["geomean", "*geomean"]:
+        geomeans[name] = {}
+        half_widths = stats.relative_half_width(
+            summary["geomean_ci"][name], summary["geomean"][name]
+        )
+        for m, mode in enumerate(modes):
+            geomeans[name][mode] = (
+                summary["geomean"][name][m],
+                round(float(half_widths[m]), 2),
+            )
+
+        fineibt = np.array([perf for perf, _ in FINEIBT_SPEC17.values()])
+        fineibt_star = fineibt[[b not in SAFESTACK_EXCLUDED for b in FINEIBT_SPEC17]]
+        geomeans[name]["fineibt"] = (
+            stats.geomean(fineibt if name == "geomean" else fineibt_star),
+            NO_CI,
+        )
 
-    return final_results
+    return final_results, geomeans, ci_data
 
 
-def save_parsed_spec_results(final_results):
+def save_parsed_spec_results(final_results, geomeans, ci_data):
     with open(PARSED_DIR / PARSED_FILES["spec"], "w", newline="") as f:
         writer = csv.writer(f)
 
-        # Define the correct order of benchmarks
-        benchmark_order = [
-            "perlbench_s",
-            "gcc_s",
-            "mcf_s",
-            "omnetpp_s",
-            "xalancbmk_s",
-            "x264_s",
-            "deepsjeng_s",
-            "leela_s",
-            "xz_s",
-        ]
-
-        # Define the order of modes (excluding LTO)
-        mode_order = [
-            "cfi",
-            "fineibt",
-            "sidecfi",
-            "safestack",
-            "sidestack",
-            "asan",
-            "sideasan",
-        ]
+        # Modes and benchmarks that did not run (yet) count as -1.0
+        for mode in SPEC_MODE_ORDER:
+            for benchmark in SPEC_BENCHMARKS:
+                final_results[mode].setdefault(benchmark, (-1.0, 0.0))
 
         # Write rows for each benchmark in the specified order
-        for benchmark in benchmark_order:
-            if (
-                benchmark in final_results["cfi"]
-            ):  # Ensure the benchmark exists in results
-                row = [benchmark]
-                for (
-                    mode
-                ) in mode_order:  # Iterate through the modes in the specified order
-                    if final_results[mode][benchmark][0] is not None:
-                        row.extend(final_results[mode][benchmark])
-                    else:
-                        row.extend(["-1.0", "0.0"])
-                writer.writerow(row)
-
-        # Calculate *geomean excluding perlbench_s, omnetpp_s, and leela_s for safestack and sidestack
-        geomean_values_star = {}
-        for mode in mode_order:
-            if mode in ["safestack", "sidestack"]:
-                mode_geomeans = []
-                for benchmark in benchmark_order:
-                    if benchmark not in ["perlbench_s", "omnetpp_s", "leela_s"]:
-                        if final_results[mode][benchmark][0] is not None:
-                            mode_geomeans.append(final_results[mode][benchmark][0])
-                geomean_values_star[mode] = calculate_geomean(mode_geomeans)
-            else:
-                geomean_values_star[mode] = 0.0
-
-        # Write *geomean row
-        geomean_row_star = ["*geomean"]
-        for mode in mode_order:
-            geomean_row_star.append(f"{geomean_values_star[mode]:.2f}")
-            geomean_row_star.append("0.00")  # Std dev is 0 for geomean
-        writer.writerow(geomean_row_star)
-
-        # Calculate geomean for all modes except safestack
-        geomean_values = {}
-        for mode in mode_order:
-            if mode == "safestack":
-                geomean_values[mode] = 0.0
-            else:
-                mode_geomeans = []
-                for benchmark in benchmark_order:
-                    if final_results[mode][benchmark][0] is not None:
-                        mode_geomeans.append(final_results[mode][benchmark][0])
-                geomean_values[mode] = calculate_geomean(mode_geomeans)
-
-        # Write geomean row
-        geomean_row = ["geomean"]
-        for mode in mode_order:
-            geomean_row.append(f"{geomean_values[mode]:.2f}")
-            geomean_row.append("0.00")  # Std dev is 0 for geomean
-        writer.writerow(geomean_row)
+        for benchmark in SPEC_BENCHMARKS:
+            row = [benchmark]
+            for mode in SPEC_MODE_ORDER:  # Iterate through the modes in order
+                row.extend(final_results[mode][benchmark])
+
+            # Followed by the relative 95% CI of each mode, -1 if unknown
+            for mode in SPEC_MODE_ORDER:
+                if final_results[mode][benchmark][0] == -1.0:
+                    row.append(NO_CI)
+                else:
+                    row.append(ci_data.get(mode, {}).get(benchmark, NO_CI))
+            writer.writerow(row)
+
+        # *geomean excludes perlbench_s, omnetpp_s, and leela_s and is only
+        # reported for safestack and sidestack, geomean for all modes except
+        # safestack
+        for name, only in [
+            ("*geomean", ["safestack", "sidestack"]),
+            ("geomean", [m for m in SPEC_MODE_ORDER if m != "safestack"]),
+        ]:
+            row = [name]
+            cis = []
+            for mode in SPEC_MODE_ORDER:
+                value, ci = geomeans[name][mode] if mode in only else (0.0, NO_CI)
+                row.append(f"{value:.2f}")
+                row.append("0.00")  # Std dev is 0 for geomean
+                cis.append(ci)
+
+            # Followed by the relative 95% bootstrap CI of each geomean
+            row.extend(cis)
+            writer.writerow(row)
 
 
 def parse_apps(run_dir):
@@ -350,16 +480,38 @@ def parse_apps(run_dir):
     apps_data["bind"] = parse_bind(run_dir / "bind.csv")
     apps_data["chromium"] = parse_chromium(run_dir / "chromium.csv")
 
+    # An app that did not run all its modes (yet) gets 0 for the rest
+    for app, values in apps_data.items():
+        values.extend([0] * (len(APP_MODES) - len(values)))
+
     return apps_data
 
 
+def parse_apps_ci(run_dir):
+    # Relative 95% CI reported by the app scripts next to each throughput
+    apps_ci = {}
+    for app in APPS:
+        cis = []
+        with open(run_dir / f"{app}.csv", "r") as f:
+            for line in f:
+                parts = line.strip().split(",")
+                if len(parts) >= 2:
+                    cis.append(float(parts[2]) if len(parts) > 2 else NO_CI)
+        apps_ci[app] = cis + [NO_CI] * (len(APP_MODES) - len(cis))
+
+    # Dromaeo reports averages only
+    apps_ci["chromium"] = [NO_CI] * len(APP_MODES)
+
+    return apps_ci
+
+
 def parse_httpd(httpd_file):
     values = []
     with open(httpd_file, "r") as f:
         for line in f:
             parts = line.strip().split(",")
-            if len(parts) == 2:
-                mode, value = parts
+            if len(parts) >= 2:
+                mode, value = parts[:2]
                 values.append(float(value))
     return values
 
@@ -369,8 +521,8 @@ def parse_lighttpd(lighttpd_file):
     with open(lighttpd_file, "r") as f:
         for line in f:
             parts = line.strip().split(",")
-            if len(parts) == 2:
-                mode, value = parts
+            if len(parts) >= 2:
+                mode, value = parts[:2]
                 values.append(float(value))
     return values
 
@@ -380,8 +532,8 @@ def parse_memcached(memcached_file):
     with open(memcached_file, "r") as f:
         for line in f:
             parts = line.strip().split(",")
-            if len(parts) == 2:
-                mode, value = parts
+            if len(parts) >= 2:
+                mode, value = parts[:2]
                 values.append(float(value))
     return values
 
@@ -391,17 +543,15 @@ def parse_bind(bind_file):
     with open(bind_file, "r") as f:
         for line in f:
             parts = line.strip().split(",")
-            if len(parts) == 2:
-                mode, value = parts
+            if len(parts) >= 2:
+                mode, value = parts[:2]
                 values.append(float(value))
     return values
 
 
 def parse_chromium(chromium_file):
-    # Initialize dictionaries to store LTO, CFI, and SIDECFI averages
-    lto_sums = defaultdict(list)
-    cfi_sums = defaultdict(list)
-    sidecfi_sums = defaultdict(list)
+    # Averages of every story per displayLabel (lto, cfi, or sidecfi)
+    samples = {label: defaultdict(list) for label in ["lto", "cfi", "sidecfi"]}
 
     # Open the CSV file and read its content
     with open(chromium_file, mode="r") as file:
@@ -420,96 +570,24 @@ def parse_chromium(chromium_file):
             else:
                 refined_name = name
 
-            # Store the averages based on the displayLabel (lto, cfi, or sidecfi)
-            if label == "lto":
-                lto_sums[refined_name].append(avg)
-            elif label == "cfi":
-                cfi_sums[refined_name].append(avg)
-            elif label == "sidecfi":
-                sidecfi_sums[refined_name].append(avg)
-
-    # Initialize variables to calculate totals and geometric mean
-    total_lto_sum = 0
-    total_cfi_sum = 0
-    total_sidecfi_sum = 0
-    geomean_cfi_list = []
-    geomean_sidecfi_list = []
+            if label in samples:
+                samples[label][refined_name].append(avg)
 
-    values = []
+    # Performance of cfi and sidecfi relative to lto, per story
+    names = list(samples["lto"])
+    data = stats.to_array(samples, names, ["lto", "cfi", "sidecfi"])
+    perf, _ = stats.relative_performance(data)
 
-    # Calculate the average for each name+suffix and print the results
-    for name in lto_sums:
-        lto_avg = sum(lto_sums[name]) / len(lto_sums[name]) if lto_sums[name] else 0
-        cfi_avg = (
-            sum(cfi_sums.get(name, [])) / len(cfi_sums.get(name, []))
-            if cfi_sums.get(name)
-            else None
-        )
-        sidecfi_avg = (
-            sum(sidecfi_sums.get(name, [])) / len(sidecfi_sums.get(name, []))
-            if sidecfi_sums.get(name)
-            else None
-        )
-
-        if cfi_avg is not None and sidecfi_avg is not None:
-            cfi_percentage = (lto_avg / cfi_avg) * 100 if lto_avg != 0 else float("inf")
-            sidecfi_percentage = (
-                (lto_avg / sidecfi_avg) * 100 if lto_avg != 0 else float("inf")
-            )
-            # print(
-            #    f"{name} {lto_avg:.2f} {cfi_avg:.2f} {sidecfi_avg:.2f} {cfi_percentage:.2f}% {sidecfi_percentage:.2f}%"
-            # )
-
-            # Update the totals
-            total_lto_sum += lto_avg
-            total_cfi_sum += cfi_avg
-            total_sidecfi_sum += sidecfi_avg
-
-            if cfi_percentage < 100 and sidecfi_percentage < 100:
-                geomean_cfi_list.append(cfi_percentage)
-                geomean_sidecfi_list.append(sidecfi_percentage)
-
-    # Calculate total percentages
-    total_cfi_percentage = (
-        (total_lto_sum / total_cfi_sum) * 100 if total_lto_sum != 0 else float("inf")
-    )
-    total_sidecfi_percentage = (
-        (total_lto_sum / total_sidecfi_sum) * 100
-        if total_lto_sum != 0
-        else float("inf")
-    )
-
-    # Calculate geometric means of percentages
-    geomean_cfi = (
-        round(
-            math.exp(
-                math.fsum(math.log(p) for p in geomean_cfi_list) / len(geomean_cfi_list)
-            ),
-            2,
-        )
-        if geomean_cfi_list
-        else None
-    )
-    geomean_sidecfi = (
-        round(
-            math.exp(
-                math.fsum(math.log(p) for p in geomean_sidecfi_list)
-                / len(geomean_sidecfi_list)
-            ),
-            2,
-        )
-        if geomean_sidecfi_list
-        else None
-    )
+    # Only the stories where both cfi and sidecfi ran and are below lto
+    # count towards the geomeans
+    with np.errstate(invalid="ignore"):
+        included = np.all(perf[:, 1:] < 100, axis=1)
+    geomeans = stats.geomean(perf[:, 1:], exclude=~included[:, None])
 
-    # Add the calculated geomeans to the values list for returning
-    values.append(geomean_cfi if geomean_cfi is not None else 0)
-    values.append(0)
-    values.append(geomean_sidecfi if geomean_sidecfi is not None else 0)
-    values.append(0)
-    values.append(0)
-    values.append(0)
-    values.append(0)
+    # The geomeans in the cfi and sidecfi columns of the apps CSV
+    values = [0] * len(APP_MODES)
+    values[APP_MODES.index("cfi")] = round(float(geomeans[0]), 2)
+    values[APP_MODES.index("sidecfi")] = round(float(geomeans[1]), 2)
 
     return values
 
@@ -520,37 +598,33 @@ def parse_results(run_dir):
         os.makedirs(PARSED_DIR)
 
     # Parse the spec results
-    final_results = parse_spec_results(run_dir)
+    final_results, geomeans, ci_data = parse_spec_results(run_dir)
 
     # Save the parsed spec results
-    save_parsed_spec_results(final_results)
+    save_parsed_spec_results(final_results, geomeans, ci_data)
 
     # Parse the apps CSVs and calculate the geomean
     apps_data = parse_apps(run_dir)
+    apps_ci = parse_apps_ci(run_dir)
 
     with open(PARSED_DIR / PARSED_FILES["apps"], "w") as apps_out:
         all_values = []
         for app, values in apps_data.items():
-            values_str = [str(v) for v in values]
+            # The values are followed by their relative 95% CIs
+            values_str = [str(v) for v in values + apps_ci[app]]
             apps_out.write(f'"{app}",' + ", ".join(values_str) + "\n")
             all_values.append(values)
 
-        # Initialize a list to store valid geomean values
-        valid_geomean_values = []
-
-        # Iterate over each column (0 to 6 for the 7 values)
-        for i in range(7):
-            column_values = [values[i] for values in all_values]
-
-            if all(value != 0 for value in column_values):
-                valid_geomean_values.append(calculate_geomean(column_values))
-            else:
-                valid_geomean_values.append(None)
+        # Geomean of each mode, only where every app has a value
+        all_values = np.array(all_values, dtype=float)
+        column_geomeans = stats.geomean(all_values)
+        complete = np.all(all_values != 0, axis=0)
 
         geomean_str = '"**geomean",'
         geomean_str += (
             ", ".join(
-                [f"{v:.2f}" if v is not None else "0" for v in valid_geomean_values]
+                [f"{v:.2f}" if ok else "0" for v, ok in zip(column_geomeans, complete)]
+                + [str(NO_CI)] * len(APP_MODES)
             )
             + "\n"
         )
@@ -607,18 +681,29 @@ def install_ptw_module():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the Figure 9 experiments.")
+    parser.add_argument(
+        "--resume",
+        metavar="RunNNN",
+        help="continue an interrupted run, skipping the jobs it finished",
+    )
+    args = parser.parse_args()
+
     print("Installing the ptw kernel module...")
     install_ptw_module()
 
     print("Setting up directories...")
-    run_dir = setup_directories()
+    run_dir = setup_directories(args.resume)
 
     print(f"Running tasks for {run_dir}...")
-    run_placeholder_tasks(run_dir)
+    run_tasks(run_dir)
 
     print("Parsing results...")
     parse_results(run_dir)
 
+    print("Storing results...")
+    print(f"{ingest_run(run_dir)} samples added to the results store.")
+
     print("Done.")
 
 
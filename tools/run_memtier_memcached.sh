@@ -5,64 +5,142 @@ ROOT_DIR="$(cd -- "${SCRIPT_DIR}/.." &> /dev/null && pwd)"
 PORT=11211
 USER="kleftog"
 
-# Define the modes
-modes=("lto" "cfi" "fineibt" "sidecfi" "safestack" "sidestack" "asan" "sideasan")
+# Define the modes (MODES overrides them, e.g. when run_fig9.py splits them into jobs)
+read -r -a modes <<< "${MODES:-lto cfi fineibt sidecfi safestack sidestack asan sideasan}"
 
-# Initialize variable to save lto throughput
-lto_throughput=0
+# CPUs of the server and of the load generator
+SERVER_CPUS=${SERVER_CPUS:-0}
+CLIENT_CPUS=${CLIENT_CPUS:-3}
+
+# Initialize variable to save lto throughput (LTO_THROUGHPUT when lto is run elsewhere)
+lto_throughput=${LTO_THROUGHPUT:-0}
 throughput=0
 
 # Set this variable to "wrk" to use run_wrk.sh, or "rand" to use random values
 #throughput_source="rand"
 throughput_source="wrk"  # or "rand"
 
+# Per-iteration samples go to results/raw/<run>/samples/memcached.<mode>.txt,
+# the full result of every memtier run to memcached.<mode>.memtier.jsonl
+samples_app=memcached
+source "$SCRIPT_DIR/samples.sh"
+
 iterations=10
 duration=60
 
+# Adaptive mode (ADAPTIVE=1): iterate until the 95% CI of the mean is
+# within CI_TARGET percent, between MIN_ITERATIONS and MAX_ITERATIONS runs
+adaptive=${ADAPTIVE:-0}
+ci_target=${CI_TARGET:-1}
+min_iterations=${MIN_ITERATIONS:-2}
+max_iterations=$iterations
+if [ "$adaptive" == "1" ]; then
+    max_iterations=${MAX_ITERATIONS:-$iterations}
+fi
+
+# Open-loop mode (OPEN_LOOP=1): sweep the offered load instead of saturating
+# the server and report the knee of the latency-throughput curve, see
+# open_loop.py
+open_loop=${OPEN_LOOP:-0}
+
+# Run memtier_benchmark once and write its JSON result to <file>
+run_memtier() {
+    : > "$1"
+    taskset -c $CLIENT_CPUS ${ROOT_DIR}/install/tools/memtier_benchmark -p $PORT -P memcache_binary --protocol=memcache_binary -t 2 -c 4 -d 32 --test-time=$duration --ratio=0:1 --pipeline=10000 --key-pattern=S:S --print-percentiles=50,90,99,99.9 --run-count=1 --json-out-file="$1" &> /dev/null
+}
+
 # Function to get the throughput
 get_throughput() {
     MODE="$1"
     
     if [ "$throughput_source" == "wrk" ]; then
+        # A server left over from the previous mode would be measured instead
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp 127.0.0.1:$PORT --dead > /dev/null; then
+            echo "Error: 127.0.0.1:$PORT is still in use, skipping mode $MODE." >&2
+            echo "0 -1"
+            return
+        fi
+
         # Start the server
-        taskset -c 0 ${SCRIPT_DIR}/build_memcached.sh ${MODE} run &> /dev/null &
+        started=$(date +%s.%N)
+        taskset -c $SERVER_CPUS ${SCRIPT_DIR}/build_memcached.sh ${MODE} run &> /dev/null &
         server_pid=$!
 
-        # Give the server some time to start properly
-        sleep 2
-
-        # Capture the output of run_wrk.sh
-	avg_throughput=$(taskset -c 3 ${ROOT_DIR}/install/tools/memtier_benchmark -p $PORT -P memcache_binary --protocol=memcache_binary -t 2 -c 4 -d 32 --test-time=$duration --ratio=0:1 --pipeline=10000 --key-pattern=S:S --run-count=$iterations 2>&1 | grep Totals | tail -n 1 | awk '{print $2}')
+        # Wait until it answers, keeping how long it took to start
+        ready=1
+        python3 "$SCRIPT_DIR/readiness.py" memcached 127.0.0.1:$PORT --since "$started" >> "$(samples_file "$MODE" startup.txt)" || ready=0
+
+        if [ "$ready" == "0" ]; then
+            # Nothing to benchmark, the mode fails
+            echo "Error: memcached did not start in mode $MODE." >&2
+            avg_throughput=0
+            ci=-1
+        elif [ "$open_loop" == "1" ]; then
+            # Sweep the offered load, the knee is the throughput of the mode
+            avg_throughput=$(taskset -c $CLIENT_CPUS python3 "$SCRIPT_DIR/open_loop.py" memcached "$(samples_file "$MODE" openloop.csv)")
+            ci=-1
+        else
+            # Ops/s of the runs kept, every run with its latencies and hits/misses
+            samples=$(mktemp)
+            run_results=$(mktemp)
+            result=$(mktemp)
+
+            # One run at a time, in adaptive mode until the mean is precise enough
+            for i in $(seq 1 $max_iterations); do
+                run_memtier "$result"
+                python3 "$SCRIPT_DIR/memtier_results.py" "$result" "$run_results" "$samples"
+
+                if [ "$adaptive" == "1" ] && python3 "$SCRIPT_DIR/confidence.py" "$samples" \
+                    --target "$ci_target" --min "$min_iterations" > /dev/null; then
+                    break
+                fi
+            done
+
+            # Failed and outlying runs are left out of the mean and its CI
+            read -r runs avg_throughput ci <<< "$(python3 "$SCRIPT_DIR/confidence.py" "$samples")"
+            cp "$samples" "$(samples_file "$MODE")"
+            cp "$run_results" "$(samples_file "$MODE" memtier.jsonl)"
+            rm -f "$samples" "$run_results" "$result"
+        fi
 
         # Stop the server
 	pkill -f ./memcached
 	wait $server_pid 2>/dev/null
 
-        # Give some time for the server to stop cleanly
-        sleep 2
+        # Wait until it stopped answering
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp 127.0.0.1:$PORT --dead > /dev/null; then
+            echo "Error: memcached did not stop after mode $MODE." >&2
+        fi
     elif [ "$throughput_source" == "rand" ]; then
         # Generate a random throughput value between 300 and 499
         avg_throughput=$(od -An -N2 -i /dev/urandom | tr -d ' \n' | awk -v min=300 -v max=499 '{print int(min + ($1 % (max-min+1)))}')
+        ci=-1
     fi
 
     if [ -z "$avg_throughput" ] || [ "$avg_throughput" == "-nan" ]; then
 	    avg_throughput=0
     fi
 
-    echo "$avg_throughput"
+    echo "$avg_throughput $ci"
 }
 
 # Loop through each mode and print the mode and throughput in CSV format
 for mode in "${modes[@]}"; do
     if [ "$mode" == "lto" ]; then
         # Run the workload for lto mode and save its throughput
-        lto_throughput=$(get_throughput "$mode")
+        read -r lto_throughput lto_ci <<< "$(get_throughput "$mode")"
+
+        # Report the raw lto throughput for runs of the other modes
+        if [ "${PRINT_LTO:-0}" == "1" ]; then
+            echo "lto,$lto_throughput,$lto_ci"
+        fi
     else
         if [ "$mode" == "fineibt" ]; then
             throughput=0
+            ci=-1
         else
             # Run the workload for the current mode and get its throughput
-	    current_throughput=$(get_throughput "$mode")
+	    read -r current_throughput ci <<< "$(get_throughput "$mode")"
             # Calculate throughput as (current throughput / lto_throughput) * 100
 	    throughput=$(awk -v ct="$current_throughput" -v lt="$lto_throughput" 'BEGIN {perf=int(ct / lt * 100); if (perf > 100) perf = 100; print perf}')
 
@@ -73,7 +151,8 @@ for mode in "${modes[@]}"; do
             throughput=-1
         fi
 
-        echo "$mode,$throughput"
+        # Followed by the relative 95% CI of the throughput of the mode, -1 if unknown
+        echo "$mode,$throughput,$ci"
     fi
 done
 
@@ -81,6 +81,9 @@ RIPE_PATH="$SCRIPT_DIR/../benchmarks/ripe64"
 # Define the modes
 modes=("clang_cfi" "clang_sidecfi" "clang_safestack" "clang_sidestack")
 
+# Attacks run at once in the modes without a monitor, one per CPU
+ripe_jobs=${RIPE_JOBS:-$(nproc)}
+
 check_and_remove_ptw
 load_ptw_module_int
   
@@ -91,7 +94,7 @@ make clean all
 for mode in "${modes[@]}"; do
     echo "Running ripe_tester for mode: $mode"
     log_file="${CUR_RUN_DIR}/ripe_${mode}.log"
-    if python3 ripe_tester.py both 3 "$mode" --only-summary --format-bash > "$log_file" 2>&1; then
+    if python3 ripe_tester.py both 3 "$mode" --only-summary --format-bash --jobs="$ripe_jobs" --json-out="${CUR_RUN_DIR}/ripe_${mode}.jsonl" > "$log_file" 2>&1; then
         echo "Successfully ran ripe_tester for mode: $mode. Log saved to $log_file."
     else
         echo "Error: ripe_tester failed for mode: $mode. Check $log_file for details."
@@ -99,82 +102,6 @@ for mode in "${modes[@]}"; do
     fi
 done
 
-# Extract relevant results from log files
-function extract_results {
-    log_file="$1"
-    grep -E "OK: [0-9]+ SOME: [0-9]+ FAIL: [0-9]+ NP: [0-9]+ Total Attacks: [0-9]+" "$log_file"
-}
-
-function compare_results {
-    # Extract FAIL and SOME counts for Clang CFI
-    cfi_fail=$(echo "$1" | grep -oP 'FAIL: \K[0-9]+' | paste -sd+ - | bc)
-    cfi_some=$(echo "$1" | grep -oP 'SOME: \K[0-9]+' | paste -sd+ - | bc)
-    cfi_fail=$((cfi_fail + cfi_some))
-    cfi_ok=$(echo "$1" | grep -oP 'OK: \K[0-9]+')
-    
-    # Extract FAIL and SOME counts for SideCFI
-    sidecfi_fail=$(echo "$2" | grep -oP 'FAIL: \K[0-9]+' | paste -sd+ - | bc)
-    sidecfi_some=$(echo "$2" | grep -oP 'SOME: \K[0-9]+' | paste -sd+ - | bc)
-    sidecfi_fail=$((sidecfi_fail + sidecfi_some))
-    sidecfi_ok=$(echo "$2" | grep -oP 'OK: \K[0-9]+')
-    
-    # Extract FAIL and SOME counts for Clang SafeStack
-    safestack_fail=$(echo "$3" | grep -oP 'FAIL: \K[0-9]+' | paste -sd+ - | bc)
-    safestack_some=$(echo "$3" | grep -oP 'SOME: \K[0-9]+' | paste -sd+ - | bc)
-    safestack_fail=$((safestack_fail + safestack_some))
-    safestack_ok=$(echo "$3" | grep -oP 'OK: \K[0-9]+')
-    
-    # Extract FAIL and SOME counts for SideStack
-    sidestack_fail=$(echo "$4" | grep -oP 'FAIL: \K[0-9]+' | paste -sd+ - | bc)
-    sidestack_some=$(echo "$4" | grep -oP 'SOME: \K[0-9]+' | paste -sd+ - | bc)
-    sidestack_fail=$((sidestack_fail + sidestack_some))
-    sidestack_ok=$(echo "$4" | grep -oP 'OK: \K[0-9]+')
-
-    # Extract the total number of attacks for CFI and SafeStack
-    total_attacks_cfi=$((cfi_fail + cfi_ok))
-    total_attacks_safestack=$((safestack_fail + safestack_ok))
-
-    # Calculate percentages relative to Clang CFI and SafeStack
-    sidecfi_percentage=$(echo "scale=2; ($sidecfi_fail / $cfi_fail) * 100" | bc)
-    sidestack_percentage=$(echo "scale=2; ($sidestack_fail / $safestack_fail) * 100" | bc)
-
-    # Write the results to the output file in a visually appealing way
-    {
-        echo "========================================="
-        echo "             Attack Results              "
-        echo "========================================="
-        printf "%-30s : %s\n" "Total attacks (FWD)" "$total_attacks_cfi"
-        printf "%-30s : %s\n" "Total attacks (BWD)" "$total_attacks_safestack"
-        echo "-----------------------------------------"
-        printf "%-30s : %s\n" "Stopped by Clang CFI" "$cfi_fail"
-        printf "%-30s : %s (%s%%)\n" "Stopped by SideCFI" "$sidecfi_fail" "$sidecfi_percentage"
-        echo "-----------------------------------------"
-        printf "%-30s : %s\n" "Attacks passed Clang CFI" "$cfi_ok"
-        printf "%-30s : %s\n" "Attacks passed SideCFI" "$sidecfi_ok"
-        echo "-----------------------------------------"
-        printf "%-30s : %s\n" "Stopped by Clang SafeStack" "$safestack_fail"
-        printf "%-30s : %s (%s%%)\n" "Stopped by SideStack" "$sidestack_fail" "$sidestack_percentage"
-        echo "-----------------------------------------"
-        printf "%-30s : %s\n" "Attacks passed Clang SafeStack" "$safestack_ok"
-        printf "%-30s : %s\n" "Attacks passed SideStack" "$sidestack_ok"
-        echo "========================================="
-    } >> ${PARSE_DIR}/ripe64_results.txt
-}
-
-# Path to the ripe_tester log files
-log="${CUR_RUN_DIR}/ripe_clang.log"
-log_cfi="${CUR_RUN_DIR}/ripe_clang_cfi.log"
-log_sidecfi="${CUR_RUN_DIR}/ripe_clang_sidecfi.log"
-log_safestack="${CUR_RUN_DIR}/ripe_clang_safestack.log"
-log_sidestack="${CUR_RUN_DIR}/ripe_clang_sidestack.log"
-
-# Extract and compare results
-results_cfi=$(extract_results "$log_cfi")
-results_sidecfi=$(extract_results "$log_sidecfi")
-results_safestack=$(extract_results "$log_safestack")
-results_sidestack=$(extract_results "$log_sidestack")
-
-# Compare and print
-rm -rf ${PARSE_DIR}/ripe64_results.txt
-compare_results "$results_cfi" "$results_sidecfi" "$results_safestack" "$results_sidestack"
-
+# Build the Section 6.2 table from the per-attack records of the run
+mkdir -p "${PARSE_DIR}"
+python3 "$SCRIPT_DIR/ripe_results.py" summary "$CUR_RUN_DIR" > "${PARSE_DIR}/ripe64_results.txt"
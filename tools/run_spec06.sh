@@ -2,8 +2,8 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
 
-# Define the modes
-modes=("lto" "sideguard")
+# Define the modes (MODES overrides them, e.g. when run_fig10.py resumes a run)
+read -r -a modes <<< "${MODES:-lto sideguard}"
 
 # Choose size of inputs
 size=train
@@ -26,8 +26,8 @@ fi
 # Define the base directory where the Runxxx directories are located
 base_dir="$SCRIPT_DIR/../results/raw"
 
-# Find the last Runxxx directory
-next_run=$(ls -1 "$base_dir" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)
+# Find the last Runxxx directory, unless RUN_NAME selects one (when resuming)
+next_run=${RUN_NAME:-$(ls -1 "$base_dir" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)}
 
 # cd to spec06 directory run ./shrc and then come back
 cd "$spec06_dir" || exit
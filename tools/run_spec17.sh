@@ -2,8 +2,11 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
 
-# Define the modes
-modes=("lto" "cfi" "sidecfi" "safestack" "sidestack" "asan" "sideasan")
+# Define the modes (MODES overrides them, e.g. when run_fig9.py splits them into jobs)
+read -r -a modes <<< "${MODES:-lto cfi sidecfi safestack sidestack asan sideasan}"
+
+# CPUs to run SPEC on
+SERVER_CPUS=${SERVER_CPUS:-0}
 
 # Choose size of inputs
 size="ref"
@@ -11,6 +14,14 @@ size="ref"
 #size=train
 laps=3
 
+# Adaptive mode (ADAPTIVE=1): run one lap at a time until the 95% CI of
+# every benchmark's mean is within CI_TARGET percent, between
+# MIN_ITERATIONS and MAX_ITERATIONS laps
+adaptive=${ADAPTIVE:-0}
+ci_target=${CI_TARGET:-1}
+min_iterations=${MIN_ITERATIONS:-2}
+max_iterations=${MAX_ITERATIONS:-5}
+
 # Spec2017 directory
 spec17_dir="$SCRIPT_DIR/../benchmarks/spec2017"
 
@@ -28,8 +39,8 @@ fi
 # Define the base directory where the Runxxx directories are located
 base_dir="$SCRIPT_DIR/../results/raw"
 
-# Find the last Runxxx directory
-next_run=$(ls -1 "$base_dir" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)
+# Find the last Runxxx directory, unless RUN_NAME selects one (when resuming)
+next_run=${RUN_NAME:-$(ls -1 "$base_dir" | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)}
 
 # cd to spec17 directory run ./shrc and then come back
 cd "$spec17_dir" || exit
@@ -46,17 +57,36 @@ for mode in "${modes[@]}"; do
         llvm_path="$SCRIPT_DIR/../sidecar/install/llvm-sidecar"
     fi
 
-    # Run the spec17 benchmark
-    taskset -c 0 runcpu --action=run --config=$mode --size=$size --label=$mode \
-      --iterations=${laps} --threads=1 --tune=base -define gcc_dir=${llvm_path} --output_format=csv \
-      --noreportable speedint
+    out_file="$base_dir/$next_run/spec17.$mode.csv"
 
-    # Find the latest csv file in spec17 directory under result
-    csv_file=$(ls -1t "$spec17_dir/result/"*intspeed*.csv | head -n 1)
-
-    if [ "$size" == "ref" ]; then
-	grep "refspeed(ref)" "$csv_file" > "$base_dir/$next_run/spec17.$mode.csv"
+    if [ "$adaptive" == "1" ]; then
+        runs=$max_iterations
+        iterations=1
     else
-	grep "${size} iteration" "$csv_file" > "$base_dir/$next_run/spec17.$mode.csv"
+        runs=1
+        iterations=$laps
     fi
+
+    > "$out_file"
+    for run in $(seq 1 $runs); do
+        # Run the spec17 benchmark
+        taskset -c $SERVER_CPUS runcpu --action=run --config=$mode --size=$size --label=$mode \
+          --iterations=${iterations} --threads=1 --tune=base -define gcc_dir=${llvm_path} --output_format=csv \
+          --noreportable speedint
+
+        # Find the latest csv file in spec17 directory under result
+        csv_file=$(ls -1t "$spec17_dir/result/"*intspeed*.csv | head -n 1)
+
+        if [ "$size" == "ref" ]; then
+            grep "refspeed(ref)" "$csv_file" >> "$out_file"
+        else
+            grep "${size} iteration" "$csv_file" >> "$out_file"
+        fi
+
+        # Stop once every benchmark's ratio (3rd column) is precise enough
+        if [ "$adaptive" == "1" ] && python3 "$SCRIPT_DIR/confidence.py" "$out_file" \
+            --key-col 0 --value-col 2 --target "$ci_target" --min "$min_iterations" > /dev/null; then
+            break
+        fi
+    done
 done
@@ -113,6 +113,10 @@ load_ptw_module_int
 # Compile the monitors
 sidecfi_dir="$SCRIPT_DIR/../benchmarks/cpu-usage/sidecfi"
 sidestack_dir="$SCRIPT_DIR/../benchmarks/cpu-usage/sidestack"
+
+# How the monitors wait for trace data: sleep, spin, adaptive or poll
+monitor_wait="${MONITOR_WAIT:-sleep}"
+
 cd "$sidecfi_dir" || exit
 make clean all
 cd "$sidestack_dir" || exit
@@ -189,6 +193,9 @@ for benchmark in "${int_benchmarks[@]}"; do
                 # Change directory to the new folder and run gen_tp.sh
                 cd "$target_dir"
                 ../../../sidecar/tools/gen_tp.sh "$binary_name"
+
+                # Precompile the typemap so the monitor can mmap it
+                python3 "$SCRIPT_DIR/gen_tpb.py" "$binary_name"
             else
                 echo "No typemap file found for $benchmark in $build_dir/build_base_$mode"
             fi
@@ -242,7 +249,7 @@ for benchmark in "${int_benchmarks[@]}"; do
             fi
 
             #echo "$monitor_cmd"
-            taskset -c 3 $monitor_cmd  > "$monitor_output" &
+            taskset -c 3 $monitor_cmd -w "$monitor_wait" > "$monitor_output" &
             monitor_pid=$!
             sleep 1
 
@@ -274,26 +281,9 @@ for benchmark in "${int_benchmarks[@]}"; do
     echo "$benchmark,$cpu_usage_sidecfi,$cpu_usage_sidestack" >> "$cpu_usage_file"
 done
 
-# Function to calculate geometric mean
+# Function to calculate geometric mean (formatted to 2 decimal places)
 geomean() {
-    nums=("$@")
-    product=1
-    count=${#nums[@]}
-    
-    for num in "${nums[@]}"; do
-        if [[ "$num" =~ ^[0-9]+([.][0-9]+)?$ ]]; then
-            product=$(echo "$product * $num" | bc -l)
-        else
-            echo "Invalid number detected: $num"
-            return 1
-        fi
-    done
-    
-    # Calculate the nth root of the product
-    geomean=$(echo "e(l($product)/$count)" | bc -l)
-    
-    # Format the result to 2 decimal places
-    printf "%.2f" "$geomean"
+    python3 "$SCRIPT_DIR/stats.py" geomean "$@"
 }
 
 # Parse the cpu_usage_file and extract the columns for SideCFI and SideStack
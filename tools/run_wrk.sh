@@ -15,19 +15,49 @@ FILE_SIZE="100KB"
 iterations=10
 duration=60
 
-# Variables for throughput calculation
-total_throughput=0
+# Adaptive mode (ADAPTIVE=1): iterate until the 95% CI of the mean is
+# within CI_TARGET percent, between MIN_ITERATIONS and MAX_ITERATIONS runs
+adaptive=${ADAPTIVE:-0}
+ci_target=${CI_TARGET:-1}
+min_iterations=${MIN_ITERATIONS:-2}
+if [ "$adaptive" == "1" ]; then
+    iterations=${MAX_ITERATIONS:-$iterations}
+fi
+
+# Throughput of each iteration
+samples=$(mktemp)
+
+# Full result of each iteration (errors, latency percentiles and histogram),
+# one JSON line each, next to the samples if they are kept
+latency_out=/dev/null
+if [ -n "$SAMPLES_OUT" ]; then
+    latency_out="${SAMPLES_OUT%.txt}.wrk.jsonl"
+    : > "$latency_out"
+fi
 
 # Run the benchmark and calculate the average throughput
 for i in $(seq 1 $iterations); do
     # Run the workload
-    throughput=$(taskset -c 3-6 $WRK_DIR/wrk -t2 -c4 -d${duration}s --latency https://127.0.0.1:8443/$FILE_SIZE | grep 'Requests/sec' | awk '{print $2}')
-    total_throughput=$(echo "$total_throughput + $throughput" | bc)
+    throughput=$(taskset -c ${CLIENT_CPUS:-3-6} python3 "$SCRIPT_DIR/wrk_driver.py" run \
+        https://127.0.0.1:8443/$FILE_SIZE --wrk $WRK_DIR/wrk --threads 2 --connections 4 \
+        --duration $duration --json-out "$latency_out")
+    echo "$throughput" >> "$samples"
+
+    # Stop once the mean is precise enough
+    if [ "$adaptive" == "1" ] && python3 "$SCRIPT_DIR/confidence.py" "$samples" \
+        --target "$ci_target" --min "$min_iterations" > /dev/null; then
+        break
+    fi
 done
 
-# Calculate the average throughput
-average_throughput=$(echo "scale=2; $total_throughput / $iterations" | bc)
+# Calculate the average throughput and its relative CI
+read -r runs average_throughput ci <<< "$(python3 "$SCRIPT_DIR/confidence.py" "$samples")"
 
-# Output the results
-echo $average_throughput
+# Keep the raw samples for the results store if asked to
+if [ -n "$SAMPLES_OUT" ]; then
+    cp "$samples" "$SAMPLES_OUT"
+fi
+rm -f "$samples"
 
+# Output the results
+echo "$average_throughput $ci"
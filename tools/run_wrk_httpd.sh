@@ -2,54 +2,96 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)"
 
-# Define the modes
-modes=("lto" "cfi" "fineibt" "sidecfi" "safestack" "sidestack" "asan" "sideasan")
+# Define the modes (MODES overrides them, e.g. when run_fig9.py splits them into jobs)
+read -r -a modes <<< "${MODES:-lto cfi fineibt sidecfi safestack sidestack asan sideasan}"
 
-# Initialize variable to save lto throughput
-lto_throughput=0
+# CPUs of the server and of the load generator
+SERVER_CPUS=${SERVER_CPUS:-0}
+CLIENT_CPUS=${CLIENT_CPUS:-3}
+
+# Initialize variable to save lto throughput (LTO_THROUGHPUT when lto is run elsewhere)
+lto_throughput=${LTO_THROUGHPUT:-0}
 throughput=0
 
 # Set this variable to "wrk" to use run_wrk.sh, or "rand" to use random values
 #throughput_source="rand"
 throughput_source="wrk"  # or "rand"
 
+# Per-iteration samples go to results/raw/<run>/samples/httpd.<mode>.txt
+samples_app=httpd
+source "$SCRIPT_DIR/samples.sh"
+
+# Open-loop mode (OPEN_LOOP=1): sweep the offered load instead of saturating
+# the server and report the knee of the latency-throughput curve, see
+# open_loop.py
+open_loop=${OPEN_LOOP:-0}
+
 # Function to get the throughput
 get_throughput() {
     MODE="$1"
     
     if [ "$throughput_source" == "wrk" ]; then
+        # A server left over from the previous mode would be measured instead
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp 127.0.0.1:8443 --dead > /dev/null; then
+            echo "Error: 127.0.0.1:8443 is still in use, skipping mode $MODE." >&2
+            echo "0 -1"
+            return
+        fi
+
         # Start the server
-        taskset -c 0 ${SCRIPT_DIR}/build_httpd.sh ${MODE} run &> /dev/null
+        started=$(date +%s.%N)
+        taskset -c $SERVER_CPUS ${SCRIPT_DIR}/build_httpd.sh ${MODE} run &> /dev/null
 
-        # Give the server some time to start properly
-        sleep 5
+        # Wait until it answers, keeping how long it took to start
+        ready=1
+        python3 "$SCRIPT_DIR/readiness.py" http https://127.0.0.1:8443/ --since "$started" >> "$(samples_file "$MODE" startup.txt)" || ready=0
 
-        # Capture the output of run_wrk.sh
-        avg_throughput=$(taskset -c 3 bash "${SCRIPT_DIR}/run_wrk.sh" | tail -n 1)
+        if [ "$ready" == "0" ]; then
+            # Nothing to benchmark, the mode fails
+            echo "Error: httpd did not start in mode $MODE." >&2
+            avg_throughput=0
+            ci=-1
+        elif [ "$open_loop" == "1" ]; then
+            # Sweep the offered load, the knee is the throughput of the mode
+            avg_throughput=$(taskset -c $CLIENT_CPUS python3 "$SCRIPT_DIR/open_loop.py" httpd "$(samples_file "$MODE" openloop.csv)")
+            ci=-1
+        else
+            # Capture the output of run_wrk.sh (ADAPTIVE=1 is passed on to it)
+            read -r avg_throughput ci <<< "$(SAMPLES_OUT=$(samples_file "$MODE") taskset -c $CLIENT_CPUS bash "${SCRIPT_DIR}/run_wrk.sh" | tail -n 1)"
+        fi
 
         # Stop the server
         ${SCRIPT_DIR}/build_httpd.sh ${MODE} stop &> /dev/null
 
-        # Give some time for the server to stop cleanly
-        sleep 2
+        # Wait until it stopped answering
+        if ! python3 "$SCRIPT_DIR/readiness.py" tcp 127.0.0.1:8443 --dead > /dev/null; then
+            echo "Error: httpd did not stop after mode $MODE." >&2
+        fi
     elif [ "$throughput_source" == "rand" ]; then
         # Generate a random throughput value between 300 and 499
         avg_throughput=$(od -An -N2 -i /dev/urandom | tr -d ' \n' | awk -v min=300 -v max=499 '{print int(min + ($1 % (max-min+1)))}')
+        ci=-1
     fi
-    echo "$avg_throughput"
+    echo "$avg_throughput $ci"
 }
 
 # Loop through each mode and print the mode and throughput in CSV format
 for mode in "${modes[@]}"; do
     if [ "$mode" == "lto" ]; then
         # Run the workload for lto mode and save its throughput
-        lto_throughput=$(get_throughput "$mode")
+        read -r lto_throughput lto_ci <<< "$(get_throughput "$mode")"
+
+        # Report the raw lto throughput for runs of the other modes
+        if [ "${PRINT_LTO:-0}" == "1" ]; then
+            echo "lto,$lto_throughput,$lto_ci"
+        fi
     else
         if [ "$mode" == "fineibt" ]; then
             throughput=0
+            ci=-1
         else
             # Run the workload for the current mode and get its throughput
-	    current_throughput=$(get_throughput "$mode")
+	    read -r current_throughput ci <<< "$(get_throughput "$mode")"
             # Calculate throughput as (current throughput / lto_throughput) * 100
 	    throughput=$(awk -v ct="$current_throughput" -v lt="$lto_throughput" 'BEGIN {perf=int(ct / lt * 100); if (perf > 100) perf = 100; print perf}')
         fi
@@ -59,7 +101,8 @@ for mode in "${modes[@]}"; do
             throughput=-1
         fi
 
-        echo "$mode,$throughput"
+        # Followed by the relative 95% CI of the throughput of the mode, -1 if unknown
+        echo "$mode,$throughput,$ci"
     fi
 done
 
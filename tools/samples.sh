@@ -0,0 +1,21 @@
+#!/bin/bash
+
+# Sourced by the app scripts (run_wrk_httpd.sh, run_wrk_lighttpd.sh,
+# run_memtier_memcached.sh, run_dnsperf_bind.sh) after setting samples_app.
+#
+# samples_file <mode> [<kind>] prints where the results of a mode go:
+# results/raw/<run>/samples/<app>.<mode>.<kind>, kind "txt" (the
+# per-iteration samples) by default, or /dev/null if there is no run yet.
+# The run is RUN_NAME, or the latest RunXXX.
+
+RAW_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" &> /dev/null && pwd)/../results/raw"
+CUR_DIR=${RUN_NAME:-$(ls -1 "$RAW_DIR" 2> /dev/null | grep -E '^Run[0-9]{3}$' | sort | tail -n 1)}
+
+samples_file() {
+    if [ -n "$CUR_DIR" ]; then
+        mkdir -p "$RAW_DIR/$CUR_DIR/samples"
+        echo "$RAW_DIR/$CUR_DIR/samples/$samples_app.$1.${2:-txt}"
+    else
+        echo /dev/null
+    fi
+}
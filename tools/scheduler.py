@@ -0,0 +1,246 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Runs experiment jobs in parallel on disjoint CPU sets.
+#
+# Every job asks for a number of server, client and monitor cores, which are
+# carved out of the CPUs given to the scheduler and handed to the job as
+# taskset lists in SERVER_CPUS, CLIENT_CPUS and MONITOR_CPUS. A job only
+# starts when enough cores are free, none of its ports is bound by a running
+# job, none of its resources (e.g. the ptw driver, a shared SPEC tree) is
+# held by a running job and all of its dependencies finished successfully.
+# Ready jobs start in the order they were added, so put the longest first.
+
+POLL_INTERVAL = 1
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def cpu_list(cpus):
+    return ",".join(str(cpu) for cpu in cpus)
+
+
+def parse_cpu_list(text):
+    # Accepts the taskset format, e.g. "0-3,8,10-11"
+    cpus = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+class Job:
+    def __init__(
+        self,
+        name,
+        cmd,
+        server_cpus=1,
+        client_cpus=0,
+        monitor_cpus=0,
+        ports=(),
+        resources=(),
+        deps=(),
+        env=None,
+        setup=None,
+        check=None,
+    ):
+        self.name = name
+        self.cmd = [str(arg) for arg in cmd]
+        self.server_cpus = server_cpus
+        self.client_cpus = client_cpus
+        self.monitor_cpus = monitor_cpus
+        self.ports = set(ports)
+        self.resources = set(resources)
+        self.deps = list(deps)
+        self.env = dict(env or {})
+
+        # Called as setup(job, dep_jobs) right before the job starts and
+        # returns extra environment variables, e.g. values parsed from the
+        # output of a dependency
+        self.setup = setup
+
+        # Called as check(job) after the job exited with 0 and returns
+        # whether its results are usable; a job whose results are not fails
+        self.check = check
+
+        self.state = PENDING
+        self.returncode = None
+        self.output = ""
+        self.cpus = []
+        self.proc = None
+        self.out_file = None
+        self.start_time = None
+        self.elapsed = 0.0
+
+    def ncpus(self):
+        return self.server_cpus + self.client_cpus + self.monitor_cpus
+
+
+class Scheduler:
+    def __init__(self, cpus, max_jobs=0, on_finish=None):
+        self.cpus = sorted(set(cpus))
+        self.max_jobs = max_jobs
+        self.jobs = {}
+
+        # Called as on_finish(job) whenever a job exits, e.g. to checkpoint
+        self.on_finish = on_finish
+
+    def add(self, job):
+        if job.name in self.jobs:
+            print(f"Error: Duplicate job {job.name}.")
+            sys.exit(1)
+        if job.ncpus() == 0 or job.ncpus() > len(self.cpus):
+            print(
+                f"Error: Job {job.name} needs {job.ncpus()} CPUs, "
+                f"{len(self.cpus)} available."
+            )
+            sys.exit(1)
+        self.jobs[job.name] = job
+        return job
+
+    def mark_done(self, name, output=""):
+        # For jobs that finished in an earlier, interrupted run
+        job = self.jobs[name]
+        job.state = DONE
+        job.returncode = 0
+        job.output = output
+
+    def free_cpus(self):
+        used = set()
+        for job in self.running():
+            used.update(job.cpus)
+        return [cpu for cpu in self.cpus if cpu not in used]
+
+    def running(self):
+        return [job for job in self.jobs.values() if job.state == RUNNING]
+
+    def conflicts(self, job):
+        for other in self.running():
+            if job.ports & other.ports or job.resources & other.resources:
+                return True
+        return False
+
+    def start(self, job, cpus):
+        dep_jobs = [self.jobs[dep] for dep in job.deps]
+
+        # Hand out the cores in order: server, client, then monitor
+        job.cpus = cpus[: job.ncpus()]
+        server = job.cpus[: job.server_cpus]
+        client = job.cpus[job.server_cpus : job.server_cpus + job.client_cpus]
+        monitor = job.cpus[job.server_cpus + job.client_cpus :]
+
+        env = dict(os.environ)
+        env.update(job.env)
+        env["SERVER_CPUS"] = cpu_list(server)
+        if client:
+            env["CLIENT_CPUS"] = cpu_list(client)
+        if monitor:
+            env["MONITOR_CPUS"] = cpu_list(monitor)
+        if job.setup:
+            env.update(job.setup(job, dep_jobs))
+
+        # Buffer the output in a file, a pipe nobody reads would fill up
+        job.out_file = tempfile.TemporaryFile(mode="w+")
+        job.proc = subprocess.Popen(job.cmd, stdout=job.out_file, env=env, text=True)
+        job.state = RUNNING
+        job.start_time = time.time()
+        print(f"[{self.progress()}] Started {job.name} on CPUs {cpu_list(job.cpus)}")
+
+    def reap(self, job):
+        job.returncode = job.proc.poll()
+        if job.returncode is None:
+            return False
+
+        job.elapsed = time.time() - job.start_time
+        job.out_file.seek(0)
+        job.output = job.out_file.read()
+        job.out_file.close()
+        job.out_file = None
+        job.proc = None
+
+        ok = job.returncode == 0 and (job.check is None or job.check(job))
+        job.state = DONE if ok else FAILED
+        status = "Finished" if job.state == DONE else "Failed"
+        print(f"[{self.progress()}] {status} {job.name} in {job.elapsed:.0f}s")
+
+        if self.on_finish:
+            self.on_finish(job)
+        return True
+
+    def progress(self):
+        finished = sum(
+            1 for job in self.jobs.values() if job.state in (DONE, FAILED, SKIPPED)
+        )
+        return f"{finished}/{len(self.jobs)}"
+
+    def ready(self, job):
+        for dep in job.deps:
+            state = self.jobs[dep].state
+            if state in (FAILED, SKIPPED):
+                job.state = SKIPPED
+                print(f"[{self.progress()}] Skipped {job.name}, {dep} did not finish")
+                return False
+            if state != DONE:
+                return False
+        return True
+
+    def schedule(self):
+        # Returns whether any job changed state
+        changed = False
+        for job in self.jobs.values():
+            if job.state != PENDING:
+                continue
+            if not self.ready(job):
+                changed |= job.state == SKIPPED
+                continue
+            if self.max_jobs and len(self.running()) >= self.max_jobs:
+                break
+
+            free = self.free_cpus()
+            if len(free) < job.ncpus() or self.conflicts(job):
+                continue
+            self.start(job, free)
+            changed = True
+        return changed
+
+    def run(self):
+        for job in self.jobs.values():
+            for dep in job.deps:
+                if dep not in self.jobs:
+                    print(f"Error: Job {job.name} depends on unknown job {dep}.")
+                    sys.exit(1)
+
+        start_time = time.time()
+        while True:
+            for job in self.running():
+                self.reap(job)
+
+            # Skipping a job can make its own dependents skippable
+            while self.schedule() and not self.running():
+                pass
+
+            if not self.running():
+                pending = [j.name for j in self.jobs.values() if j.state == PENDING]
+                if pending:
+                    # Nothing runs and nothing can start: a dependency cycle
+                    print(f"Error: Cannot schedule {', '.join(pending)}.")
+                    sys.exit(1)
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+        print(f"All jobs done in {time.time() - start_time:.0f}s ({self.progress()})")
+        return all(job.state == DONE for job in self.jobs.values())
@@ -0,0 +1,284 @@
+import argparse
+import itertools
+import math
+import sys
+import warnings
+
+import numpy as np
+
+# Statistics shared by the figures and tables.
+#
+# Results are a (benchmark x mode x iteration) array, NaN where a benchmark
+# has fewer iterations in a mode or did not run at all. Every function works
+# on the whole array at once:
+#   sample_stats()          mean, standard deviation and count per cell
+#   relative_performance()  baseline mean / mode mean * 100 with the error of
+#                           the ratio propagated from both standard deviations
+#   geomean()               geomean per mode over the benchmarks in range,
+#                           minus an optional exclusion mask (e.g. the
+#                           benchmarks SafeStack cannot run for *geomean)
+#   bootstrap_ci()          percentile CIs of the relative performance and of
+#                           the geomeans, resampling the iterations
+#   summarize()             all of the above in one call
+#   outliers()              runs to leave out of a series of samples
+#   relative_ci()           Student's t 95% CI half-width of the mean, in
+#                           percent of the mean (confidence.py, run_fig9.py)
+#   bootstrap_pvalue()      two-sample tests of whether two runs differ
+#   mannwhitney_pvalue()    (compare_runs.py)
+
+BOOTSTRAP_SAMPLES = 1000
+CI_LEVEL = 95
+
+# Two-sided 95% quantiles of Student's t for 1..30 degrees of freedom
+T_975 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]  # fmt: skip
+Z_975 = 1.96
+
+# Reported when there are too few samples for an interval
+NO_CI = -1.0
+
+# Resamples behind bootstrap_pvalue()
+PVALUE_BOOTSTRAP_SAMPLES = 2000
+
+# Exact Mann-Whitney p-values up to this many rank permutations, normal
+# approximation above
+MWU_EXACT_LIMIT = 20000
+
+# Samples further than this many (normal-scaled) median absolute deviations
+# from the median are outliers, and at least this many samples are needed to
+# tell
+OUTLIER_MADS = 3.5
+OUTLIER_MIN_SAMPLES = 3
+
+# Relative performance outside (GEOMEAN_MIN, GEOMEAN_MAX] is left out of
+# geomeans: failed runs (-1, 0) and noise above the baseline
+GEOMEAN_MIN = 0
+GEOMEAN_MAX = 100
+
+
+def to_array(samples, benchmarks, modes):
+    # {mode: {benchmark: [values]}} -> (benchmark x mode x iteration) array
+    iterations = max(
+        (len(values) for per_mode in samples.values() for values in per_mode.values()),
+        default=0,
+    )
+    data = np.full((len(benchmarks), len(modes), max(iterations, 1)), np.nan)
+    for m, mode in enumerate(modes):
+        for b, benchmark in enumerate(benchmarks):
+            values = samples.get(mode, {}).get(benchmark, [])
+            data[b, m, : len(values)] = values
+    return data
+
+
+def sample_stats(data):
+    # Population standard deviation, as np.std() gave the figures before
+    n = np.sum(~np.isnan(data), axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(data, axis=-1) / n
+        std = np.sqrt(np.nansum((data - mean[..., None]) ** 2, axis=-1) / n)
+    return mean, std, n
+
+
+def ratio(base_mean, base_std, mean, std):
+    # base / mode * 100 and its first-order propagated error
+    with np.errstate(invalid="ignore", divide="ignore"):
+        perf = base_mean / mean * 100
+        err = np.abs(perf) * np.sqrt((base_std / base_mean) ** 2 + (std / mean) ** 2)
+    invalid = ~np.isfinite(perf) | (mean == 0)
+    return np.where(invalid, np.nan, perf), np.where(invalid, np.nan, err)
+
+
+def relative_performance(data, baseline=0):
+    # Performance of every mode relative to the baseline mode, in percent
+    mean, std, _ = sample_stats(data)
+    return ratio(mean[:, baseline, None], std[:, baseline, None], mean, std)
+
+
+def geomean(values, exclude=None, low=GEOMEAN_MIN, high=GEOMEAN_MAX):
+    # Geomean over the first axis (benchmarks), 0.0 where nothing is left
+    valid = np.isfinite(values) & (values > low) & (values <= high)
+    if exclude is not None:
+        valid &= ~exclude
+
+    logs = np.where(valid, np.log(np.where(valid, values, 1)), 0)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = np.exp(logs.sum(axis=0) / count)
+    return np.where(count > 0, result, 0.0)
+
+
+def bootstrap_ci(
+    data, baseline=0, excludes=None, samples=BOOTSTRAP_SAMPLES, level=CI_LEVEL, seed=0
+):
+    # Resample the iterations of every (benchmark, mode) with replacement.
+    # excludes maps a name to the exclusion mask of one geomean, so that
+    # several geomean rules share the same resamples.
+    excludes = excludes or {"geomean": None}
+    rng = np.random.default_rng(seed)
+
+    # Move the valid samples of each cell first (np.sort puts NaN last) so
+    # that drawing an index below the cell's count picks a valid one
+    data = np.sort(data, axis=-1)
+    n = np.sum(~np.isnan(data), axis=-1)
+    draws = rng.random((samples,) + data.shape)
+    idx = np.minimum((draws * n[..., None]).astype(int), data.shape[-1] - 1)
+    resampled = np.take_along_axis(data[None], idx, axis=-1)
+
+    # Cells without samples stay NaN
+    resampled[:, n == 0] = np.nan
+
+    mean, std, _ = sample_stats(resampled)
+    perf, _ = ratio(mean[:, :, baseline, None], std[:, :, baseline, None], mean, std)
+
+    tail = (100 - level) / 2
+    with warnings.catch_warnings():
+        # Benchmarks that did not run in a mode have no CI
+        warnings.simplefilter("ignore", RuntimeWarning)
+        perf_ci = np.nanpercentile(perf, [tail, 100 - tail], axis=0)
+
+    geomean_ci = {}
+    for name, exclude in excludes.items():
+        geo = np.stack([geomean(p, exclude) for p in perf])
+        geomean_ci[name] = np.percentile(geo, [tail, 100 - tail], axis=0)
+    return perf_ci, geomean_ci
+
+
+def outliers(values, threshold=OUTLIER_MADS):
+    # Mask of the failed (missing, zero or negative) samples and of the ones
+    # far from the median of the others
+    values = np.asarray(values, dtype=float)
+    bad = ~np.isfinite(values) | (values <= 0)
+    good = values[~bad]
+    if len(good) < OUTLIER_MIN_SAMPLES:
+        return bad
+
+    median = np.median(good)
+    mad = np.median(np.abs(good - median)) * 1.4826
+    if mad == 0:
+        return bad
+    with np.errstate(invalid="ignore"):
+        far = np.abs(values - median) / mad > threshold
+    return bad | far
+
+
+def relative_ci(data):
+    # Half-width of the 95% CI of the mean over the last axis (the
+    # iterations), in percent of the mean, NO_CI with fewer than two samples
+    mean, std, n = sample_stats(np.asarray(data, dtype=float))
+    dof = np.maximum(n - 1, 1)
+    t = np.take(T_975 + [Z_975], np.minimum(dof, len(T_975) + 1) - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # std is the population one, std / sqrt(n - 1) the standard error
+        width = t * std / np.sqrt(dof) / np.abs(mean) * 100
+    return np.where(
+        (n >= 2) & (mean != 0) & np.isfinite(width), np.round(width, 2), NO_CI
+    )
+
+
+def bootstrap_pvalue(base, other, samples=PVALUE_BOOTSTRAP_SAMPLES, seed=0):
+    # Two-sided p-value of "the means differ", from resampling both runs
+    rng = np.random.default_rng(seed)
+    base_means = rng.choice(base, (samples, len(base))).mean(axis=1)
+    other_means = rng.choice(other, (samples, len(other))).mean(axis=1)
+    diff = other_means - base_means
+    tail = min(np.mean(diff <= 0), np.mean(diff >= 0))
+    return min(1.0, 2 * tail)
+
+
+def mannwhitney_pvalue(base, other):
+    # Two-sided Mann-Whitney U test on the ranks of both runs
+    n1, n2 = len(base), len(other)
+    values = np.concatenate([base, other])
+    order = values.argsort()
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+
+    # Average ranks of ties
+    for value in np.unique(values):
+        tied = values == value
+        ranks[tied] = ranks[tied].mean()
+
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    mean_u = n1 * n2 / 2
+
+    if math.comb(n1 + n2, n1) <= MWU_EXACT_LIMIT:
+        # Exact: U of every way to pick the ranks of the base run
+        us = np.array(
+            [
+                sum(ranks[list(idx)]) - n1 * (n1 + 1) / 2
+                for idx in itertools.combinations(range(n1 + n2), n1)
+            ]
+        )
+        return min(1.0, np.mean(np.abs(us - mean_u) >= abs(u - mean_u) - 1e-9))
+
+    _, counts = np.unique(values, return_counts=True)
+    n = n1 + n2
+    var_u = n1 * n2 / 12 * ((n + 1) - np.sum(counts**3 - counts) / (n * (n - 1)))
+    if var_u == 0:
+        return 1.0
+    z = (abs(u - mean_u) - 0.5) / math.sqrt(var_u)
+    return min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def mannwhitney_min_pvalue(n1, n2):
+    # Smallest two-sided p-value the exact test can give for these sizes,
+    # e.g. 0.1 for 3 laps against 3
+    return min(1.0, 2 / math.comb(n1 + n2, n1))
+
+
+def relative_half_width(ci, value):
+    # Half-width of a (low, high) CI in percent of the value, -1 if unknown
+    with np.errstate(invalid="ignore", divide="ignore"):
+        width = (ci[1] - ci[0]) / 2 / np.abs(value) * 100
+    return np.where(np.isfinite(width) & (value != 0), width, -1.0)
+
+
+def summarize(data, baseline=0, excludes=None, bootstrap=BOOTSTRAP_SAMPLES):
+    excludes = excludes or {"geomean": None}
+    mean, std, n = sample_stats(data)
+    perf, err = relative_performance(data, baseline)
+    summary = {
+        "mean": mean,
+        "std": std,
+        "n": n,
+        "perf": perf,
+        "err": err,
+        "geomean": {name: geomean(perf, exclude) for name, exclude in excludes.items()},
+    }
+    if bootstrap:
+        summary["perf_ci"], summary["geomean_ci"] = bootstrap_ci(
+            data, baseline, excludes, bootstrap
+        )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics for the shell scripts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    geomean_parser = subparsers.add_parser("geomean", help="geomean of the values")
+    geomean_parser.add_argument("values", nargs="+", type=float)
+    geomean_parser.add_argument(
+        "--max",
+        type=float,
+        default=np.inf,
+        help="leave out values above this (default: none)",
+    )
+
+    args = parser.parse_args()
+    values = np.array(args.values)
+    if not np.all(np.isfinite(values) & (values > 0)):
+        # On stderr, so that $(geomean ...) stays empty for the caller
+        print(
+            "Invalid number detected: values must be finite and positive",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    print(f"{geomean(values, high=args.max):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Runs one wrk iteration with a Lua done() reporter and keeps the whole
+# result instead of the Requests/sec line: throughput, error counts, latency
+# percentiles and the full latency histogram.
+#
+# "run" prints the requests/s of the iteration (what run_wrk.sh averages)
+# and, with --json-out, appends the result as one JSON line:
+#   {"duration_us": ..., "requests": ..., "bytes": ..., "requests_per_sec": ...,
+#    "errors": {"connect": ..., "read": ..., "write": ..., "status": ...,
+#               "timeout": ...},
+#    "latency_us": {"min": ..., "max": ..., "mean": ..., "stdev": ...,
+#                   "p50": ..., "p90": ..., "p99": ..., "p99.9": ...},
+#    "histogram": [[latency_us, count], ...]}
+# "hgrm" turns a line of that file into an HdrHistogram percentile
+# distribution (.hgrm) that the HdrHistogram plotters read.
+#
+# Usage: python3 wrk_driver.py run <url> [--duration S] [--json-out FILE]
+#        python3 wrk_driver.py hgrm <file.jsonl> <iteration> <out.hgrm>
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+WRK_PATH = Path(script_dir) / "../install/tools/wrk"
+
+JSON_PREFIX = "WRK_JSON "
+PERCENTILES = [50, 90, 99, 99.9]
+
+# wrk's stats objects: latency(i) gives the value and count of the i-th
+# distinct latency and #latency how many there are
+REPORTER_TEMPLATE = """
+done = function(summary, latency, requests)
+    local e = summary.errors
+    local parts = {
+        string.format('"duration_us":%d', summary.duration),
+        string.format('"requests":%d', summary.requests),
+        string.format('"bytes":%d', summary.bytes),
+        string.format('"errors":{"connect":%d,"read":%d,"write":%d,'
+            .. '"status":%d,"timeout":%d}',
+            e.connect, e.read, e.write, e.status, e.timeout),
+    }
+
+    local lat = string.format('"min":%d,"max":%d,"mean":%.2f,"stdev":%.2f',
+        latency.min, latency.max, latency.mean, latency.stdev)
+    for _, p in ipairs({@PERCENTILES@}) do
+        lat = lat .. string.format(',"p%s":%d', p, latency:percentile(p))
+    end
+    parts[#parts + 1] = '"latency_us":{' .. lat .. '}'
+
+    local hist = {}
+    for i = 1, #latency do
+        local value, count = latency(i)
+        hist[#hist + 1] = string.format("[%d,%d]", value, count)
+    end
+    parts[#parts + 1] = '"histogram":[' .. table.concat(hist, ",") .. ']'
+
+    io.write("@PREFIX@{" .. table.concat(parts, ",") .. "}\\n")
+end
+"""
+REPORTER = REPORTER_TEMPLATE.replace(
+    "@PERCENTILES@", ", ".join(str(p) for p in PERCENTILES)
+).replace("@PREFIX@", JSON_PREFIX)
+
+# Constant-rate runs with stock wrk, which only has delay(). Each thread
+# keeps a schedule of send times threads * 1000 / rate ms apart and every
+# request of its connections takes the next one, so time spent waiting for
+# a response does not lower the rate. A request sent late still has its
+# latency counted from when it was sent; wrk2 (-R) counts it from the
+# schedule.
+SCHEDULE_TEMPLATE = """
+local ffi = require("ffi")
+ffi.cdef[[
+typedef struct { long tv_sec; long tv_nsec; } wrk_timespec;
+int clock_gettime(int clock, wrk_timespec *ts);
+]]
+local ts = ffi.new("wrk_timespec")
+local interval_ms = @INTERVAL@
+local next_send = nil
+
+local function now_ms()
+    ffi.C.clock_gettime(1, ts)
+    return tonumber(ts.tv_sec) * 1000 + tonumber(ts.tv_nsec) / 1e6
+end
+
+delay = function()
+    local now = now_ms()
+    local send = next_send or now
+    next_send = send + interval_ms
+    return math.max(0, math.floor(send - now))
+end
+"""
+
+
+def run_wrk(
+    url, duration=60, threads=2, connections=4, wrk=WRK_PATH, rate=0, wrk2=False
+):
+    # rate is the total requests/s to send, 0 for as fast as possible; with
+    # wrk2 the wrk binary is wrk2
+    args = [f"-t{threads}", f"-c{connections}", f"-d{duration}s", "--latency"]
+    with tempfile.NamedTemporaryFile("w", suffix=".lua") as script:
+        script.write(REPORTER)
+        if rate and wrk2:
+            args.append(f"-R{max(1, round(rate))}")
+        elif rate:
+            interval_ms = threads * 1000 / rate
+            schedule = SCHEDULE_TEMPLATE.replace("@INTERVAL@", f"{interval_ms:.6f}")
+            script.write(schedule)
+        script.flush()
+
+        result = subprocess.run(
+            [str(wrk)] + args + ["-s", script.name, url],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+
+    for line in result.stdout.splitlines():
+        if line.startswith(JSON_PREFIX):
+            data = json.loads(line[len(JSON_PREFIX) :])
+            break
+    else:
+        return None
+
+    data["requests_per_sec"] = round(data["requests"] / (data["duration_us"] / 1e6), 2)
+    data["errors"]["total"] = sum(data["errors"].values())
+    return data
+
+
+def write_hgrm(data, path, scale=1000.0):
+    # Percentile distribution in milliseconds, in the layout of
+    # HdrHistogram's outputPercentileDistribution()
+    histogram = data["histogram"]
+    total = sum(count for _, count in histogram)
+
+    with open(path, "w") as f:
+        f.write(f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} ")
+        f.write(f"{'1/(1-Percentile)':>14}\n\n")
+
+        seen = 0
+        for value, count in histogram:
+            seen += count
+            percentile = seen / total
+            line = f"{value / scale:12.3f} {percentile:14.12f} {seen:10d}"
+            if percentile < 1:
+                line += f" {1 / (1 - percentile):14.2f}"
+            f.write(line + "\n")
+
+        latency = data["latency_us"]
+        f.write(
+            f"#[Mean    = {latency['mean'] / scale:12.3f}, "
+            f"StdDeviation   = {latency['stdev'] / scale:12.3f}]\n"
+        )
+        f.write(
+            f"#[Max     = {latency['max'] / scale:12.3f}, "
+            f"Total count    = {total:12d}]\n"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wrk with full latency results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run one wrk iteration")
+    run_parser.add_argument("url")
+    run_parser.add_argument("--duration", type=int, default=60, help="seconds")
+    run_parser.add_argument("--threads", type=int, default=2)
+    run_parser.add_argument("--connections", type=int, default=4)
+    run_parser.add_argument("--wrk", default=WRK_PATH, help="wrk binary")
+    run_parser.add_argument("--json-out", help="append the result to this file")
+
+    hgrm_parser = subparsers.add_parser("hgrm", help="export a histogram")
+    hgrm_parser.add_argument("results", help="JSON lines written by run")
+    hgrm_parser.add_argument("iteration", type=int, help="line to export, from 1")
+    hgrm_parser.add_argument("out", help=".hgrm file to write")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        data = run_wrk(
+            args.url, args.duration, args.threads, args.connections, args.wrk
+        )
+        if data is None:
+            print("Error: wrk did not report any results.", file=sys.stderr)
+            sys.exit(1)
+
+        if args.json_out:
+            with open(args.json_out, "a") as f:
+                f.write(json.dumps(data) + "\n")
+        print(data["requests_per_sec"])
+    else:
+        with open(args.results, "r") as f:
+            lines = f.read().splitlines()
+        if not 1 <= args.iteration <= len(lines):
+            print(f"Error: {args.results} has {len(lines)} iterations.")
+            sys.exit(1)
+        write_hgrm(json.loads(lines[args.iteration - 1]), args.out)
+
+
+if __name__ == "__main__":
+    main()